@@ -10,9 +10,23 @@ python manage.py collectstatic --noinput
 
 # Start server
 #gunicorn inriver_qr.wsgi:application --bind 0.0.0.0:8000 --timeout 300
+# WEB_SERVER=asgi: uvicorn workers with the scan fast lane of inriver_qr/asgi.py
+if [ "${WEB_SERVER:-wsgi}" = "asgi" ]; then
+  exec gunicorn inriver_qr.asgi:application \
+    --worker-class uvicorn.workers.UvicornWorker \
+    --bind 0.0.0.0:8000 \
+    --timeout 300 \
+    --workers "${GUNICORN_WORKERS:-1}" \
+    --access-logfile /app/logs/access.log \
+    --error-logfile /app/logs/error.log \
+    --log-level info
+fi
+
 gunicorn inriver_qr.wsgi:application \
   --bind 0.0.0.0:8000 \
   --timeout 300 \
+  --workers "${GUNICORN_WORKERS:-1}" \
+  --threads "${GUNICORN_THREADS:-8}" \
   --access-logfile /app/logs/access.log \
   --error-logfile /app/logs/error.log \
   --log-level info
\ No newline at end of file
@@ -3,14 +3,85 @@ ASGI config for inriver_qr project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Scans of printed QR codes (GET/HEAD /01/<barcode>, with or without the
+trailing slash) are answered by a fast lane in front of Django: the
+barcode is resolved through products.redirect_cache and a bare 302 is sent,
+without the middleware stack (sessions, CSRF, auth, messages, CORS,
+whitenoise). Everything else, and barcodes without a product, go to the
+regular Django application, so redirect_by_barcode still renders the 404.
+
+Run with an ASGI server, e.g. (see entrypoint.sh, WEB_SERVER=asgi):
+
+    gunicorn inriver_qr.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
+import re
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'inriver_qr.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from asgiref.sync import sync_to_async  # noqa: E402
+from django.db import close_old_connections  # noqa: E402
+from django.utils.encoding import iri_to_uri  # noqa: E402
+
+from django.conf import settings  # noqa: E402
+
+from products.redirect_cache import cached_redirect, resolve_redirect  # noqa: E402
+from products.scan_events import record_scan  # noqa: E402
+
+SCAN_PATH = re.compile(r"^/01/([^/]+)/?$")
+
+
+def _resolve(barcode):
+    # Runs on Django's thread for sync code (thread_sensitive), whose connection the
+    # request signals manage; the fast lane sends none, so check it like request_started
+    close_old_connections()
+    return resolve_redirect(barcode)
+
+
+async def scan_fast_lane(scope, receive, send):
+    """Answer a scan with a 302, or return False to let Django handle the request."""
+    match = SCAN_PATH.match(scope["path"])
+    if not match or scope["method"] not in ("GET", "HEAD"):
+        return False
+
+    # Same lookup key as redirect_by_barcode: the path segment without its first digit
+    barcode = match.group(1)[1:]
+    target = cached_redirect(barcode)
+    if target is None:
+        # Not in this process's LRU: shared cache or database, off the event loop
+        target = await sync_to_async(_resolve)(barcode)
+    if not target:
+        return False
+
+    headers = dict(scope.get("headers") or [])
+    country_header = settings.SCAN_COUNTRY_HEADER.lower().encode("latin-1")
+    record_scan(
+        match.group(1),
+        headers.get(b"user-agent", b"").decode("latin-1"),
+        headers.get(country_header, b"").decode("latin-1"),
+    )
+    await send({
+        "type": "http.response.start",
+        "status": 302,
+        "headers": [
+            (b"location", iri_to_uri(target).encode("latin-1")),
+            (b"content-length", b"0"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": b""})
+    return True
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and await scan_fast_lane(scope, receive, send):
+        return
+    await django_application(scope, receive, send)
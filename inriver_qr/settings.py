@@ -224,6 +224,161 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 
 
+# QR rendering
+# Number of processes used to render QR codes in parallel (1 = render in-process)
+QR_RENDER_WORKERS = int(os.environ.get('QR_RENDER_WORKERS', os.cpu_count() or 1))
+# How many QR codes are rendered before their files are uploaded
+QR_RENDER_BATCH_SIZE = int(os.environ.get('QR_RENDER_BATCH_SIZE', 200))
+# File formats generated for every QR code: png, eps, svg
+QR_FORMATS = os.environ.get('QR_FORMATS', 'png,eps').split(',')
+# Decode every rendered PNG in memory and fail the item if it does not match its payload
+QR_VERIFY_DECODE = os.environ.get('QR_VERIFY_DECODE', 'False') == 'True'
+# Unchanged QR codes are skipped when the QRAsset manifest has their files with the same hash;
+# True checks the qr-hash metadata on S3 (a HEAD per product) instead
+QR_SKIP_VERIFY_REMOTE = os.environ.get('QR_SKIP_VERIFY_REMOTE', 'False') == 'True'
+QR_SKIP_VERIFY_WORKERS = int(os.environ.get('QR_SKIP_VERIFY_WORKERS', 16))
+# Parallel downloads when sync_qrcodes --decode reads the PNGs
+SYNC_DECODE_WORKERS = int(os.environ.get('SYNC_DECODE_WORKERS', 16))
+
+# S3 uploads
+# Connections kept open to S3, at least S3_UPLOAD_WORKERS
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 64))
+# botocore retries for throttling and 5xx responses
+S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 5))
+# PUT requests in flight at the same time
+S3_UPLOAD_WORKERS = int(os.environ.get('S3_UPLOAD_WORKERS', 32))
+# Products whose uploads may be pending before generation waits for them
+S3_UPLOAD_WINDOW = int(os.environ.get('S3_UPLOAD_WINDOW', 128))
+# Attempts per object, with exponential backoff starting at S3_UPLOAD_BACKOFF seconds
+S3_UPLOAD_ATTEMPTS = int(os.environ.get('S3_UPLOAD_ATTEMPTS', 3))
+S3_UPLOAD_BACKOFF = float(os.environ.get('S3_UPLOAD_BACKOFF', 0.5))
+# delete_objects calls (1,000 keys each) in flight when QR codes are purged
+S3_DELETE_WORKERS = int(os.environ.get('S3_DELETE_WORKERS', 8))
+QR_CACHE_CONTROL = os.environ.get('QR_CACHE_CONTROL', 'public, max-age=86400')
+# Objects downloaded ahead while a ZIP of all QR codes is streamed
+ZIP_PREFETCH_OBJECTS = int(os.environ.get('ZIP_PREFETCH_OBJECTS', 16))
+
+# Pre-built ZIP of all QR codes, updated when codes are generated or deleted
+QR_BUNDLE_ENABLED = os.environ.get('QR_BUNDLE_ENABLED', 'True') == 'True'
+QR_BUNDLE_PATH = os.environ.get('QR_BUNDLE_PATH', os.path.join(MEDIA_ROOT, 'qr_bundle', 'qr_codes.zip'))
+# Also keep a copy in S3 (key outside S3_FOLDER) and serve it with a presigned URL
+QR_BUNDLE_S3_KEY = os.environ.get('QR_BUNDLE_S3_KEY', '')
+QR_BUNDLE_URL_EXPIRES = int(os.environ.get('QR_BUNDLE_URL_EXPIRES', 3600))
+# Seconds during which a queued full rebuild of the archive is not queued again
+QR_BUNDLE_BUILD_LOCK = int(os.environ.get('QR_BUNDLE_BUILD_LOCK', 30 * 60))
+
+# Pages of the QR code list API (get_all_generated_qr_codes)
+QR_LIST_PAGE_SIZE = int(os.environ.get('QR_LIST_PAGE_SIZE', 100))
+QR_LIST_MAX_PAGE_SIZE = int(os.environ.get('QR_LIST_MAX_PAGE_SIZE', 1000))
+QR_LIST_URL_EXPIRES = int(os.environ.get('QR_LIST_URL_EXPIRES', 3600))
+
+# Products per infinite scroll request (product_rows)
+PRODUCT_ROWS_PAGE_SIZE = int(os.environ.get('PRODUCT_ROWS_PAGE_SIZE', 50))
+
+# Cache, shared by the web and worker containers when CACHE_REDIS_URL is set
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Scan redirects: per-process LRU (entries, seconds) in front of the shared cache (seconds)
+REDIRECT_LOCAL_CACHE_SIZE = int(os.environ.get('REDIRECT_LOCAL_CACHE_SIZE', 10000))
+REDIRECT_LOCAL_CACHE_TTL = int(os.environ.get('REDIRECT_LOCAL_CACHE_TTL', 30))
+REDIRECT_CACHE_TTL = int(os.environ.get('REDIRECT_CACHE_TTL', 60 * 60))
+
+# Static redirect map for the edge (redirect_map.py), exported after imports and generation
+REDIRECT_MAP_ENABLED = os.environ.get('REDIRECT_MAP_ENABLED', 'False') == 'True'
+REDIRECT_MAP_DIR = os.environ.get('REDIRECT_MAP_DIR', os.path.join(MEDIA_ROOT, 'redirect_map'))
+# Bucket served as an S3 website that gets one redirect object per barcode, empty to skip
+REDIRECT_MAP_S3_BUCKET = os.environ.get('REDIRECT_MAP_S3_BUCKET', '')
+REDIRECT_MAP_S3_PREFIX = os.environ.get('REDIRECT_MAP_S3_PREFIX', '01/')
+# Seconds an export stays queued before another one may be enqueued
+REDIRECT_MAP_EXPORT_LOCK = int(os.environ.get('REDIRECT_MAP_EXPORT_LOCK', 10 * 60))
+
+# Scan analytics: events buffered per process and bulk inserted by a background thread;
+# at most SCAN_BUFFER_SIZE wait, further scans are dropped (and counted)
+SCAN_EVENTS_ENABLED = os.environ.get('SCAN_EVENTS_ENABLED', 'True') == 'True'
+SCAN_BUFFER_SIZE = int(os.environ.get('SCAN_BUFFER_SIZE', 10000))
+SCAN_FLUSH_BATCH = int(os.environ.get('SCAN_FLUSH_BATCH', 500))
+SCAN_FLUSH_INTERVAL = float(os.environ.get('SCAN_FLUSH_INTERVAL', 5))
+# Header with the viewer's country, set by CloudFront
+SCAN_COUNTRY_HEADER = os.environ.get('SCAN_COUNTRY_HEADER', 'CloudFront-Viewer-Country')
+# Hours recomputed by every rollup run, and days raw events are kept (0: forever)
+SCAN_ROLLUP_HOURS = int(os.environ.get('SCAN_ROLLUP_HOURS', 2))
+SCAN_EVENT_RETENTION_DAYS = int(os.environ.get('SCAN_EVENT_RETENTION_DAYS', 90))
+
+# Product list and admin search: "prefix" (indexed istartswith) or "contains" (icontains)
+PRODUCT_SEARCH_MODE = os.environ.get('PRODUCT_SEARCH_MODE', 'prefix')
+
+# Task progress: written to QRTaskStatus every N items or N seconds
+PROGRESS_FLUSH_EVERY = int(os.environ.get('PROGRESS_FLUSH_EVERY', 100))
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 5))
+# Seconds between server-sent progress checks and the longest a stream stays open
+PROGRESS_STREAM_INTERVAL = float(os.environ.get('PROGRESS_STREAM_INTERVAL', 0.5))
+PROGRESS_STREAM_TIMEOUT = int(os.environ.get('PROGRESS_STREAM_TIMEOUT', 5 * 60))
+# Streams held open per process, past that clients get one update and reconnect or poll
+PROGRESS_STREAM_MAX_OPEN = int(os.environ.get('PROGRESS_STREAM_MAX_OPEN', 4))
+
+# Background tasks (Celery)
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379/0')
+# Run tasks in-process without a broker, e.g. for tests or a single container
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_TASK_EAGER_PROPAGATES = True
+# Acknowledge after the task ran, so tasks of a killed worker are delivered again
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_WORKER_CONCURRENCY = int(os.environ.get('CELERY_WORKER_CONCURRENCY', 2))
+CELERY_TASK_IGNORE_RESULT = True
+# Periodic tasks, run by "celery -A inriver_qr beat"
+CELERY_BEAT_SCHEDULE = {
+    'rollup-scan-events': {
+        'task': 'products.tasks.rollup_scan_events',
+        'schedule': 15 * 60,
+    },
+}
+# Products per generation task and entity ids per import task
+QR_TASK_CHUNK_SIZE = int(os.environ.get('QR_TASK_CHUNK_SIZE', 500))
+INRIVER_TASK_CHUNK_SIZE = int(os.environ.get('INRIVER_TASK_CHUNK_SIZE', 200))
+# Rows per multi-row INSERT ... UPDATE when products and QR assets are written
+BULK_UPSERT_BATCH_SIZE = int(os.environ.get('BULK_UPSERT_BATCH_SIZE', 500))
+
+# inRiver API client: concurrent requests over one pooled session
+INRIVER_WORKERS = int(os.environ.get('INRIVER_WORKERS', 8))
+# Requests per second over all threads, 0 for no limit
+INRIVER_RATE_LIMIT = float(os.environ.get('INRIVER_RATE_LIMIT', 20))
+INRIVER_MAX_RETRIES = int(os.environ.get('INRIVER_MAX_RETRIES', 5))
+INRIVER_BACKOFF = float(os.environ.get('INRIVER_BACKOFF', 0.5))
+INRIVER_TIMEOUT = float(os.environ.get('INRIVER_TIMEOUT', 30))
+# Entities per entities:fetchdata request; False uses one /fieldvalues request per entity
+INRIVER_FETCH_BATCH_SIZE = int(os.environ.get('INRIVER_FETCH_BATCH_SIZE', 100))
+INRIVER_USE_FETCHDATA = os.environ.get('INRIVER_USE_FETCHDATA', 'True') == 'True'
+# Seconds the incremental sync goes back before the last sync, for clock differences
+INRIVER_SYNC_OVERLAP = int(os.environ.get('INRIVER_SYNC_OVERLAP', 300))
+# Keep the raw field values of every fetched entity (InRiverEntityMirror) and
+# reuse entries younger than INRIVER_MIRROR_MAX_AGE seconds (0: no limit)
+INRIVER_MIRROR_ENABLED = os.environ.get('INRIVER_MIRROR_ENABLED', 'True') == 'True'
+INRIVER_MIRROR_MAX_AGE = int(os.environ.get('INRIVER_MIRROR_MAX_AGE', 7 * 24 * 60 * 60))
+# Items buffered between the stages of the import pipeline
+IMPORT_PIPELINE_QUEUE_SIZE = int(os.environ.get('IMPORT_PIPELINE_QUEUE_SIZE', 1000))
+
+# Landing page link checks
+LINK_CHECK_WORKERS = int(os.environ.get('LINK_CHECK_WORKERS', 16))
+# Seconds a link check result stays valid
+LINK_CHECK_TTL = int(os.environ.get('LINK_CHECK_TTL', 24 * 60 * 60))
+LINK_CHECK_TIMEOUT = float(os.environ.get('LINK_CHECK_TIMEOUT', 5))
+
+
 LOG_DIR = BASE_DIR / "logs"
 LOG_DIR.mkdir(exist_ok=True)
 
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from urllib.parse import quote
-from .models import Product, ItemCollection, QRTaskStatus
+from .models import Product, ItemCollection, QRTaskStatus, QRAsset, InRiverSyncState, InRiverEntityMirror, ScanRollup
+from .search import admin_search_fields
 
 
 admin.site.register(ItemCollection)
@@ -16,13 +17,41 @@ class QRTaskStatusAdmin(admin.ModelAdmin):
         return f"{obj.progress}%"
     progress.short_description = 'Progress'
 
+@admin.register(InRiverSyncState)
+class InRiverSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_synced_at', 'last_full_sync_at', 'running_task_id')
+
+@admin.register(InRiverEntityMirror)
+class InRiverEntityMirrorAdmin(admin.ModelAdmin):
+    list_display = ('entity_id', 'content_hash', 'fetched_at', 'stale')
+    list_filter = ('stale',)
+    search_fields = ('entity_id',)
+
+@admin.register(ScanRollup)
+class ScanRollupAdmin(admin.ModelAdmin):
+    list_display = ('period', 'period_start', 'gtin', 'country', 'scans')
+    list_filter = ('period', 'country')
+    search_fields = ('gtin',)
+    date_hierarchy = 'period_start'
+
+@admin.register(QRAsset)
+class QRAssetAdmin(admin.ModelAdmin):
+    list_display = ('key', 'format', 'size', 'product', 'generated_at')
+    list_filter = ('format',)
+    search_fields = ('key',)
+    raw_id_fields = ('product',)
+
 # Register your models here.
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'barcode', 'image_preview', 'created_at', 'show_on_site')
-    list_filter = ('show_on_site', 'group', 'created_at')
+    list_filter = ('show_on_site', 'group', 'created_at', 'deleted_at')
     search_fields = ('name', 'barcode', 'external_id', 'group')
 
+    def get_search_fields(self, request):
+        # Prefix search on the indexed columns unless PRODUCT_SEARCH_MODE is "contains"
+        return admin_search_fields()
+
     readonly_fields = ('image_preview',)
 
     def image_preview(self, obj):
@@ -4,9 +4,9 @@ from rest_framework.response import Response
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from .serializers import GenerateQRInputSerializer
-from .models import Product
+from .models import Product, QRAsset
 from .filters import ProductFilter
-from .views import create_and_save_qr_code_eps , extract_qr_data_from_image
+from .generation import generate_and_store_qr_codes
 import os
 from django.conf import settings
 from rest_framework.views import APIView
@@ -15,8 +15,10 @@ from rest_framework.permissions import IsAuthenticated
 import base64
 from drf_yasg import openapi
 from django.views.decorators.csrf import csrf_exempt
-import boto3
-from datetime import date
+from .storage import get_s3_client, read_object
+from .zip_stream import prefetch
+from django.http import StreamingHttpResponse
+import json
 
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 S3_FOLDER = os.getenv("S3_FOLDER")
@@ -24,7 +26,7 @@ AWS_REGION=os.getenv("AWS_REGION")
 
 AWS_URL = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{S3_FOLDER}"
 
-s3 = boto3.client("s3")
+s3 = get_s3_client()
 
 
 
@@ -81,26 +83,11 @@ def generate_qr_api(request):
 
 
     generated_products = []
-    for product in products:
-        url = f"https://{domain}/01/0"
-        result = create_and_save_qr_code_eps(s3,url, product.name, product.barcode,  S3_FOLDER)
-
-        if not isinstance(result, dict):
+    for generated in generate_and_store_qr_codes(s3, products, domain, force=data.get("force", False)):
+        product = generated.product
+        result = generated.files
+        if result is None:
             continue
-        product, created = Product.objects.update_or_create(
-        external_id=product.external_id,
-        defaults={
-                'name': product.name,
-                'barcode': product.barcode,
-                'created_at': date.today(),
-                'group': 'inriver',
-                'show_on_site': True,
-                'qr_code_url': f"{AWS_URL}{product.name}.png",
-                'qr_image_url': extract_qr_data_from_image(product.name,AWS_URL),
-                
-
-                }
-            )
 
         product_files = []
 
@@ -117,7 +104,8 @@ def generate_qr_api(request):
 
         generated_products.append({
             "product": product.name,
-            "files": product_files
+            "files": product_files,
+            "skipped": generated.skipped,
         })
 
     return Response({
@@ -130,18 +118,110 @@ def generate_qr_api(request):
 file_type_param = openapi.Parameter(
     'file_type',
     openapi.IN_QUERY,
-    description="Тип файла QR-кода: png или eps",
+    description="Тип файла QR-кода: png, eps или svg",
     type=openapi.TYPE_STRING,
-    enum=['png', 'eps'],
+    enum=['png', 'eps', 'svg'],
+    required=False
+)
+
+page_size_param = openapi.Parameter(
+    'page_size',
+    openapi.IN_QUERY,
+    description="Number of QR codes per page (max QR_LIST_MAX_PAGE_SIZE)",
+    type=openapi.TYPE_INTEGER,
     required=False
 )
 
+cursor_param = openapi.Parameter(
+    'cursor',
+    openapi.IN_QUERY,
+    description="next_cursor of the previous page",
+    type=openapi.TYPE_STRING,
+    required=False
+)
+
+inline_param = openapi.Parameter(
+    'inline',
+    openapi.IN_QUERY,
+    description="1 to include the file content as image_base64",
+    type=openapi.TYPE_INTEGER,
+    enum=[0, 1],
+    required=False
+)
+
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    key = base64.urlsafe_b64decode(cursor.encode()).decode()
+    if not key.startswith(S3_FOLDER or ""):
+        raise ValueError("cursor outside the QR code folder")
+    return key
+
+
+def _list_qr_page(start_after, page_size, file_type=None):
+    """Keys of one page and the cursor of the next one (None on the last page).
+
+    Pages are read from the QRAsset manifest in key order, start_after is
+    the last key of the previous page.
+    """
+    assets = QRAsset.objects.order_by("key")
+    if start_after:
+        assets = assets.filter(key__gt=start_after)
+    if file_type:
+        assets = assets.filter(format=file_type)
+
+    keys = list(assets.values_list("key", flat=True)[:page_size + 1])
+    if len(keys) > page_size:
+        keys = keys[:page_size]
+        return keys, _encode_cursor(keys[-1])
+    return keys, None
+
+
+def _qr_code_entry(key, inline=False, image_content=None):
+    entry = {
+        "filename": os.path.basename(key),
+        "url": s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": BUCKET_NAME, "Key": key},
+            ExpiresIn=settings.QR_LIST_URL_EXPIRES,
+        ),
+    }
+    if inline:
+        entry["image_base64"] = base64.b64encode(image_content).decode('utf-8') if image_content is not None else None
+    return entry
+
+
+def _read_or_none(key):
+    try:
+        return read_object(s3, key, BUCKET_NAME)
+    except Exception:
+        return None
+
+
+def _stream_qr_page(keys, next_cursor, inline):
+    """The page as JSON, one entry at a time; inline content is downloaded a few objects ahead."""
+    if inline:
+        entries = (
+            _qr_code_entry(key, True, content)
+            for key, content in prefetch(keys, _read_or_none, window=settings.ZIP_PREFETCH_OBJECTS)
+        )
+    else:
+        entries = (_qr_code_entry(key) for key in keys)
+
+    yield '{"qr_codes": ['
+    for i, entry in enumerate(entries):
+        yield ("," if i else "") + json.dumps(entry)
+    yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+
 
 @csrf_exempt
 @swagger_auto_schema(
     method='get',
-    manual_parameters=[file_type_param],
-    operation_description="Получить список всех сгенерированных QR-кодов из S3.",
+    manual_parameters=[file_type_param, page_size_param, cursor_param, inline_param],
+    operation_description="Получить список сгенерированных QR-кодов из S3, по страницам.",
     responses={
         200: openapi.Response(
             description="Успешный ответ со списком QR-кодов",
@@ -156,12 +236,14 @@ file_type_param = openapi.Parameter(
                             "filename": "product_2.png",
                             "url": "https://example-bucket.s3.amazonaws.com/qrcodes/product_2.png?..."
                         }
-                    ]
+                    ],
+                    "next_cursor": "cXJjb2Rlcy9wcm9kdWN0XzIucG5n"
                 }
             }
         ),
+        400: "Неверный page_size или cursor",
         401: "Неавторизовано — отсутствует или неверный токен",
-        500: "Ошибка при доступе к S3"
+        500: "Ошибка при доступе к базе данных"
     }
 )
 @api_view(['GET'])
@@ -169,48 +251,36 @@ file_type_param = openapi.Parameter(
 @permission_classes([IsAuthenticated])
 def get_all_generated_qr_codes(request):
     """
-    Возвращает список всех сгенерированных QR-кодов, 
-    загруженных в S3. Для доступа требуется токен авторизации.
+    Возвращает список сгенерированных QR-кодов, загруженных в S3, по страницам
+    (из таблицы QRAsset, без листинга бакета).
+    Для доступа требуется токен авторизации.
     Можно фильтровать по типу файла: ?file_type=png или ?file_type=eps
+    ?page_size=N задаёт размер страницы, ?cursor= — next_cursor предыдущей страницы.
+    По умолчанию url — presigned URL; ?inline=1 добавляет image_base64.
     """
-    qr_codes = []
+    try:
+        page_size = int(request.query_params.get('page_size', settings.QR_LIST_PAGE_SIZE))
+        if not 1 <= page_size <= settings.QR_LIST_MAX_PAGE_SIZE:
+            raise ValueError
+    except ValueError:
+        return Response(
+            {"error": f"page_size must be between 1 and {settings.QR_LIST_MAX_PAGE_SIZE}"}, status=400
+        )
+
+    cursor = request.query_params.get('cursor')
+    try:
+        start_after = _decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return Response({"error": "Invalid cursor"}, status=400)
+
+    file_type = (request.query_params.get('file_type') or '').lower() or None
+    inline = request.query_params.get('inline') in ('1', 'true', 'True')
 
     try:
-        response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=S3_FOLDER)
-        
-        contents = response.get('Contents', [])
-
-        # ✅ фильтрация по расширению файла (если указано в query params)
-        file_type = request.query_params.get('file_type')
-        if file_type:
-            contents = [
-                obj for obj in contents
-                if obj['Key'].lower().endswith(f'.{file_type.lower()}')
-            ]
-
-        
-        for obj in contents:
-            key = obj['Key']
-         
-            filename = os.path.basename(key)
-            if key.endswith('/'):# or not key.lower().endswith('.png'):
-                continue
-
-          
-            file_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{key}"
-            try:
-                s3_object = s3.get_object(Bucket=BUCKET_NAME, Key=key)
-                image_content = s3_object['Body'].read()
-                image_base64 = base64.b64encode(image_content).decode('utf-8')
-            except Exception as e:
-                image_base64 = None
-
-            qr_codes.append({
-                "filename": filename,
-                "url": file_url,
-                "image_base64": image_base64
-            })
+        keys, next_cursor = _list_qr_page(start_after, page_size, file_type)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
-    return Response({"qr_codes": qr_codes}, status=200)
+    return StreamingHttpResponse(
+        _stream_qr_page(keys, next_cursor, inline), content_type="application/json"
+    )
@@ -0,0 +1,14 @@
+# products/batching.py
+#
+# Fixed-size chunks of lists and streams, shared by the bulk queries, the
+# task fan-out, batch rendering and S3 deletes. No Django imports: the
+# render worker processes load it too.
+
+from itertools import islice
+
+
+def chunks(items, size):
+    """Lists of up to size items of any iterable, in order."""
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
@@ -0,0 +1,237 @@
+# products/bundle.py
+#
+# Pre-built ZIP with all QR codes, kept up to date by the generation and
+# delete paths so "download all" is a single file read instead of one S3 GET
+# per object. Optionally mirrored to S3 and served with a presigned URL.
+#
+# The archive is never written in place: every change goes to a temporary
+# file that replaces it, so a running download or a crash mid-write never
+# sees a partial ZIP. Generation stages its files next to the bundle batch
+# by batch and merges them once at the end of the run.
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote, unquote
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import Product
+from .storage import get_s3_client
+from .zip_stream import compress_type_for
+
+logger = logging.getLogger(__name__)
+
+
+def bundle_path():
+    return settings.QR_BUNDLE_PATH
+
+
+def _state_path():
+    return bundle_path() + ".json"
+
+
+def _staging_dir():
+    return bundle_path() + ".pending"
+
+
+def _staged_path(name):
+    return os.path.join(_staging_dir(), quote(name, safe=""))
+
+
+@contextmanager
+def _locked():
+    os.makedirs(os.path.dirname(bundle_path()), exist_ok=True)
+    with open(bundle_path() + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _zip_info(name):
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compress_type_for(name)
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def _write_state(entries):
+    state = {"updated_at": datetime.now(dt_timezone.utc).isoformat(), "entries": entries}
+    tmp_path = _state_path() + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, _state_path())
+
+
+def _apply(added, read, removed):
+    """Write the bundle with the added arcnames (read(name) -> bytes) and without removed.
+
+    New names only: the archive is copied and the entries appended to the
+    copy; otherwise it is rewritten. Either way the copy replaces the
+    archive. The caller holds the lock.
+    """
+    path = bundle_path()
+    tmp_path = path + ".tmp"
+    with zipfile.ZipFile(path) as archive:
+        existing = set(archive.namelist())
+
+    drop = removed | added
+    if not drop & existing:
+        shutil.copyfile(path, tmp_path)
+        with zipfile.ZipFile(tmp_path, "a") as archive:
+            for name in added:
+                archive.writestr(_zip_info(name), read(name))
+        entries = len(existing) + len(added)
+    else:
+        with zipfile.ZipFile(path) as old, zipfile.ZipFile(tmp_path, "w") as new:
+            for info in old.infolist():
+                if info.filename not in drop:
+                    new.writestr(info, old.read(info))
+            for name in added:
+                new.writestr(_zip_info(name), read(name))
+            entries = len(new.namelist())
+    os.replace(tmp_path, path)
+    _write_state(entries)
+
+
+def update_bundle(added=None, removed=()):
+    """Add or replace entries ({arcname: bytes}) and drop removed arcnames.
+
+    Does nothing while no bundle has been built. Staged entries of removed
+    names are dropped too, so a later merge does not bring them back.
+    """
+    added = added or {}
+    removed = set(removed) - set(added)
+    if not added and not removed:
+        return
+
+    with _locked():
+        if not os.path.exists(bundle_path()):
+            # A partial bundle would look complete, it is built in full by build_qr_bundle
+            return
+        for name in removed:
+            if os.path.exists(_staged_path(name)):
+                os.remove(_staged_path(name))
+        _apply(set(added), added.__getitem__, removed)
+
+    if settings.QR_BUNDLE_S3_KEY:
+        _upload_bundle()
+
+
+def stage_bundle_entries(added):
+    """Keep entries ({arcname: bytes}) on disk next to the bundle until merge_staged_entries."""
+    if not added or not os.path.exists(bundle_path()):
+        return
+    os.makedirs(_staging_dir(), exist_ok=True)
+    for name, data in added.items():
+        tmp_path = os.path.join(_staging_dir(), ".tmp-" + quote(name, safe=""))
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, _staged_path(name))
+
+
+def merge_staged_entries():
+    """Merge the staged entries into the bundle with one rewrite and one upload; returns how many."""
+    with _locked():
+        if not os.path.exists(bundle_path()) or not os.path.isdir(_staging_dir()):
+            return 0
+        staged = {
+            unquote(filename): os.path.join(_staging_dir(), filename)
+            for filename in os.listdir(_staging_dir())
+            if not filename.startswith(".tmp-")
+        }
+        if not staged:
+            return 0
+
+        def read(name):
+            with open(staged[name], "rb") as f:
+                return f.read()
+
+        _apply(set(staged), read, set())
+        for staged_path in staged.values():
+            os.remove(staged_path)
+
+    if settings.QR_BUNDLE_S3_KEY:
+        _upload_bundle()
+    return len(staged)
+
+
+def build_bundle(entries):
+    """Replace the bundle with the (arcname, bytes) entries, e.g. streamed from S3."""
+    with _locked():
+        path = bundle_path()
+        tmp_path = path + ".tmp"
+        count = 0
+        with zipfile.ZipFile(tmp_path, "w") as archive:
+            for name, data in entries:
+                archive.writestr(_zip_info(name), data)
+                count += 1
+        os.replace(tmp_path, path)
+        _write_state(count)
+        # The listing already has the newest files
+        shutil.rmtree(_staging_dir(), ignore_errors=True)
+
+    if settings.QR_BUNDLE_S3_KEY:
+        _upload_bundle()
+    return count
+
+
+def remove_bundle():
+    with _locked():
+        for path in (bundle_path(), _state_path()):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(_staging_dir(), ignore_errors=True)
+
+    if settings.QR_BUNDLE_S3_KEY:
+        get_s3_client().delete_object(Bucket=os.getenv("BUCKET_NAME"), Key=settings.QR_BUNDLE_S3_KEY)
+
+
+def _upload_bundle():
+    get_s3_client().upload_file(
+        bundle_path(),
+        os.getenv("BUCKET_NAME"),
+        settings.QR_BUNDLE_S3_KEY,
+        ExtraArgs={"ContentType": "application/zip"},
+    )
+
+
+def bundle_url():
+    """Presigned URL of the S3 copy of the bundle, None when it is not mirrored."""
+    if not settings.QR_BUNDLE_S3_KEY:
+        return None
+    return get_s3_client().generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": os.getenv("BUCKET_NAME"),
+            "Key": settings.QR_BUNDLE_S3_KEY,
+            "ResponseContentDisposition": 'attachment; filename="qr_codes.zip"',
+        },
+        ExpiresIn=settings.QR_BUNDLE_URL_EXPIRES,
+    )
+
+
+def bundle_status():
+    """When the bundle was updated, how many files it has and if any QR code is newer."""
+    if not os.path.exists(bundle_path()) or not os.path.exists(_state_path()):
+        return {"exists": False, "updated_at": None, "entries": 0, "fresh": False}
+
+    with open(_state_path()) as f:
+        state = json.load(f)
+    updated_at = datetime.fromisoformat(state["updated_at"])
+    last_generated = Product.objects.aggregate(last=Max("qr_generated_at"))["last"]
+    return {
+        "exists": True,
+        "updated_at": updated_at,
+        "entries": state["entries"],
+        "fresh": last_generated is None or last_generated <= updated_at,
+    }
@@ -0,0 +1,113 @@
+# products/fake_inriver.py
+#
+# Minimal local inRiver API for tests and offline development: the query,
+# entities:fetchdata and /entities/<id>/fieldvalues endpoints over a dict of
+# entities, with LastModified system criteria. Can answer the first
+# requests with 429 to exercise retries.
+#
+#   server = FakeInRiverServer({85053: {"ItemCode": "34100030", "ItemGTIN": "8713968316602"}})
+#   server.start()  # server.url is the base URL for the client
+#   ...
+#   server.stop()
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELDVALUES_PATH = re.compile(r"^/api/v1\.0\.0/entities/(\d+)/fieldvalues$")
+
+
+class FakeInRiverServer:
+    def __init__(self, entities, fetchdata=True, throttle=0, retry_after="0", modified=None):
+        # {entity_id: {fieldTypeId: value}}
+        self.entities = {int(entity_id): fields for entity_id, fields in entities.items()}
+        # {entity_id: "YYYY-MM-DDTHH:MM:SS"} for LastModified criteria, older by default
+        self.modified = {int(entity_id): value for entity_id, value in (modified or {}).items()}
+        self.fetchdata = fetchdata
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.requests = []
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _query(self, query):
+        ids = sorted(self.entities)
+        for criterion in query.get("systemCriteria", []):
+            if criterion.get("type") == "LastModified" and criterion.get("operator") == "GreaterThan":
+                ids = [i for i in ids if self.modified.get(i, "2000-01-01T00:00:00") > criterion["value"]]
+        return ids
+
+    def _field_values(self, entity_id, field_type_ids=None):
+        fields = self.entities.get(entity_id, {})
+        return [
+            {"fieldTypeId": field_type_id, "value": value}
+            for field_type_id, value in fields.items()
+            if not field_type_ids or field_type_id in field_type_ids
+        ]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, headers=None):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _throttled(self):
+                with server.lock:
+                    server.requests.append((self.command, self.path))
+                    if server.throttle > 0:
+                        server.throttle -= 1
+                        return True
+                return False
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                if self._throttled():
+                    return self._send(429, {"message": "Too many requests"}, {"Retry-After": server.retry_after})
+                match = FIELDVALUES_PATH.match(self.path)
+                if not match:
+                    return self._send(404, {"message": "Not found"})
+                entity_id = int(match.group(1))
+                if entity_id not in server.entities:
+                    return self._send(404, {"message": "Entity not found"})
+                self._send(200, server._field_values(entity_id))
+
+            def do_POST(self):
+                if self._throttled():
+                    return self._send(429, {"message": "Too many requests"}, {"Retry-After": server.retry_after})
+                body = self._body()
+                if self.path == "/api/v1.0.0/query":
+                    return self._send(200, {"entityIds": server._query(body)})
+                if self.path == "/api/v1.0.0/entities:fetchdata" and server.fetchdata:
+                    field_type_ids = [f for f in body.get("fieldTypeIds", "").split(",") if f]
+                    return self._send(200, [
+                        {"entityId": entity_id, "fieldValues": server._field_values(entity_id, field_type_ids)}
+                        for entity_id in body.get("entityIds", [])
+                        if entity_id in server.entities
+                    ])
+                self._send(404, {"message": "Not found"})
+
+        return Handler
@@ -1,12 +1,17 @@
 import django_filters
 from .models import Product
+from .search import search_products
 
 class ProductFilter(django_filters.FilterSet):
     #created_at = django_filters.DateFromToRangeFilter()
     #group = django_filters.CharFilter(lookup_expr='icontains')
-    name = django_filters.CharFilter(lookup_expr='icontains')
+    # Item code, GTIN or external id, see products/search.py
+    name = django_filters.CharFilter(method='search')
 
     class Meta:
         model = Product
         #fields = ['created_at', 'group', 'name']
         fields = ['name']
+
+    def search(self, queryset, name, value):
+        return search_products(queryset, value)
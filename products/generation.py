@@ -0,0 +1,92 @@
+# products/generation.py
+#
+# QR generation used by the web view, the API and the background tasks:
+# render + upload (qr_batch) followed by the bulk Product and QRAsset upsert.
+
+import os
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .bundle import merge_staged_entries, stage_bundle_entries
+from .manifest import qr_asset_rows, record_qr_assets
+from .qr_batch import iter_generated_qr_codes
+from .upsert import upsert_products
+
+BUCKET_NAME = os.getenv("BUCKET_NAME")
+S3_FOLDER = os.getenv("S3_FOLDER")
+AWS_REGION = os.getenv("AWS_REGION")
+
+AWS_URL = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{S3_FOLDER}"
+
+# Existing products only get their QR columns rewritten, the rest of the row
+# (show_on_site, group, created_at) is only used when the product is new
+QR_UPDATE_FIELDS = ['qr_code_url', 'qr_image_url', 'qr_hash', 'qr_generated_at']
+
+
+def _store_batch(batch):
+    """Write the products and QR assets of a batch of uploaded QR codes in one transaction."""
+    generated_at = timezone.now()
+    product_rows, asset_rows = [], []
+    for generated in batch:
+        product = generated.product
+        product.qr_code_url = f"{AWS_URL}{product.name}.png"
+        product.qr_image_url = generated.payload
+        product.qr_hash = generated.qr_hash
+        product.qr_generated_at = generated_at
+        product_rows.append({
+            'external_id': product.external_id,
+            'name': product.name,
+            'barcode': product.barcode,
+            'created_at': date.today(),
+            'group': 'inriver',
+            'show_on_site': True,
+            'qr_code_url': product.qr_code_url,
+            'qr_image_url': product.qr_image_url,
+            'qr_hash': product.qr_hash,
+            'qr_generated_at': generated_at,
+        })
+        asset_rows.extend(qr_asset_rows(product, generated, S3_FOLDER, generated_at))
+
+    with transaction.atomic():
+        upsert_products(product_rows, update_fields=QR_UPDATE_FIELDS)
+        record_qr_assets(asset_rows)
+
+
+def generate_and_store_qr_codes(s3, products, domain, force=False, merge_bundle=True):
+    """Generate QR codes for products and save the result on each Product.
+
+    Yields every GeneratedQR, failed ones included (files is None), so the
+    caller can report progress per product. Products and their QRAsset rows
+    are written BULK_UPSERT_BATCH_SIZE at a time with multi-row upserts, one
+    transaction per batch, and yielded once written. The new files of each
+    batch are staged for the pre-built archive and merged into it once all
+    products are done, or by the caller when merge_bundle is not set.
+    """
+    pending, to_store = [], []
+
+    def flush():
+        if to_store:
+            _store_batch(to_store)
+            if settings.QR_BUNDLE_ENABLED:
+                stage_bundle_entries({
+                    f"{generated.product.name}.{ext}": data
+                    for generated in to_store
+                    for ext, data in generated.content.items()
+                })
+        yield from pending
+        pending.clear()
+        to_store.clear()
+
+    for generated in iter_generated_qr_codes(s3, products, domain, S3_FOLDER, force=force):
+        pending.append(generated)
+        if generated.files is not None and not generated.skipped:
+            to_store.append(generated)
+        if len(pending) >= settings.BULK_UPSERT_BATCH_SIZE:
+            yield from flush()
+    yield from flush()
+
+    if merge_bundle and settings.QR_BUNDLE_ENABLED:
+        merge_staged_entries()
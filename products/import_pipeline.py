@@ -0,0 +1,341 @@
+# products/import_pipeline.py
+#
+# The inRiver import as a chain of generator stages:
+#
+#   query ids -> fetch field values -> normalize -> upsert in chunks
+#
+# Entities with a fresh entry in the raw-response mirror (inriver_mirror) are
+# served from it; the fetched ones are written back to it with the products.
+# The fetch and normalize stages run in their own threads and hand items to
+# the next stage through bounded queues, so a slow stage holds the others
+# back instead of letting items pile up in memory. When the run ends, also
+# by an error, a shared stop event makes the threads give up waiting on the
+# queues and they are joined. The query and upsert stages run in the calling
+# thread; the fetch thread only reads the mirror, one window at a time, on
+# its own connection. Used by the load_products command, the web view
+# (through the Celery tasks) and the tasks themselves.
+
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .batching import chunks
+from .inriver import (
+    IMPORT_FIELDS,
+    finish_inriver_sync,
+    get_inriver_client,
+    inriver_product_row,
+    plan_inriver_sync,
+    record_failed_entities,
+)
+from .inriver_mirror import fresh_payloads, mirror_row, record_mirror
+from .models import Product
+from .upsert import upsert_products
+
+logger = logging.getLogger(__name__)
+
+ImportResult = namedtuple("ImportResult", ["created", "updated", "skipped", "timings", "mirrored"])
+
+_DONE = object()
+# NOT NULL product columns and the error reported when the entity has no value for them
+_REQUIRED_FIELDS = (("name", "No ItemCode"), ("barcode", "No ItemGTIN or BundleGTIN"))
+# Seconds between checks of the stop event while waiting on a queue
+_POLL_INTERVAL = 0.1
+
+
+class _Cancelled(Exception):
+    """The pipeline was stopped while a stage waited on a queue."""
+
+
+class _StageStats:
+    def __init__(self):
+        self.items = 0
+        self.waited = 0.0
+        self.started = None
+        self.finished = None
+
+    def as_dict(self):
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        return {"items": self.items, "seconds": round(max(elapsed - self.waited, 0), 3), "waited": round(self.waited, 3)}
+
+
+class _QueueReader:
+    """Iterator over a stage's output queue; time blocked in get() counts as waiting of the reader."""
+
+    def __init__(self, out, thread, errors, stop, reader_stats=None):
+        self.out = out
+        self.thread = thread
+        self.errors = errors
+        self.stop = stop
+        self.reader_stats = reader_stats
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # chunks() asks again after the end; the queue holds nothing more
+        if self.finished:
+            raise StopIteration
+        started = time.monotonic()
+        while True:
+            try:
+                item = self.out.get(timeout=_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if self.stop.is_set():
+                    self.finished = True
+                    raise _Cancelled()
+        if self.reader_stats is not None:
+            self.reader_stats.waited += time.monotonic() - started
+        if item is _DONE:
+            self.finished = True
+            self.thread.join()
+            if self.errors:
+                raise self.errors[0]
+            raise StopIteration
+        return item
+
+
+class Pipeline:
+    """Generator stages connected by bounded queues, with per-stage timings."""
+
+    def __init__(self, source, queue_size=None):
+        self.queue_size = queue_size or settings.IMPORT_PIPELINE_QUEUE_SIZE
+        self.stats = {}
+        self.output = iter(source)
+        self.stop = threading.Event()
+        self.threads = []
+
+    def _reader_of(self, stats):
+        if isinstance(self.output, _QueueReader):
+            self.output.reader_stats = stats
+        return self.output
+
+    def add(self, name, stage, *args):
+        """Run stage(upstream, *args) in a thread; its items become the upstream of the next stage."""
+        stats = self.stats[name] = _StageStats()
+        upstream = self._reader_of(stats)
+        out = queue.Queue(self.queue_size)
+        errors = []
+        stop = self.stop
+
+        def put(item):
+            while True:
+                try:
+                    return out.put(item, timeout=_POLL_INTERVAL)
+                except queue.Full:
+                    if stop.is_set():
+                        raise _Cancelled()
+
+        def run():
+            stats.started = time.monotonic()
+            try:
+                for item in stage(upstream, *args):
+                    stats.items += 1
+                    started = time.monotonic()
+                    put(item)
+                    stats.waited += time.monotonic() - started
+            except _Cancelled:
+                pass
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                stats.finished = time.monotonic()
+                try:
+                    put(_DONE)
+                except _Cancelled:
+                    pass
+
+        thread = threading.Thread(target=run, name=f"import-{name}", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        self.output = _QueueReader(out, thread, errors, stop)
+        return self
+
+    def run(self, name, stage, *args):
+        """Run the last stage in the calling thread and yield its items."""
+        stats = self.stats[name] = _StageStats()
+        stats.started = time.monotonic()
+        try:
+            for item in stage(self._reader_of(stats), *args):
+                stats.items += 1
+                yield item
+        finally:
+            stats.finished = time.monotonic()
+            self.close()
+
+    def close(self):
+        """Stop the stage threads (after an error they may wait on a full queue) and join them."""
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def timings(self):
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+
+def query_stage(entity_ids, update_existing, on_progress):
+    """Entity ids to fetch and how many were skipped.
+
+    entity_ids is a list or a callable returning one (the inRiver query).
+    Without update_existing, ids that already have a product are skipped.
+    """
+    if callable(entity_ids):
+        entity_ids = entity_ids()
+    entity_ids = [str(entity_id) for entity_id in entity_ids if entity_id]
+    if update_existing:
+        return entity_ids, 0
+
+    existing = set()
+    for chunk in chunks(entity_ids, settings.BULK_UPSERT_BATCH_SIZE):
+        existing.update(Product.objects.filter(external_id__in=chunk).values_list('external_id', flat=True))
+    if existing and on_progress:
+        on_progress(len(existing))
+    return [entity_id for entity_id in entity_ids if entity_id not in existing], len(existing)
+
+
+def fetch_stage(entity_ids, client, mirror=False, counts=None):
+    """(entity_id, field values, error, from_api) for the ids, one window of fetch batches at a time.
+
+    With mirror each window is looked up in the mirror first and only the
+    ids without a fresh entry are requested; counts["mirrored"] is raised
+    by the entries used.
+    """
+    try:
+        for chunk in chunks(entity_ids, client.batch_size * client.workers):
+            mirrored = fresh_payloads(chunk) if mirror else {}
+            if counts is not None:
+                counts["mirrored"] += len(mirrored)
+            for entity_id, json_data in mirrored.items():
+                yield entity_id, json_data, None, False
+            to_fetch = [entity_id for entity_id in chunk if entity_id not in mirrored]
+            if to_fetch:
+                for entity_id, json_data, error in client.iter_field_values(to_fetch, IMPORT_FIELDS):
+                    yield entity_id, json_data, error, True
+    finally:
+        if mirror:
+            # Connection of the fetch thread, nothing else closes it
+            connection.close()
+
+
+def normalize_stage(fetched, mirror=False):
+    """(entity_id, product row, mirror row, error) of every fetched entity.
+
+    The row is None for failed and empty entities and for entities without
+    a name or barcode, which would fail the whole upsert chunk; the latter
+    get an error. The mirror row is None unless mirror is set and the
+    values came from the API. Nothing is reported from here: progress and
+    errors go through the upsert stage, which runs in the calling thread.
+    """
+    for entity_id, json_data, error, from_api in fetched:
+        if error is not None or not json_data:
+            yield entity_id, None, None, error
+            continue
+        row = inriver_product_row(entity_id, json_data)
+        missing = [message for field, message in _REQUIRED_FIELDS if not row[field]]
+        if missing:
+            yield entity_id, None, None, ", ".join(missing)
+            continue
+        mirrored = mirror_row(entity_id, json_data, timezone.now()) if mirror and from_api else None
+        yield entity_id, row, mirrored, None
+
+
+def upsert_stage(items, batch_size, on_progress=None, on_error=None):
+    """Write the rows and their mirror entries in chunks, yield (created, updated) per chunk.
+
+    Failed entities are reported with on_error(entity_id, message) and
+    on_progress(count) is called once a chunk is stored.
+    """
+    for chunk in chunks(items, batch_size):
+        rows, mirror_rows = [], []
+        for entity_id, row, mirrored, error in chunk:
+            if error is not None and on_error:
+                on_error(entity_id, error)
+            if row is not None:
+                rows.append(row)
+            if mirrored is not None:
+                mirror_rows.append(mirrored)
+        with transaction.atomic():
+            result = upsert_products(rows, batch_size=batch_size)
+            if mirror_rows:
+                record_mirror(mirror_rows)
+        if on_progress:
+            on_progress(len(chunk))
+        yield result
+
+
+def run_import_pipeline(entity_ids, on_progress=None, on_error=None, client=None,
+                        update_existing=False, queue_size=None):
+    """Import entity ids (a list, or a callable returning them) through the staged pipeline.
+
+    on_progress(count) is called as entity ids are done, on_error(entity_id,
+    message) for entities whose field values could not be loaded. Returns
+    an ImportResult with created, updated and skipped counts and the
+    per-stage timings ({stage: {"items", "seconds", "waited"}}) and how
+    many entities came from the mirror instead of the API.
+    """
+    client = client or get_inriver_client()
+
+    query_stats = _StageStats()
+    query_stats.started = time.monotonic()
+    entity_ids, skipped = query_stage(entity_ids, update_existing, on_progress)
+    use_mirror = settings.INRIVER_MIRROR_ENABLED
+    counts = Counter()
+    query_stats.items = len(entity_ids)
+    query_stats.finished = time.monotonic()
+
+    pipeline = (
+        Pipeline(entity_ids, queue_size)
+        .add("fetch", fetch_stage, client, use_mirror, counts)
+        .add("normalize", normalize_stage, use_mirror)
+    )
+    created = updated = 0
+    upserts = pipeline.run("upsert", upsert_stage, settings.BULK_UPSERT_BATCH_SIZE, on_progress, on_error)
+    try:
+        for chunk_created, chunk_updated in upserts:
+            created += chunk_created
+            updated += chunk_updated
+    finally:
+        pipeline.close()
+
+    timings = {"query": query_stats.as_dict(), **pipeline.timings()}
+    return ImportResult(created, updated, skipped, timings, counts["mirrored"])
+
+
+def import_inriver_entities(entity_ids, on_progress=None, on_error=None, client=None, update_existing=False):
+    """Create products for entity ids that are not in the database yet.
+
+    With update_existing (incremental or full sync) products that exist
+    are fetched and updated too, and a soft-deleted product is restored.
+    Returns (created, updated, skipped).
+    """
+    result = run_import_pipeline(entity_ids, on_progress, on_error, client, update_existing)
+    logger.info("inRiver import stages: %s", result.timings)
+    return result.created, result.updated, result.skipped
+
+
+def run_inriver_sync(full=False, on_progress=None, on_error=None, client=None):
+    """Whole sync in this process (the CLI): plan, import every changed entity, store the cursor."""
+    client = client or get_inriver_client()
+    run_id = f"cli-{uuid.uuid4()}"
+    failed = []
+
+    def report_error(entity_id, message):
+        failed.append(entity_id)
+        if on_error:
+            on_error(entity_id, message)
+
+    result = run_import_pipeline(
+        lambda: plan_inriver_sync(run_id, full, client), on_progress, report_error, client, update_existing=True
+    )
+    record_failed_entities(run_id, failed)
+    finish_inriver_sync(run_id)
+    return result
@@ -1,4 +1,14 @@
 import os
+from datetime import date, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .inriver_client import InRiverClient
+from .models import InRiverEntityMirror, InRiverSyncState, ItemCollection, Product
 
 def get_inriver_token():
     token = os.getenv("IN_RIVER_API_KEY")
@@ -14,3 +24,156 @@ def get_inriver_header():
         headers_inRiver['X-inRiver-APIKey'] = get_inriver_token()
         return headers_inRiver
     
+
+
+IN_RIVER_URL = os.getenv("IN_RIVER_URL")
+
+
+@lru_cache(maxsize=None)
+def get_inriver_client():
+    """One client per process, its pooled session is shared by all threads."""
+    return InRiverClient(IN_RIVER_URL, get_inriver_header())
+
+
+def collections_query(modified_since=None):
+    """Query for the items in the configured ItemCollections, optionally only modified ones."""
+    collections = ItemCollection.objects.values_list('collection', flat=True)
+    system_criteria = []
+    if modified_since is not None:
+        system_criteria.append({
+            "type": "LastModified",
+            "value": modified_since.astimezone(dt_timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+            "operator": "GreaterThan",
+        })
+    return {
+        "systemCriteria": system_criteria,
+        "dataCriteria": [
+            {
+                "fieldTypeId": "ItemCollection",
+                "value": collection,
+                "operator": "Equal"
+            }
+            for collection in collections
+        ],
+        "dataCriteriaOperator": "Or"
+    }
+
+
+def query_entity_ids(client=None, modified_since=None):
+    """Entity ids of all items in the configured ItemCollections (modified after modified_since)."""
+    return (client or get_inriver_client()).query(collections_query(modified_since))
+
+
+def field_value(json_data, field_type_id):
+    return next((item["value"] for item in json_data if item["fieldTypeId"] == field_type_id), None)
+
+
+# Fields the import reads, fetchdata only returns these
+IMPORT_FIELDS = ("ItemCode", "ItemGTIN", "BundleGTIN")
+
+
+def inriver_product_row(ext_id, json_data):
+    """Product fields for one inRiver entity."""
+    product_name = field_value(json_data, "ItemCode")
+    return {
+        'external_id': str(ext_id),
+        'name': product_name,
+        # Bundles have no ItemGTIN
+        'barcode': field_value(json_data, "ItemGTIN") or field_value(json_data, "BundleGTIN"),
+        'created_at': date.today(),
+        'group': 'inriver',
+        'show_on_site': True,
+        'deleted_at': None,
+        'product_url' : f"{os.getenv('QR_REDIRECT_URL')}{product_name}",
+        'product_image_url' : f"https://dhznjqezv3l9q.cloudfront.net/report_Image/normal/{product_name}_01.png"
+    }
+
+
+SYNC_STATE_NAME = "products"
+
+
+def plan_inriver_sync(task_id, full=False, client=None):
+    """Entity ids the sync task has to fetch; soft-deletes products that left the collections.
+
+    The first sync and a full one fetch every entity. Later syncs only
+    fetch entities modified since the last completed sync (less
+    INRIVER_SYNC_OVERLAP seconds for clock skew), entities that have no
+    product yet and the ones the last sync failed to fetch. The cursor is
+    stored by finish_inriver_sync once all chunks are done. Mirror entries
+    of the modified entities (all of them for a full sync) are marked stale
+    so they are fetched again.
+    """
+    client = client or get_inriver_client()
+    state, _ = InRiverSyncState.objects.get_or_create(name=SYNC_STATE_NAME)
+    started = timezone.now()
+    full = full or state.last_synced_at is None
+
+    # Ids only, one query: needed to find entities that left the collections
+    all_ids = [str(entity_id) for entity_id in client.query(collections_query())]
+    if all_ids:
+        soft_delete_missing(all_ids)
+
+    if full:
+        fetch_ids = all_ids
+        InRiverEntityMirror.objects.filter(stale=False).update(stale=True)
+    else:
+        since = state.last_synced_at - timedelta(seconds=settings.INRIVER_SYNC_OVERLAP)
+        modified = {str(entity_id) for entity_id in client.query(collections_query(since))}
+        modified.update(state.failed_entity_ids)
+        known = set(
+            Product.objects.filter(external_id__in=all_ids, deleted_at__isnull=True)
+            .values_list('external_id', flat=True)
+        )
+        fetch_ids = [entity_id for entity_id in all_ids if entity_id in modified or entity_id not in known]
+        modified = list(modified)
+        for start in range(0, len(modified), 1000):
+            InRiverEntityMirror.objects.filter(entity_id__in=modified[start:start + 1000]).update(stale=True)
+
+    InRiverSyncState.objects.filter(pk=state.pk).update(
+        running_task_id=task_id, running_since=started, running_full=full, running_failed_ids=[]
+    )
+    return fetch_ids
+
+
+def record_failed_entities(task_id, entity_ids):
+    """Remember entities of a running sync that could not be fetched or stored."""
+    if not entity_ids:
+        return
+    with transaction.atomic():
+        # Chunks of the same sync finish in parallel
+        state = InRiverSyncState.objects.select_for_update().filter(running_task_id=task_id).first()
+        if state is None:
+            return
+        state.running_failed_ids = sorted(set(state.running_failed_ids) | {str(i) for i in entity_ids})
+        state.save(update_fields=["running_failed_ids"])
+
+
+def soft_delete_missing(entity_ids):
+    """Hide inRiver products whose entity is no longer in the collections, return how many."""
+    entity_ids = set(entity_ids)
+    missing = [
+        pk for pk, external_id in Product.objects.filter(group='inriver', deleted_at__isnull=True)
+        .values_list('pk', 'external_id')
+        if external_id not in entity_ids
+    ]
+    now = timezone.now()
+    for start in range(0, len(missing), 1000):
+        Product.objects.filter(pk__in=missing[start:start + 1000]).update(deleted_at=now, show_on_site=False)
+    return len(missing)
+
+
+def finish_inriver_sync(task_id):
+    """Store the cursor of a completed sync; later calls for the same task do nothing.
+
+    The cursor moves on even when entities failed: they are kept in
+    failed_entity_ids and fetched again by the next sync.
+    """
+    now = timezone.now()
+    updated = InRiverSyncState.objects.filter(running_task_id=task_id, running_full=True).update(
+        last_full_sync_at=now
+    )
+    updated += InRiverSyncState.objects.filter(running_task_id=task_id).update(
+        last_synced_at=F("running_since"), failed_entity_ids=F("running_failed_ids"),
+        running_task_id="", running_since=None, running_full=False, running_failed_ids=[],
+    )
+    return bool(updated)
@@ -0,0 +1,169 @@
+# products/inriver_client.py
+#
+# HTTP client for the inRiver REST API shared by the import paths. One pooled
+# session, a rate limiter across all threads, retries with backoff (the
+# Retry-After header of a 429 is honored) and concurrent field value fetches:
+# entities:fetchdata loads a batch of entities per request, per-entity
+# /fieldvalues requests are the fallback when that endpoint is unavailable.
+
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api/v1.0.0"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class InRiverError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class RateLimiter:
+    """At most rate calls per second over all threads (0 disables it)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class InRiverClient:
+    def __init__(self, base_url, headers, workers=None, rate=None, max_retries=None,
+                 backoff=None, timeout=None, batch_size=None, use_fetchdata=None):
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers or settings.INRIVER_WORKERS
+        self.max_retries = settings.INRIVER_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.INRIVER_BACKOFF if backoff is None else backoff
+        self.timeout = timeout or settings.INRIVER_TIMEOUT
+        self.batch_size = batch_size or settings.INRIVER_FETCH_BATCH_SIZE
+        self.use_fetchdata = settings.INRIVER_USE_FETCHDATA if use_fetchdata is None else use_fetchdata
+        self.limiter = RateLimiter(settings.INRIVER_RATE_LIMIT if rate is None else rate)
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        delay = self.backoff * 2 ** attempt
+        return delay + random.uniform(0, delay)
+
+    def request(self, method, path, **kwargs):
+        """Send one request, retrying connection errors, 429 and 5xx responses."""
+        url = f"{self.base_url}{API_PREFIX}{path}"
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise InRiverError(f"{method} {path} failed: {e}")
+                delay = self._retry_delay(attempt)
+                logger.warning("inRiver %s %s failed (%s), retry in %.2fs", method, path, e, delay)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                if attempt == self.max_retries:
+                    raise InRiverError(f"{method} {path} returned {response.status_code}", response.status_code)
+                delay = self._retry_delay(attempt, response)
+                logger.warning("inRiver %s %s returned %s, retry in %.2fs", method, path, response.status_code, delay)
+            time.sleep(delay)
+
+    def query(self, query):
+        """Entity ids matching an inRiver query."""
+        response = self.request("POST", "/query", data=json.dumps(query))
+        if response.status_code != 200:
+            raise InRiverError(f"query returned {response.status_code}", response.status_code)
+        return response.json()["entityIds"]
+
+    def _fetch_one(self, entity_id):
+        response = self.request("GET", f"/entities/{int(entity_id)}/fieldvalues")
+        if response.status_code != 200:
+            raise InRiverError(f"inRiver returned {response.status_code}", response.status_code)
+        return response.json()
+
+    def _fetch_batch(self, entity_ids, field_type_ids):
+        body = {"entityIds": [int(entity_id) for entity_id in entity_ids], "objects": "FieldValues"}
+        if field_type_ids:
+            body["fieldTypeIds"] = ",".join(field_type_ids)
+        response = self.request("POST", "/entities:fetchdata", data=json.dumps(body))
+        if response.status_code in (404, 405, 501):
+            return None
+        if response.status_code != 200:
+            raise InRiverError(f"fetchdata returned {response.status_code}", response.status_code)
+        return {
+            str(entity["entityId"]): entity.get("fieldValues", entity.get("fields", []))
+            for entity in response.json()
+        }
+
+    def _iter_single(self, pool, entity_ids):
+        def fetch(entity_id):
+            try:
+                return entity_id, self._fetch_one(entity_id), None
+            except InRiverError as e:
+                return entity_id, None, str(e)
+
+        yield from pool.map(fetch, entity_ids)
+
+    def iter_field_values(self, entity_ids, field_type_ids=None):
+        """Yield (entity_id, field values, error) for every entity id, in input order.
+
+        field values is the list of {"fieldTypeId", "value"} dicts (empty if
+        inRiver has none), None if the entity could not be loaded; error then
+        says why.
+        """
+        entity_ids = list(entity_ids)
+        starts = range(0, len(entity_ids), self.batch_size)
+        batches = [entity_ids[start:start + self.batch_size] for start in starts]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            if not self.use_fetchdata:
+                yield from self._iter_single(pool, entity_ids)
+                return
+
+            def fetch_batch(batch):
+                try:
+                    return self._fetch_batch(batch, field_type_ids), None
+                except InRiverError as e:
+                    return {}, e
+
+            for start, batch, (found, error) in zip(starts, batches, pool.map(fetch_batch, batches)):
+                if found is None:
+                    # No batch endpoint on this server: one request per entity from here on
+                    logger.info("inRiver entities:fetchdata is not available, fetching entities one by one")
+                    self.use_fetchdata = False
+                    yield from self._iter_single(pool, entity_ids[start:])
+                    return
+                for entity_id in batch:
+                    if error is not None:
+                        yield entity_id, None, str(error)
+                    else:
+                        yield entity_id, found.get(str(entity_id), []), None
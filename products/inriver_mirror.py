@@ -0,0 +1,70 @@
+# products/inriver_mirror.py
+#
+# Local copy of the raw inRiver field values (InRiverEntityMirror). The
+# import writes every fetched payload here and serves fresh entries from it
+# instead of the API; rebuild_from_mirror recomputes the product fields from
+# the stored payloads without any request, e.g. after a change to
+# inriver_product_row or to replay an import in a test or benchmark.
+
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .inriver import inriver_product_row
+from .models import InRiverEntityMirror
+from .upsert import bulk_upsert, upsert_products
+
+
+def payload_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def mirror_row(entity_id, payload, fetched_at):
+    return {
+        'entity_id': str(entity_id),
+        'payload': payload,
+        'content_hash': payload_hash(payload),
+        'fetched_at': fetched_at,
+        'stale': False,
+    }
+
+
+def record_mirror(rows):
+    """Bulk upsert mirror rows keyed on the entity id, returns (created, updated)."""
+    return bulk_upsert(InRiverEntityMirror, rows, "entity_id")
+
+
+def fresh_payloads(entity_ids, max_age=None):
+    """{entity_id: payload} of the ids whose mirror entry can be used instead of a request."""
+    max_age = settings.INRIVER_MIRROR_MAX_AGE if max_age is None else max_age
+    entries = InRiverEntityMirror.objects.filter(stale=False)
+    if max_age:
+        entries = entries.filter(fetched_at__gte=timezone.now() - timedelta(seconds=max_age))
+
+    entity_ids = [str(entity_id) for entity_id in entity_ids]
+    payloads = {}
+    for start in range(0, len(entity_ids), settings.BULK_UPSERT_BATCH_SIZE):
+        chunk = entity_ids[start:start + settings.BULK_UPSERT_BATCH_SIZE]
+        payloads.update(entries.filter(entity_id__in=chunk).values_list('entity_id', 'payload'))
+    return payloads
+
+
+def rebuild_from_mirror(entity_ids=None, batch_size=None):
+    """Upsert products from the stored payloads, no inRiver request; returns (created, updated)."""
+    batch_size = batch_size or settings.BULK_UPSERT_BATCH_SIZE
+    entries = InRiverEntityMirror.objects.order_by('pk')
+    if entity_ids is not None:
+        entries = entries.filter(entity_id__in=[str(entity_id) for entity_id in entity_ids])
+
+    created = updated = 0
+    last_pk = 0
+    while chunk := list(entries.filter(pk__gt=last_pk).values_list('pk', 'entity_id', 'payload')[:batch_size]):
+        last_pk = chunk[-1][0]
+        rows = [inriver_product_row(entity_id, payload) for _, entity_id, payload in chunk if payload]
+        chunk_created, chunk_updated = upsert_products(rows, batch_size=batch_size)
+        created += chunk_created
+        updated += chunk_updated
+    return created, updated
@@ -0,0 +1,40 @@
+# products/keyset.py
+#
+# Keyset (seek) pagination of products ordered by (name, id): the next page
+# starts after the last row of the previous one, "WHERE (name, id) > (...)"
+# on the (name, id) index, so a deep page costs as much as the first and no
+# COUNT(*) is needed. The cursor is the last (name, id), base64url JSON.
+
+import base64
+import json
+
+from django.db.models import Q
+
+
+def encode_cursor(product):
+    return base64.urlsafe_b64encode(json.dumps([product.name, product.pk]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(name, id) of a cursor; ValueError if it is not one of ours."""
+    try:
+        name, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(name, str) or not isinstance(pk, int):
+        raise ValueError("invalid cursor")
+    return name, pk
+
+
+def product_page(queryset, cursor=None, page_size=50):
+    """Products of one page and the cursor of the next one (None on the last page)."""
+    queryset = queryset.order_by('name', 'id')
+    if cursor:
+        name, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(name__gt=name) | Q(name=name, id__gt=pk))
+
+    products = list(queryset[:page_size + 1])
+    if len(products) > page_size:
+        products = products[:page_size]
+        return products, encode_cursor(products[-1])
+    return products, None
@@ -0,0 +1,100 @@
+# products/link_check.py
+#
+# Landing page validation, run as its own stage (management command or
+# background job) so QR generation never waits on the customer website.
+
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# link_status value stored when the site could not be reached at all
+LINK_UNREACHABLE = 0
+
+
+def product_link(product):
+    return product.product_url or f"{os.getenv('QR_REDIRECT_URL') or ''}{product.name}"
+
+
+def _cache_key(url):
+    return "link-check:" + hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def _session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_link_status(session, url, timeout=None):
+    """HTTP status of the landing page after redirects, LINK_UNREACHABLE on errors."""
+    timeout = timeout or settings.LINK_CHECK_TIMEOUT
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+        if response.status_code in (403, 405, 501):
+            # Some sites do not answer HEAD, retry with a streamed GET
+            response = session.get(url, allow_redirects=True, timeout=timeout, stream=True)
+            response.close()
+        return response.status_code
+    except requests.RequestException as e:
+        logger.info("Link check failed for %s: %s", url, e)
+        return LINK_UNREACHABLE
+
+
+def check_product_links(products=None, workers=None, ttl=None, force=False):
+    """Check landing pages of products concurrently and store the result on them.
+
+    Only products that were not checked within ttl seconds are checked, unless
+    force is set. Statuses are cached per URL for ttl seconds so products
+    sharing a landing page cost one request. Returns a dict of counters.
+    """
+    workers = workers or settings.LINK_CHECK_WORKERS
+    ttl = settings.LINK_CHECK_TTL if ttl is None else ttl
+
+    if products is None:
+        products = Product.objects.all()
+    if not force:
+        products = products.filter(
+            Q(link_checked_at__isnull=True) | Q(link_checked_at__lt=timezone.now() - timedelta(seconds=ttl))
+        )
+    products = list(products.only("id", "name", "product_url"))
+
+    urls = {product.pk: product_link(product) for product in products}
+    unique_urls = set(urls.values())
+
+    statuses = {}
+    if not force:
+        found = cache.get_many([_cache_key(url) for url in unique_urls])
+        statuses = {url: found[_cache_key(url)] for url in unique_urls if _cache_key(url) in found}
+    cached = len(statuses)
+
+    to_fetch = [url for url in unique_urls if url not in statuses]
+    if to_fetch:
+        session = _session(workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for url, status in zip(to_fetch, pool.map(lambda url: fetch_link_status(session, url), to_fetch)):
+                statuses[url] = status
+        cache.set_many({_cache_key(url): statuses[url] for url in to_fetch}, timeout=ttl)
+
+    now = timezone.now()
+    for product in products:
+        product.link_status = statuses[urls[product.pk]]
+        product.link_checked_at = now
+    Product.objects.bulk_update(products, ["link_status", "link_checked_at"], batch_size=500)
+
+    broken = sum(1 for product in products if not product.link_ok)
+    return {"checked": len(products), "fetched": len(to_fetch), "cached": cached, "broken": broken}
@@ -0,0 +1,50 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.qr_batch import render_qr_batch
+
+#python manage.py benchmark_qr_render --count 2000 --workers 1,2,4,8
+
+
+class Command(BaseCommand):
+    help = "Measure QR rendering throughput for different worker counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=1000, help="QR codes rendered per run")
+        parser.add_argument(
+            "--workers",
+            default=",".join(str(n) for n in (1, 2, 4, 8) if n <= (os.cpu_count() or 1)),
+            help="Comma separated list of worker counts",
+        )
+        parser.add_argument("--domain", default="example.com")
+
+    def handle(self, *args, **options):
+        count = options["count"]
+        jobs = [
+            (f"871396{index:07d}", f"BENCH{index:07d}", options["domain"])
+            for index in range(count)
+        ]
+        worker_counts = [int(value) for value in options["workers"].split(",") if value]
+
+        self.stdout.write(f"Rendering {count} QR codes on {os.cpu_count()} CPUs")
+
+        baseline = None
+        for workers in worker_counts:
+            started = time.perf_counter()
+            results = render_qr_batch(jobs, workers=workers)
+            elapsed = time.perf_counter() - started
+
+            failed = sum(1 for files in results if files is None)
+            throughput = count / elapsed
+            baseline = baseline or throughput
+
+            self.stdout.write(
+                f"workers={workers:<3} {elapsed:8.2f}s {throughput:9.1f} codes/s "
+                f"speedup x{throughput / baseline:.2f} "
+                f"efficiency {throughput / baseline / workers:.0%}"
+                + (f" failed={failed}" if failed else "")
+            )
+
+        self.stdout.write(self.style.SUCCESS("Benchmark finished"))
@@ -0,0 +1,98 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from products.models import Product
+
+#python manage.py benchmark_scan_redirect --requests 5000 --workers 8
+
+
+class Command(BaseCommand):
+    help = "Compare scan redirects per second: full Django stack (WSGI) against the ASGI fast lane"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=5000, help="Scans per run")
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent requests, the same for both runs")
+        parser.add_argument("--barcodes", type=int, default=100, help="Distinct products scanned")
+
+    def handle(self, *args, **options):
+        barcodes = list(
+            Product.objects.exclude(barcode="").order_by("pk").values_list("barcode", flat=True)[:options["barcodes"]]
+        )
+        if not barcodes:
+            raise CommandError("No products with a barcode to scan")
+        paths = [f"/01/0{barcodes[index % len(barcodes)]}/" for index in range(options["requests"])]
+        host = next((host for host in settings.ALLOWED_HOSTS if host and "*" not in host), "localhost")
+
+        self.stdout.write(f"{len(paths)} scans of {len(barcodes)} barcodes, {options['workers']} workers")
+        baseline = None
+        for name, run in (("wsgi", self.run_wsgi), ("asgi-fast-lane", self.run_asgi)):
+            # Warm-up pass fills the redirect caches, as in production
+            run(paths[:len(barcodes)], options["workers"], host)
+            started = time.perf_counter()
+            latencies = run(paths, options["workers"], host)
+            elapsed = time.perf_counter() - started
+
+            rps = len(paths) / elapsed
+            baseline = baseline or rps
+            latencies.sort()
+            self.stdout.write(
+                f"{name:<15} {rps:9.1f} req/s  p50 {statistics.median(latencies) * 1000:7.3f}ms  "
+                f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.3f}ms  x{rps / baseline:.2f}"
+            )
+
+        self.stdout.write(self.style.SUCCESS("Benchmark finished"))
+
+    def run_wsgi(self, paths, workers, host):
+        # One Client per request: the whole middleware stack, as under gunicorn threads
+        def scan(path):
+            started = time.perf_counter()
+            response = Client(HTTP_HOST=host).get(path)
+            if response.status_code != 302:
+                raise CommandError(f"{path}: HTTP {response.status_code}")
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(scan, paths))
+
+    def run_asgi(self, paths, workers, host):
+        from inriver_qr.asgi import application
+
+        async def scan(path):
+            scope = {
+                "type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+                "headers": [(b"host", host.encode())], "scheme": "http", "http_version": "1.1",
+                "server": (host, 80), "client": ("127.0.0.1", 0), "root_path": "",
+            }
+            status = []
+
+            async def receive():
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    status.append(message["status"])
+
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            if status != [302]:
+                raise CommandError(f"{path}: HTTP {status}")
+            return time.perf_counter() - started
+
+        async def run_all():
+            queue = list(reversed(paths))
+            latencies = []
+
+            async def worker():
+                while queue:
+                    latencies.append(await scan(queue.pop()))
+
+            await asyncio.gather(*(worker() for _ in range(workers)))
+            return latencies
+
+        return asyncio.run(run_all())
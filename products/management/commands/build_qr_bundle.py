@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from products.tasks import build_qr_bundle
+
+#python manage.py build_qr_bundle
+
+
+class Command(BaseCommand):
+    help = "Build the ZIP archive of all QR codes from the files in S3"
+
+    def handle(self, *args, **options):
+        build_qr_bundle()
+        self.stdout.write(self.style.SUCCESS("QR code archive built"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from products.link_check import check_product_links
+
+#python manage.py check_product_links --force
+
+
+class Command(BaseCommand):
+    help = "Check product landing pages and store broken links"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Ignore cached results and check every product")
+        parser.add_argument("--workers", type=int, default=None, help="Concurrent requests")
+
+    def handle(self, *args, **options):
+        result = check_product_links(workers=options["workers"], force=options["force"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {result['checked']} products: {result['fetched']} requests, "
+            f"{result['cached']} cached, {result['broken']} broken links."
+        ))
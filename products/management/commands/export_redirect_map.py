@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products.redirect_map import export_redirect_map
+
+#python manage.py export_redirect_map
+
+
+class Command(BaseCommand):
+    help = "Write the barcode redirects as nginx map, JSON and CSV files (and S3 redirect objects)"
+
+    def handle(self, *args, **options):
+        result = export_redirect_map()
+        if not result["written"]:
+            self.stdout.write(f"Redirect map unchanged, {result['entries']} entries.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Redirect map written: {result['entries']} entries, "
+            f"{result['changed']} changed, {result['removed']} removed."
+        ))
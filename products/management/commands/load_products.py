@@ -1,65 +1,47 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
-import requests
-import json
-from products.models import ItemCollection, Product
-from datetime import date
-from urllib.parse import quote
-import os
+
+from products.import_pipeline import run_inriver_sync
+from products.inriver_mirror import rebuild_from_mirror
+from products.redirect_map import export_redirect_map
+
+#python manage.py load_products --full
+#python manage.py load_products --offline
+
 
 class Command(BaseCommand):
     help = "Загрузка товаров из inRiver"
-    Product.objects.all().delete()
-    
-    
-    def get_inriver_header(self):
-        headers_inRiver = dict(Accept='application/json')
-        headers_inRiver['Content-type'] = 'application/json'
-        headers_inRiver['X-inRiver-APIKey'] = os.getenv("IN_RIVER_API_KEY")
-        return headers_inRiver
-    
-    def get_inriver_url(self):
-        return 'https://api-prod1a-euw.productmarketingcloud.com'
 
-    def handle(self, *args, **kwargs):
-        
-        collections = ItemCollection.objects.values_list('collection', flat=True)
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Fetch every entity, not only the changed ones")
+        parser.add_argument(
+            "--offline", action="store_true", help="Rebuild the products from the stored inRiver responses only"
+        )
 
-        json_request = {
-            "systemCriteria": [],
-            "dataCriteria": [
-                {
-                    "fieldTypeId": "ItemCollection",
-                    "value": collection,
-                    "operator": "Equal"
-                }
-                for collection in collections
-            ],
-            "dataCriteriaOperator": "Or"
-        }
+    def handle(self, *args, **options):
+        if options["offline"]:
+            created, updated = rebuild_from_mirror()
+            self.stdout.write(self.style.SUCCESS(f"{created} products added, {updated} updated from the mirror."))
+            self.export_redirect_map()
+            return
 
-        response = requests.post('{}/api/v1.0.0/query'.format(self.get_inriver_url()),
-                                 headers= self.get_inriver_header(), data= json.dumps(json_request))
-        if response.status_code == 200:
-            products = response.json()['entityIds']
+        # Same pipeline as the web import, run in this process
+        def on_error(entity_id, message):
+            self.stderr.write(f"{entity_id}: {message}")
 
-        for iditem in products:
-            resp_get_linkEntityId = requests.get('{}/api/v1.0.0/entities/{}/fieldvalues'.format(self.get_inriver_url(),int(iditem)),headers= self.get_inriver_header())
-            if resp_get_linkEntityId.text != '[]' and resp_get_linkEntityId.status_code == 200:
-                json_data = resp_get_linkEntityId.json()
-                ItemGTIN = next((item["value"] for item in json_data if item["fieldTypeId"] == "ItemGTIN"), None)
-                if ItemGTIN is not  None:
-                    barcode = ItemGTIN
-                else:
-                    ItemGTIN = next((item["value"] for item in json_data if item["fieldTypeId"] == "BundleGTIN"), None)
-                
-            Product.objects.update_or_create(
-                barcode = barcode,
-                defaults={
-                    'name': next((item_["value"] for item_ in json_data if item_["fieldTypeId"] == "ItemCode"), None),
-                    'created_at': date.today(),
-                    #'group': item['group'],
-                    'show_on_site': True,
-                    'external_id' : int(iditem),
-                }
+        result = run_inriver_sync(full=options["full"], on_error=on_error)
+
+        for stage, timing in result.timings.items():
+            self.stdout.write(
+                f"{stage:<10} {timing['items']:>7} items {timing['seconds']:>8.2f}s (waited {timing['waited']:.2f}s)"
             )
-            
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.created} products added, {result.updated} updated, {result.skipped} skipped, "
+            f"{result.mirrored} served from the mirror."
+        ))
+        self.export_redirect_map()
+
+    def export_redirect_map(self):
+        if settings.REDIRECT_MAP_ENABLED:
+            result = export_redirect_map()
+            self.stdout.write(f"Redirect map: {result['entries']} entries, {result['changed']} changed")
@@ -0,0 +1,42 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.purge import purge_qr_codes
+from products.storage import get_s3_client
+
+#python manage.py purge_qr_codes --format eps --product 34100030
+
+
+class Command(BaseCommand):
+    help = "Delete QR code files from S3 and clear them on the products"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", action="append", dest="formats", help="Only this file type (repeatable)")
+        parser.add_argument("--product", action="append", dest="products", help="Only this product name (repeatable)")
+        parser.add_argument("--workers", type=int, default=None, help="delete_objects calls in parallel")
+
+    def handle(self, *args, **options):
+        product_ids = None
+        if options["products"]:
+            product_ids = list(Product.objects.filter(name__in=options["products"]).values_list("id", flat=True))
+
+        processed = 0
+
+        def on_progress(count):
+            nonlocal processed
+            processed += count
+            self.stdout.write(f"{processed} keys processed")
+
+        def on_error(key, message):
+            self.stderr.write(f"{key}: {message}")
+
+        result = purge_qr_codes(
+            get_s3_client(), os.getenv("S3_FOLDER"), options["formats"], product_ids,
+            on_progress, on_error, options["workers"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Purge complete: {result['deleted']} deleted, {result['failed']} failed, "
+            f"{result['products']} products cleared."
+        ))
@@ -0,0 +1,25 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from products.manifest import reconcile_qr_assets
+from products.storage import get_s3_client
+
+#python manage.py reconcile_qr_assets --verify-hashes
+
+
+class Command(BaseCommand):
+    help = "Rebuild the QRAsset manifest from one listing of the QR code folder in S3"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify-hashes", action="store_true",
+            help="Read the qr-hash metadata of new or changed objects (one HEAD each)"
+        )
+
+    def handle(self, *args, **options):
+        result = reconcile_qr_assets(get_s3_client(), os.getenv("S3_FOLDER"), options["verify_hashes"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Manifest reconciled: {result['created']} added, {result['updated']} updated, "
+            f"{result['removed']} removed."
+        ))
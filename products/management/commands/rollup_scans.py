@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.scan_events import prune_scan_events, rollup_scans
+
+#python manage.py rollup_scans --since 2026-01-01
+
+
+class Command(BaseCommand):
+    help = "Aggregate scan events into hourly and daily rollups and delete old raw events"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Recompute from this date (YYYY-MM-DD), default the last hours")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = timezone.make_aware(datetime.strptime(options["since"], "%Y-%m-%d"))
+        rows = rollup_scans(since)
+        pruned = prune_scan_events()
+        self.stdout.write(self.style.SUCCESS(f"{rows} rollup rows written, {pruned} old events deleted."))
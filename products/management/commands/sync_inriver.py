@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from products.tasks import start_inriver_import
+
+#python manage.py sync_inriver --full
+
+
+class Command(BaseCommand):
+    help = "Start the inRiver sync: products changed since the last sync, or all with --full"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Fetch every entity, not only the changed ones")
+
+    def handle(self, *args, **options):
+        task_id = start_inriver_import(full=options["full"])
+        self.stdout.write(self.style.SUCCESS(f"inRiver sync started, task {task_id}"))
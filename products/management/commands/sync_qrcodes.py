@@ -1,8 +1,7 @@
-import boto3
-from django.core.management.base import BaseCommand
-from products.models import Product
-from django.utils import timezone
-from ...qr_utils import  extract_qr_data_from_image
+from products.storage import get_s3_client
+from django.core.management.base import BaseCommand, CommandError
+from products.manifest import reconcile_qr_assets
+from products.qr_sync import sync_qr_links
 import os
 # Настройки S3
 
@@ -10,70 +9,62 @@ BUCKET_NAME = os.getenv("BUCKET_NAME")
 S3_FOLDER = os.getenv("S3_FOLDER")
 AWS_REGION=os.getenv("AWS_REGION")
 
-AWS_URL = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{S3_FOLDER}"
-
 CLOUDFRONT_URL= f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/"
 
-s3 = boto3.client('s3')
+s3 = get_s3_client()
+
+#python manage.py sync_qrcodes --dry-run
+#python manage.py sync_qrcodes --reconcile
+#python manage.py sync_qrcodes --from-manifest
 
 
 class Command(BaseCommand):
     help = 'Синхронизация товаров с QR-кодами на AWS S3/CloudFront'
 
-    def handle(self, *args, **options):
-        # Подключаемся к S3
-        paginator = s3.get_paginator('list_objects_v2')
-
-        aws_files = set()
-        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=S3_FOLDER):
-            for obj in page.get('Contents', []):
-                key = obj['Key'].replace(S3_FOLDER, '')
-                if key.endswith('.png'):
-                    aws_files.add(key)
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reconcile", action="store_true",
+            help="Rebuild the QRAsset manifest from a listing of the bucket first and sync from it"
+        )
+        parser.add_argument(
+            "--from-manifest", action="store_true",
+            help="Take the files from the QRAsset manifest instead of listing the bucket"
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report the changes")
+        parser.add_argument(
+            "--decode", action="store_true",
+            help="Download and decode the PNGs to refresh qr_image_url"
+        )
+        parser.add_argument("--workers", type=int, default=None, help="Parallel downloads when decoding")
 
-        self.stdout.write(f"Found {(aws_files)} files on AWS")
+    def handle(self, *args, **options):
+        if options["reconcile"] and options["dry_run"]:
+            # reconcile переписывает манифест, в dry run это недопустимо
+            raise CommandError("--reconcile writes the QRAsset manifest and cannot be combined with --dry-run")
+        if options["reconcile"]:
+            result = reconcile_qr_assets(s3, S3_FOLDER)
+            self.stdout.write(f"Manifest reconciled: {result}")
 
-        # Получаем все записи с заполненным qr_code_url
-        products = Product.objects.exclude(qr_code_url__isnull=True)
+        # Файлы берём из листинга S3, после --reconcile или с --from-manifest из таблицы QRAsset
+        report = sync_qr_links(
+            s3, CLOUDFRONT_URL, S3_FOLDER,
+            decode=options["decode"], dry_run=options["dry_run"], workers=options["workers"],
+            use_manifest=options["reconcile"] or options["from_manifest"],
+        )
 
-        deleted_count = 0
-        updated_count = 0
+        if report["no_files"]:
+            self.stdout.write(self.style.WARNING("No QR code PNGs found, no links were cleared."))
 
-        # Синхронизация существующих записей
-        for product in products:
-            filename = f"{product.name}.png"
-            if filename in aws_files:
-                print(f"Обработка продукта: {filename}")
-                # QR код существует, обновляем URL
-                qr_url = CLOUDFRONT_URL + S3_FOLDER + filename
-                #if product.qr_code_url != qr_url:
-                product.qr_image_url = extract_qr_data_from_image(product.name, AWS_URL)
-                product.qr_code_url = qr_url
-                product.save(update_fields=['qr_image_url', 'qr_code_url'])
-                updated_count += 1
-            else:
-                # QR код отсутствует, удаляем запись
-                product.qr_image_url = ''
-                product.qr_code_url = ''
-                product.save(update_fields=['qr_image_url', 'qr_code_url'])
-                deleted_count += 1
+        if options["dry_run"]:
+            for change in ("linked", "cleared", "orphans"):
+                names = report[change]
+                sample = ", ".join(names[:20]) + (" ..." if len(names) > 20 else "")
+                self.stdout.write(f"{change}: {len(names)} {sample}")
+            self.stdout.write(f"unchanged: {report['unchanged']}")
+            self.stdout.write(self.style.WARNING("Dry run, nothing was changed."))
+            return
 
         self.stdout.write(self.style.SUCCESS(
-            f"Sync complete: {updated_count} updated, {deleted_count} deleted."
+            f"Sync complete: {len(report['linked'])} updated, {len(report['cleared'])} deleted, "
+            f"{len(report['decoded'])} decoded, {len(report['orphans'])} files without product."
         ))
-        
-        for filename in aws_files:
-            product_name = filename.replace('.png', '')
-            product  = Product.objects.filter(name__iexact=product_name).first()
-            print(f"Проверка продукта для файла: {product_name}")
-            print(f"Найдено продуктов в БД: {product }")
-            if product :
-                qr_url = CLOUDFRONT_URL + S3_FOLDER + filename
-                product.qr_image_url = extract_qr_data_from_image(product.name,AWS_URL)
-                product.qr_code_url = qr_url
-                product.save(update_fields=['qr_image_url', 'qr_code_url'])
-               
-             
-
-       
-            
@@ -0,0 +1,121 @@
+# products/manifest.py
+#
+# QRAsset rows are the index of the QR code files in S3. Generation writes
+# them together with the Product update; listing, zipping and deleting query
+# them instead of listing the bucket. reconcile_qr_assets rebuilds the index
+# from one paginated listing when it has drifted from S3.
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Product, QRAsset
+from .qr_utils import remote_qr_hash
+from .storage import iter_s3_objects
+from .upsert import bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+
+def asset_key(folder, item, ext):
+    return os.path.join(folder, f"{item}.{ext}")
+
+
+def qr_asset_rows(product, generated, folder, generated_at):
+    """QRAsset fields of every file of one freshly uploaded QR code."""
+    etags = generated.etags or {}
+    return [
+        {
+            'key': asset_key(folder, product.name, ext),
+            'format': ext,
+            'size': len(data),
+            'etag': etags.get(ext, ""),
+            'payload_hash': generated.qr_hash,
+            'generated_at': generated_at,
+            'product': product,
+        }
+        for ext, data in generated.content.items()
+    ]
+
+
+def record_qr_assets(rows):
+    """Bulk upsert QRAsset rows keyed on the S3 key, returns (created, updated)."""
+    return bulk_upsert(QRAsset, rows, "key")
+
+
+def unchanged_in_manifest(candidates, folder, formats):
+    """pks of the (product, qr_hash) candidates that have every format recorded with qr_hash."""
+    wanted = {
+        asset_key(folder, product.name, ext): (product.pk, qr_hash)
+        for product, qr_hash in candidates
+        for ext in formats
+    }
+    found = {}
+    for key, payload_hash in QRAsset.objects.filter(key__in=wanted).values_list("key", "payload_hash"):
+        pk, qr_hash = wanted[key]
+        if payload_hash == qr_hash:
+            found[pk] = found.get(pk, 0) + 1
+    return {pk for pk, count in found.items() if count == len(formats)}
+
+
+def qr_asset_keys(formats=None):
+    """Keys of all recorded files in key order, streamed from the DB."""
+    assets = QRAsset.objects.order_by("key")
+    if formats:
+        assets = assets.filter(format__in=formats)
+    return assets.values_list("key", flat=True).iterator()
+
+
+def reconcile_qr_assets(s3, folder, verify_hashes=False):
+    """Rebuild the manifest from one listing of folder.
+
+    Rows are created for objects that are missing, size and ETag are
+    refreshed, and rows of objects that no longer exist are deleted. With
+    verify_hashes the qr-hash metadata of new or changed objects is read
+    (a HEAD each), otherwise their payload_hash is unknown and the next
+    generation uploads them again.
+    """
+    existing = {asset.key: asset for asset in QRAsset.objects.all()}
+    products = dict(Product.objects.values_list("name", "id"))
+
+    created, updated, seen = [], [], set()
+    for obj in iter_s3_objects(s3, folder):
+        key = obj["Key"]
+        seen.add(key)
+        item, _, ext = os.path.basename(key).rpartition(".")
+        etag = obj.get("ETag", "")
+        asset = existing.get(key)
+        if asset is None:
+            created.append(QRAsset(
+                key=key, format=ext, size=obj.get("Size", 0), etag=etag,
+                generated_at=obj.get("LastModified"), product_id=products.get(item),
+            ))
+        elif asset.etag != etag or asset.size != obj.get("Size", 0):
+            asset.size = obj.get("Size", 0)
+            asset.etag = etag
+            asset.payload_hash = None
+            asset.generated_at = obj.get("LastModified")
+            updated.append(asset)
+
+    if verify_hashes:
+        def head(asset):
+            item, _, ext = os.path.basename(asset.key).rpartition(".")
+            asset.payload_hash = remote_qr_hash(s3, item, folder, ext)
+
+        with ThreadPoolExecutor(max_workers=settings.QR_SKIP_VERIFY_WORKERS) as pool:
+            list(pool.map(head, created + updated))
+
+    removed = [asset.pk for key, asset in existing.items() if key not in seen]
+    with transaction.atomic():
+        QRAsset.objects.bulk_create(created, batch_size=1000)
+        QRAsset.objects.bulk_update(
+            updated, ["size", "etag", "payload_hash", "generated_at"], batch_size=1000
+        )
+        for start in range(0, len(removed), 1000):
+            QRAsset.objects.filter(pk__in=removed[start:start + 1000]).delete()
+
+    logger.info("QR manifest reconciled: %s added, %s updated, %s removed", len(created), len(updated), len(removed))
+    return {"created": len(created), "updated": len(updated), "removed": len(removed)}
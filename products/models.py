@@ -7,8 +7,10 @@ from .qr_utils import extract_qr_data_from_image, check_url_exists
 
 class Product(models.Model):
     
+    # Item code; the (name, id) index in Meta serves the prefix search too
     name = models.CharField(max_length=255)
-    barcode = models.CharField(max_length=50)
+    # Scans look products up by barcode (redirect_by_barcode)
+    barcode = models.CharField(max_length=50, db_index=True)
     created_at = models.DateField()
     group = models.CharField(max_length=100)
     show_on_site = models.BooleanField(default=False)
@@ -17,13 +19,118 @@ class Product(models.Model):
     qr_code_url = models.URLField(blank=True, null=True)
     product_url = models.URLField(blank=True, null=True)
     product_image_url = models.URLField(blank=True, null=True)
+    qr_hash = models.CharField(max_length=64, blank=True, null=True)
+    qr_generated_at = models.DateTimeField(blank=True, null=True)
+    # HTTP status of product_url from the last link check, 0 if unreachable
+    link_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    link_checked_at = models.DateTimeField(blank=True, null=True)
+    # Set when the entity dropped out of the inRiver collections (soft delete)
+    deleted_at = models.DateTimeField(blank=True, null=True)
     
     
 
 
+    class Meta:
+        # Keyset pagination of the product list (products/keyset.py)
+        indexes = [models.Index(fields=['name', 'id'], name='product_name_id_idx')]
+
     def __str__(self):
         return self.name
 
+    @property
+    def link_ok(self):
+        # Unchecked links are not reported as broken
+        return self.link_status is None or 200 <= self.link_status < 400
+
+class QRAsset(models.Model):
+    """One QR code file in S3; the index used instead of listing the bucket."""
+
+    key = models.CharField(max_length=512, unique=True)
+    format = models.CharField(max_length=10, db_index=True)
+    size = models.PositiveIntegerField(default=0)
+    etag = models.CharField(max_length=100, blank=True)
+    # qr_hash the file was generated with, None if unknown (found by reconcile)
+    payload_hash = models.CharField(max_length=64, blank=True, null=True)
+    generated_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    product = models.ForeignKey(
+        Product, blank=True, null=True, on_delete=models.SET_NULL, related_name='qr_assets'
+    )
+
+    def __str__(self):
+        return self.key
+
+    @property
+    def filename(self):
+        return os.path.basename(self.key)
+
+
+class InRiverSyncState(models.Model):
+    """Change cursor of the inRiver import, one row per synced data set."""
+
+    name = models.CharField(max_length=50, unique=True)
+    # Start of the last completed sync; the next one asks for entities modified since
+    last_synced_at = models.DateTimeField(blank=True, null=True)
+    last_full_sync_at = models.DateTimeField(blank=True, null=True)
+    # Sync whose chunks are still running and the cursor it will store
+    running_task_id = models.CharField(max_length=100, blank=True)
+    running_since = models.DateTimeField(blank=True, null=True)
+    running_full = models.BooleanField(default=False)
+    # Entities the last completed sync could not fetch, the next one fetches them again
+    failed_entity_ids = models.JSONField(default=list, blank=True)
+    running_failed_ids = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class InRiverEntityMirror(models.Model):
+    """Raw field values of one inRiver entity as last fetched, for offline rebuilds."""
+
+    entity_id = models.CharField(max_length=100, unique=True)
+    payload = models.JSONField()
+    # sha256 of the payload, to see whether a refetch changed anything
+    content_hash = models.CharField(max_length=64)
+    fetched_at = models.DateTimeField(db_index=True)
+    # Set when the entity was modified in inRiver since it was fetched
+    stale = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.entity_id
+
+
+class ScanEvent(models.Model):
+    """One scan of a printed QR code, written in batches by scan_events."""
+
+    # Path segment of /01/<gtin>/ as scanned
+    gtin = models.CharField(max_length=20, db_index=True)
+    scanned_at = models.DateTimeField(db_index=True)
+    # ios, android, mobile, desktop, bot or unknown
+    agent = models.CharField(max_length=10)
+    country = models.CharField(max_length=2, blank=True)
+
+    def __str__(self):
+        return f"{self.gtin} {self.scanned_at}"
+
+
+class ScanRollup(models.Model):
+    """Scans per hour or day, GTIN and country; dashboards read these instead of ScanEvent."""
+
+    PERIODS = [("hour", "Hour"), ("day", "Day")]
+
+    period = models.CharField(max_length=4, choices=PERIODS)
+    period_start = models.DateTimeField()
+    gtin = models.CharField(max_length=20)
+    country = models.CharField(max_length=2, blank=True)
+    scans = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('period', 'period_start', 'gtin', 'country')
+        indexes = [models.Index(fields=['period', 'period_start'])]
+
+    def __str__(self):
+        return f"{self.period} {self.period_start} {self.gtin}"
+
+
 class QRTaskStatus(models.Model):
     task_id = models.CharField(max_length=100, unique=True)
     total = models.PositiveIntegerField(default=0)
@@ -0,0 +1,218 @@
+# products/progress.py
+#
+# Task progress lives in the cache (Redis in production) and is written to
+# QRTaskStatus only every PROGRESS_FLUSH_EVERY items or PROGRESS_FLUSH_INTERVAL
+# seconds, instead of one UPDATE per processed item. Without a shared cache
+# readers also check QRTaskStatus.
+
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import F
+
+from .models import QRTaskStatus
+
+# Progress keys outlive any realistic task
+PROGRESS_TTL = 24 * 60 * 60
+
+# Open progress streams in this process, each one holds a server thread
+_open_streams = 0
+_streams_lock = threading.Lock()
+
+
+def _key(task_id, name):
+    return f"qr-progress:{task_id}:{name}"
+
+
+def _incr(key, delta):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Key expired or was never set (e.g. a different cache per process)
+        cache.add(key, 0, PROGRESS_TTL)
+        return cache.incr(key, delta)
+
+
+def start_progress(task_id, total, done=False):
+    cache.set_many({
+        _key(task_id, "total"): total,
+        _key(task_id, "processed"): 0,
+        _key(task_id, "errors"): 0,
+        _key(task_id, "done"): done,
+    }, PROGRESS_TTL)
+
+
+def set_progress_total(task_id, total):
+    cache.set_many({
+        _key(task_id, "total"): total,
+        _key(task_id, "done"): not total,
+    }, PROGRESS_TTL)
+
+
+class ProgressTracker:
+    """Counts processed items of one task chunk.
+
+    Every advance() is one cache increment; the database row is updated in
+    batches. Call close() when the chunk is finished.
+    """
+
+    def __init__(self, task_id, flush_every=None, flush_interval=None):
+        self.task_id = task_id
+        self.flush_every = flush_every or settings.PROGRESS_FLUSH_EVERY
+        self.flush_interval = flush_interval or settings.PROGRESS_FLUSH_INTERVAL
+        self.processed = 0
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def advance(self, count=1):
+        if count <= 0:
+            return
+        _incr(_key(self.task_id, "processed"), count)
+        self.processed += count
+        self.pending += count
+        if self.pending >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def error(self, item, message):
+        index = _incr(_key(self.task_id, "errors"), 1)
+        cache.set(_key(self.task_id, f"error:{index}"), {"item": item, "error": message}, PROGRESS_TTL)
+
+    def flush(self):
+        if self.pending:
+            QRTaskStatus.objects.filter(task_id=self.task_id).update(processed=F("processed") + self.pending)
+            self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if QRTaskStatus.objects.filter(task_id=self.task_id, processed__gte=F("total")).update(done=True):
+            cache.set(_key(self.task_id, "done"), True, PROGRESS_TTL)
+
+
+def _cache_is_shared():
+    # A per-process cache never sees the counters written by the Celery worker
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def _task_progress(task):
+    return {
+        "task_id": task.task_id,
+        "total": task.total,
+        "processed": task.processed,
+        "errors": 0,
+        "done": task.done,
+        "progress": task.progress,
+    }
+
+
+def get_progress(task_id):
+    """Current progress from the cache, from QRTaskStatus if the cache has none.
+
+    With a per-process cache (LocMem) the worker's counters are not visible
+    here, so QRTaskStatus is read as well and the furthest of the two wins.
+    """
+    values = cache.get_many([_key(task_id, name) for name in ("total", "processed", "errors", "done")])
+    shared = _cache_is_shared()
+    task = None
+    if not shared or _key(task_id, "total") not in values:
+        task = QRTaskStatus.objects.filter(task_id=task_id).first()
+
+    if _key(task_id, "total") not in values:
+        return _task_progress(task) if task is not None else None
+
+    total = values[_key(task_id, "total")]
+    processed = values.get(_key(task_id, "processed"), 0)
+    done = values.get(_key(task_id, "done"), False)
+    if task is not None:
+        total = max(total, task.total)
+        processed = max(processed, task.processed)
+        done = done or task.done
+    processed = min(processed, total) if total else 0
+    return {
+        "task_id": task_id,
+        "total": total,
+        "processed": processed,
+        "errors": values.get(_key(task_id, "errors"), 0),
+        "done": done,
+        "progress": int(processed / total * 100) if total else 0,
+    }
+
+
+def get_errors(task_id, start, end):
+    """Per-item errors with index start + 1 .. end."""
+    keys = [_key(task_id, f"error:{index}") for index in range(start + 1, end + 1)]
+    found = cache.get_many(keys)
+    return [found[key] for key in keys if key in found]
+
+
+def stream_progress(task_id, interval=None, timeout=None):
+    """Server-sent events with the task progress and per-item errors until the task is done.
+
+    At most PROGRESS_STREAM_MAX_OPEN streams are held open per process; past
+    that the current progress is sent once and the stream ends, so the
+    client reconnects or polls instead of taking another server thread.
+    """
+    global _open_streams
+
+    with _streams_lock:
+        slot = _open_streams < settings.PROGRESS_STREAM_MAX_OPEN
+        if slot:
+            _open_streams += 1
+    if not slot:
+        progress = get_progress(task_id)
+        yield "retry: 5000\n\n"
+        if progress is None:
+            yield f"event: error\ndata: {json.dumps({'error': 'Task not found'})}\n\n"
+        else:
+            yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            if progress["done"]:
+                yield f"event: done\ndata: {json.dumps(progress)}\n\n"
+        return
+
+    try:
+        yield from _stream_progress(task_id, interval, timeout)
+    finally:
+        with _streams_lock:
+            _open_streams -= 1
+
+
+def _stream_progress(task_id, interval, timeout):
+    interval = interval or settings.PROGRESS_STREAM_INTERVAL
+    timeout = timeout or settings.PROGRESS_STREAM_TIMEOUT
+    started = time.monotonic()
+    last_sent = None
+    errors_sent = 0
+    last_event = started
+
+    yield "retry: 3000\n\n"
+    while time.monotonic() - started < timeout:
+        progress = get_progress(task_id)
+        if progress is None:
+            yield f"event: error\ndata: {json.dumps({'error': 'Task not found'})}\n\n"
+            return
+
+        if progress["errors"] > errors_sent:
+            for error in get_errors(task_id, errors_sent, progress["errors"]):
+                yield f"event: item-error\ndata: {json.dumps(error)}\n\n"
+            errors_sent = progress["errors"]
+            last_event = time.monotonic()
+
+        if progress != last_sent:
+            yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            last_sent = progress
+            last_event = time.monotonic()
+
+        if progress["done"]:
+            yield f"event: done\ndata: {json.dumps(progress)}\n\n"
+            return
+
+        if time.monotonic() - last_event >= 15:
+            # Comment line keeps proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+            last_event = time.monotonic()
+        time.sleep(interval)
@@ -0,0 +1,123 @@
+# products/purge.py
+#
+# Bulk deletion of QR code files. Keys are paged from S3 (or taken from the
+# manifest for a product subset) and deleted in batches of 1,000, the
+# delete_objects limit, with several batches in flight at once.
+
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .batching import chunks
+from .bundle import remove_bundle, update_bundle
+from .models import Product, QRAsset
+from .storage import iter_s3_objects
+
+logger = logging.getLogger(__name__)
+
+# Most keys delete_objects accepts in one call
+DELETE_BATCH_SIZE = 1000
+
+
+def _split_key(key):
+    item, _, ext = os.path.basename(key).rpartition(".")
+    return item, ext.lower()
+
+
+def iter_purge_keys(s3, folder, formats=None, product_names=None):
+    """Keys to delete: the whole folder paged from S3, or the files of product_names."""
+    if product_names is None:
+        for obj in iter_s3_objects(s3, folder):
+            if not formats or _split_key(obj["Key"])[1] in formats:
+                yield obj["Key"]
+        return
+
+    # Recorded files plus the expected names, in case the manifest has drifted
+    keys = set(
+        QRAsset.objects.filter(product__name__in=product_names).values_list("key", flat=True)
+    )
+    keys.update(
+        os.path.join(folder, f"{name}.{ext}")
+        for name in product_names
+        for ext in settings.QR_FORMATS
+    )
+    yield from sorted(key for key in keys if not formats or _split_key(key)[1] in formats)
+
+
+def delete_batch(s3, keys):
+    """Delete up to 1,000 keys, return {key: error} for the ones that failed."""
+    try:
+        response = s3.delete_objects(
+            Bucket=os.getenv("BUCKET_NAME"),
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+    except Exception as e:
+        return {key: str(e) for key in keys}
+    return {
+        error["Key"]: f"{error.get('Code')}: {error.get('Message')}"
+        for error in response.get("Errors", [])
+    }
+
+
+def purge_qr_codes(s3, folder, formats=None, product_ids=None, on_progress=None, on_error=None, workers=None):
+    """Delete QR code files from S3 and forget them in the DB.
+
+    formats limits the purge to some file types, product_ids to some
+    products. on_progress(n) is called after every batch and
+    on_error(key, message) for every key S3 did not delete. Only products
+    whose PNG was deleted, and none of whose files failed, have their QR
+    fields cleared. Returns {"deleted", "failed", "products"} counts.
+    """
+    formats = {ext.lower() for ext in formats} if formats else None
+    product_names = None
+    if product_ids is not None:
+        product_names = list(Product.objects.filter(id__in=product_ids).values_list("name", flat=True))
+    workers = workers or settings.S3_DELETE_WORKERS
+
+    deleted, failed = [], 0
+    cleared_names, failed_names = set(), set()
+
+    def finish(keys, future):
+        nonlocal failed
+        errors = future.result()
+        done = [key for key in keys if key not in errors]
+        deleted.extend(done)
+        QRAsset.objects.filter(key__in=done).delete()
+        for key in done:
+            item, ext = _split_key(key)
+            if ext == "png":
+                cleared_names.add(item)
+        for key, message in errors.items():
+            failed_names.add(_split_key(key)[0])
+            if on_error:
+                on_error(key, message)
+        failed += len(errors)
+        if on_progress:
+            on_progress(len(keys))
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for keys in chunks(iter_purge_keys(s3, folder, formats, product_names), DELETE_BATCH_SIZE):
+            pending.append((keys, pool.submit(delete_batch, s3, keys)))
+            while len(pending) > workers:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+
+    names = sorted(cleared_names - failed_names)
+    cleared = 0
+    for start in range(0, len(names), DELETE_BATCH_SIZE):
+        cleared += Product.objects.filter(name__in=names[start:start + DELETE_BATCH_SIZE]).update(
+            qr_code_url=None, qr_image_url=None, qr_hash=None
+        )
+
+    if formats is None and product_ids is None and not failed:
+        remove_bundle()
+    elif deleted:
+        update_bundle(removed=[key[len(folder):] for key in deleted])
+
+    logger.info("QR purge: %s deleted, %s failed, %s products cleared", len(deleted), failed, cleared)
+    return {"deleted": len(deleted), "failed": failed, "products": cleared}
@@ -0,0 +1,184 @@
+# products/qr_batch.py
+#
+# Batch QR rendering: the CPU-bound part (matrix build + file encoding)
+# is fanned out over a process pool. Uploads run from a thread pool in the
+# calling process and DB writes stay with the caller. Daemonic processes
+# (Celery prefork workers) cannot have children, there a thread pool
+# renders instead.
+
+import logging
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+
+from .batching import chunks
+from .qr_utils import (
+    decode_qr_image,
+    gs1_base_url,
+    qr_content_hash,
+    qr_file_urls,
+    qr_payload,
+    remote_qr_hash,
+    render_qr_code,
+)
+from .storage import submit_qr_upload
+
+logger = logging.getLogger(__name__)
+
+QRJob = namedtuple("QRJob", ["GTIN", "item", "domain"])
+GeneratedQR = namedtuple(
+    "GeneratedQR",
+    ["product", "files", "payload", "qr_hash", "skipped", "content", "etags"],
+    defaults=(None, None),
+)
+
+
+def _render_job(job, formats=("png", "eps"), verify=False):
+    GTIN, item, domain = job
+    url = gs1_base_url(domain)
+    try:
+        files = render_qr_code(url, GTIN, formats)
+        if verify:
+            png = files["png"] if "png" in files else render_qr_code(url, GTIN, ("png",))["png"]
+            decoded = decode_qr_image(png)
+            if decoded != qr_payload(url, GTIN):
+                logger.error("QR verification failed for %s: decoded %r", item, decoded)
+                return None
+        return files
+    except Exception as e:
+        logger.error("QR render error for %s: %s", item, e)
+        return None
+
+
+def iter_rendered_qr_codes(jobs, workers=None, batch_size=None):
+    """Yield (job, files) for every job, in input order.
+
+    files is the {format: bytes} dict returned by render_qr_code for the
+    formats in settings.QR_FORMATS, or None if rendering failed. With
+    QR_VERIFY_DECODE the rendered PNG is decoded in memory and a code that
+    does not decode to its payload counts as failed. Jobs are
+    rendered in batches of batch_size so only one batch of encoded files is
+    held in memory at a time.
+    """
+    jobs = [QRJob(*job) for job in jobs]
+    workers = workers or settings.QR_RENDER_WORKERS
+    batch_size = batch_size or settings.QR_RENDER_BATCH_SIZE
+    render = partial(
+        _render_job,
+        formats=tuple(settings.QR_FORMATS),
+        verify=settings.QR_VERIFY_DECODE,
+    )
+
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield job, render(job)
+        return
+
+    executor = ThreadPoolExecutor if multiprocessing.current_process().daemon else ProcessPoolExecutor
+    with executor(max_workers=min(workers, len(jobs))) as pool:
+        for batch in chunks(jobs, batch_size):
+            chunksize = max(1, len(batch) // (workers * 4))
+            for job, files in zip(batch, pool.map(render, batch, chunksize=chunksize)):
+                yield job, files
+
+
+def render_qr_batch(jobs, workers=None):
+    """Render a list of (GTIN, item, domain) jobs, results in the same order."""
+    return [files for _, files in iter_rendered_qr_codes(jobs, workers)]
+
+
+def _unchanged_products(s3, candidates, folder, formats):
+    """Products whose files are all recorded with the expected hash.
+
+    The QRAsset manifest is checked with one query; with QR_SKIP_VERIFY_REMOTE
+    the uploaded PNG's qr-hash metadata is checked instead.
+    """
+    if not settings.QR_SKIP_VERIFY_REMOTE:
+        # Imported here: render workers load this module without the models
+        from .manifest import unchanged_in_manifest
+
+        return unchanged_in_manifest(candidates, folder, formats)
+
+    def check(candidate):
+        product, qr_hash = candidate
+        return product.pk, remote_qr_hash(s3, product.name, folder) == qr_hash
+
+    with ThreadPoolExecutor(max_workers=settings.QR_SKIP_VERIFY_WORKERS) as pool:
+        return {pk for pk, unchanged in pool.map(check, candidates) if unchanged}
+
+
+def iter_generated_qr_codes(s3, products, domain, folder, workers=None, force=False):
+    """Render QR codes for products in parallel and upload them from this process.
+
+    Yields a GeneratedQR per product, in product order. files is the dict of
+    file URLs or None if rendering or uploading failed, payload is the data
+    encoded in the QR code, content the rendered {format: bytes} and etags the
+    {format: ETag} of the uploaded objects. Products whose stored
+    qr_hash matches the hash of their payload and render settings are not
+    rendered or uploaded again (skipped=True) unless force is set.
+    """
+    products = list(products)
+    formats = tuple(settings.QR_FORMATS)
+    url = gs1_base_url(domain)
+    hashes = [qr_content_hash(url, product.barcode, formats) for product in products]
+
+    unchanged = set()
+    if not force:
+        candidates = [
+            (product, qr_hash)
+            for product, qr_hash in zip(products, hashes)
+            if product.qr_code_url and product.qr_hash == qr_hash
+        ]
+        if candidates:
+            unchanged = _unchanged_products(s3, candidates, folder, formats)
+
+    jobs = [
+        (product.barcode, product.name, domain)
+        for product in products
+        if product.pk not in unchanged
+    ]
+    rendered = iter_rendered_qr_codes(jobs, workers)
+
+    # Uploads of several products are in flight while the next ones render;
+    # results are still yielded in product order.
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=settings.S3_UPLOAD_WORKERS) as uploads:
+        for product, qr_hash in zip(products, hashes):
+            payload = qr_payload(url, product.barcode)
+            if product.pk in unchanged:
+                generated = GeneratedQR(product, qr_file_urls(product.name, formats, folder), payload, qr_hash, True)
+                pending.append((generated, None))
+            else:
+                job, files = next(rendered)
+                generated = GeneratedQR(product, None, payload, qr_hash, False, files)
+                if files is not None:
+                    pending.append((generated, submit_qr_upload(uploads, s3, product.name, files, folder, qr_hash)))
+                else:
+                    pending.append((generated, None))
+
+            while len(pending) > settings.S3_UPLOAD_WINDOW:
+                yield _finish_upload(*pending.popleft(), folder)
+
+        while pending:
+            yield _finish_upload(*pending.popleft(), folder)
+
+
+def _finish_upload(generated, futures, folder):
+    if futures is None:
+        return generated
+
+    product = generated.product
+    failed = False
+    etags = {}
+    for ext, future in futures.items():
+        try:
+            etags[ext] = (future.result() or {}).get("ETag", "")
+        except Exception as e:
+            logger.error("%s upload error for %s: %s", ext.upper(), product.name, e)
+            failed = True
+    if failed:
+        return generated
+    return generated._replace(files=qr_file_urls(product.name, futures, folder), etags=etags)
@@ -0,0 +1,103 @@
+# products/qr_sync.py
+#
+# Link products to the QR code PNGs that exist in S3 (sync_qrcodes). The
+# file set comes from one paginated listing of the bucket folder (or from
+# the QRAsset manifest when asked) and the products from one query; the
+# diff between them is applied with chunked bulk_update.
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Product, QRAsset
+from .qr_utils import decode_qr_image
+from .storage import iter_s3_objects, read_object
+
+logger = logging.getLogger(__name__)
+
+SYNC_BATCH_SIZE = 1000
+
+
+def _decode_key(s3, key):
+    try:
+        return decode_qr_image(read_object(s3, key))
+    except Exception as e:
+        logger.error("QR decode error for %s: %s", key, e)
+        return None
+
+
+def _png_keys(s3, folder, use_manifest):
+    if use_manifest:
+        return QRAsset.objects.filter(format="png").values_list("key", flat=True)
+    return (obj["Key"] for obj in iter_s3_objects(s3, folder) if obj["Key"].lower().endswith(".png"))
+
+
+def sync_qr_links(s3, base_url, folder, decode=False, dry_run=False, workers=None, use_manifest=False):
+    """Set qr_code_url on products that have a PNG in S3 and clear it on the others.
+
+    The PNGs are listed from folder, or taken from the QRAsset manifest
+    with use_manifest. Names are matched case-insensitively. With decode
+    the PNGs of linked products are downloaded and decoded in parallel to
+    refresh qr_image_url; otherwise qr_image_url is left as it is. With
+    dry_run nothing is written. Finding no PNG at all never clears links,
+    it almost always means a wrong folder or a manifest that was not
+    reconciled. Returns a report with the names per change type.
+    """
+    files = {
+        os.path.basename(key)[:-len(".png")].lower(): key
+        for key in _png_keys(s3, folder, use_manifest)
+    }
+    if not files:
+        source = "the manifest" if use_manifest else folder
+        logger.warning("No QR code PNGs found in %s, links are not cleared", source)
+    products = list(Product.objects.only("id", "name", "qr_code_url", "qr_image_url"))
+
+    linked, cleared, unchanged = [], [], 0
+    for product in products:
+        key = files.get(product.name.lower())
+        if key is not None:
+            qr_url = base_url + key
+            if product.qr_code_url != qr_url:
+                product.qr_code_url = qr_url
+                linked.append(product)
+            else:
+                unchanged += 1
+        elif files and (product.qr_code_url or product.qr_image_url):
+            product.qr_code_url = None
+            product.qr_image_url = None
+            cleared.append(product)
+        else:
+            unchanged += 1
+
+    names = {product.name.lower() for product in products}
+    orphans = sorted(key for name, key in files.items() if name not in names)
+
+    decoded = []
+    if decode and not dry_run:
+        # Every product with a file, not only the changed ones
+        targets = [product for product in products if product.name.lower() in files]
+        with ThreadPoolExecutor(max_workers=workers or settings.SYNC_DECODE_WORKERS) as pool:
+            payloads = pool.map(lambda product: _decode_key(s3, files[product.name.lower()]), targets)
+            for product, payload in zip(targets, payloads):
+                if payload and payload != product.qr_image_url:
+                    product.qr_image_url = payload
+                    decoded.append(product)
+
+    changed = {product.pk: product for product in linked + cleared + decoded}
+    if not dry_run and changed:
+        with transaction.atomic():
+            Product.objects.bulk_update(
+                list(changed.values()), ["qr_code_url", "qr_image_url"], batch_size=SYNC_BATCH_SIZE
+            )
+
+    return {
+        "linked": [product.name for product in linked],
+        "cleared": [product.name for product in cleared],
+        "decoded": [product.name for product in decoded],
+        "unchanged": unchanged,
+        "orphans": orphans,
+        "no_files": not files,
+    }
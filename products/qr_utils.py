@@ -1,13 +1,15 @@
 # products/utils/qr_utils.py
 
 import os
+import json
+import hashlib
 import qrcode
 from PIL import Image
 from urllib.request import urlopen
 from django.conf import settings
-from pyzbar.pyzbar import decode
 import requests
 from io import BytesIO
+from .qr_vector import matrix_to_eps, matrix_to_svg
 
 
 def extract_qr_data_from_image(name,AWS_URL):
@@ -20,17 +22,23 @@ def extract_qr_data_from_image(name,AWS_URL):
     try:
        
         response = requests.get(url)
-        img = Image.open(BytesIO(response.content))
-        # Decode QR
-        decoded_objects = decode(img)
-    
-        if decoded_objects:
-            qr_data = decoded_objects[0].data.decode("utf-8")
-            return qr_data
+        return decode_qr_image(response.content)
     except Exception as e:
         print(f"Ошибка при декодировании QR: {e}")
     return None
 
+
+def decode_qr_image(content):
+    """Decode the first QR code found in image bytes, None if there is none."""
+    # pyzbar needs the native zbar library, only load it when decoding
+    from pyzbar.pyzbar import decode
+
+    img = Image.open(BytesIO(content))
+    decoded_objects = decode(img)
+    if decoded_objects:
+        return decoded_objects[0].data.decode("utf-8")
+    return None
+
 def check_url_exists(url):
     try:
         response = urlopen(url)
@@ -47,60 +55,84 @@ def remove_transparency(im, bg_color=(255, 255, 255)):
 
 
 
-def create_and_save_qr_code_eps(s3, url, item, GTIN,  folder):
-    # Form the URL for the QR
-    data_url = (os.getenv("QR_REDIRECT_URL") or "") + str(item)
-    bucket_name = os.getenv("BUCKET_NAME")
+def gs1_base_url(domain):
+    # GS1 Digital Link prefix, the GTIN is appended to it
+    return f"https://{domain}/01/0"
 
-    if not check_url_exists(data_url):
-        print("Ссылка не существует:", data_url)
 
-    data = url + str(GTIN)
-    
+# Render settings, part of the content hash: change QR_RENDER_VERSION
+# whenever the output of render_qr_code changes for the same input.
+QR_RENDER_VERSION = 2
+QR_BOX_SIZE = 10
+QR_BORDER = 4
+
+
+def qr_payload(url, GTIN):
+    """The data encoded in the QR code, also stored in Product.qr_image_url."""
+    return url + str(GTIN)
+
+
+def qr_content_hash(url, GTIN, formats=("png", "eps")):
+    """Hash of the QR payload and every setting that affects the rendered files."""
+    key = json.dumps({
+        "data": qr_payload(url, GTIN),
+        "version": QR_RENDER_VERSION,
+        "box_size": QR_BOX_SIZE,
+        "border": QR_BORDER,
+        "error_correction": "L",
+        "formats": sorted(formats),
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def render_qr_code(url, GTIN, formats=("png", "eps")):
+    """Build the QR matrix for url + GTIN and encode it in the requested formats.
+
+    EPS and SVG are written as vector art straight from the module matrix,
+    only PNG goes through PIL. Pure CPU work without any I/O, so it can run
+    inside a worker process.
+    """
+    data = qr_payload(url, GTIN)
+
     # Create a QR code
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+        box_size=QR_BOX_SIZE,
+        border=QR_BORDER,
     )
     qr.add_data(data)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
 
-    # --- PNG ---
-    try:
-        png_buffer = BytesIO()
-        img.save(png_buffer, format="PNG")
-        png_buffer.seek(0)
-
-        s3.upload_fileobj(
-            png_buffer,
-            bucket_name,
-            os.path.join(folder, f"{item}.png"),
-            ExtraArgs={'ACL': 'public-read'}
-        )
-    except Exception as e:
-        print("PNG upload error:", e)
-        return False
+    files = {}
+    for ext in formats:
+        if ext == "png":
+            img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
+            png_buffer = BytesIO()
+            img.save(png_buffer, format="PNG")
+            files["png"] = png_buffer.getvalue()
+        elif ext == "eps":
+            files["eps"] = matrix_to_eps(qr.get_matrix(), qr.box_size)
+        elif ext == "svg":
+            files["svg"] = matrix_to_svg(qr.get_matrix(), qr.box_size)
+        else:
+            raise ValueError(f"Unsupported QR format: {ext}")
 
-    # --- EPS ---
-    try:
-        eps_buffer = BytesIO()
-        img.save(eps_buffer, format="EPS")
-        eps_buffer.seek(0)
-
-        s3.upload_fileobj(
-            eps_buffer,
-            bucket_name,
-            os.path.join(folder, f"{item}.eps"),
-            ExtraArgs={'ACL': 'public-read'}
-        )
-    except Exception as e:
-        print("EPS upload error:", e)
-        return False
+    return files
 
+
+def qr_file_urls(item, formats, folder):
+    bucket_name = os.getenv("BUCKET_NAME")
     return {
-        "png": f"https://{bucket_name}.s3.amazonaws.com/{folder}{item}.png",
-        "eps": f"https://{bucket_name}.s3.amazonaws.com/{folder}{item}.eps"
-    }
\ No newline at end of file
+        ext: f"https://{bucket_name}.s3.amazonaws.com/{folder}{item}.{ext}"
+        for ext in formats
+    }
+
+
+def remote_qr_hash(s3, item, folder, ext="png"):
+    """qr-hash metadata stored on the uploaded object, None if it is missing."""
+    try:
+        head = s3.head_object(Bucket=os.getenv("BUCKET_NAME"), Key=os.path.join(folder, f"{item}.{ext}"))
+    except Exception:
+        return None
+    return head.get("Metadata", {}).get("qr-hash")
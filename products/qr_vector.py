@@ -0,0 +1,85 @@
+# products/qr_vector.py
+#
+# Vector writers driven directly by the qrcode module matrix.
+# Dark modules are merged into horizontal runs and identical runs in
+# consecutive rows are merged into rectangles, so a code needs a few
+# hundred drawing operations instead of one per module.
+
+
+def matrix_rectangles(matrix):
+    """Return dark areas of a boolean matrix as (x, y, width, height) in modules."""
+    rectangles = []
+    open_runs = {}  # (x, width) -> (y, height)
+
+    for y, row in enumerate(matrix):
+        runs = []
+        x = 0
+        size = len(row)
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                runs.append((start, x - start))
+            else:
+                x += 1
+
+        next_open = {}
+        for run in runs:
+            if run in open_runs:
+                start_y, height = open_runs.pop(run)
+                next_open[run] = (start_y, height + 1)
+            else:
+                next_open[run] = (y, 1)
+
+        for (run_x, width), (start_y, height) in open_runs.items():
+            rectangles.append((run_x, start_y, width, height))
+        open_runs = next_open
+
+    for (run_x, width), (start_y, height) in open_runs.items():
+        rectangles.append((run_x, start_y, width, height))
+
+    rectangles.sort(key=lambda rect: (rect[1], rect[0]))
+    return rectangles
+
+
+def matrix_to_eps(matrix, box_size=10):
+    """Encode the matrix as a vector EPS, one rectfill per merged rectangle."""
+    size = len(matrix) * box_size
+    lines = [
+        "%!PS-Adobe-3.0 EPSF-3.0",
+        f"%%BoundingBox: 0 0 {size} {size}",
+        f"%%HiResBoundingBox: 0 0 {size} {size}",
+        "%%Creator: inriver_qr",
+        "%%Pages: 1",
+        "%%EndComments",
+        "/r { rectfill } bind def",
+        "1 setgray",
+        f"0 0 {size} {size} r",
+        "0 setgray",
+    ]
+    # PostScript origin is bottom-left, the matrix starts at the top row
+    for x, y, width, height in matrix_rectangles(matrix):
+        lines.append(
+            f"{x * box_size} {size - (y + height) * box_size} "
+            f"{width * box_size} {height * box_size} r"
+        )
+    lines += ["showpage", "%%EOF", ""]
+    return "\n".join(lines).encode("ascii")
+
+
+def matrix_to_svg(matrix, box_size=10):
+    """Encode the matrix as an SVG with a single path of merged rectangles."""
+    size = len(matrix) * box_size
+    path = "".join(
+        f"M{x * box_size} {y * box_size}h{width * box_size}v{height * box_size}h-{width * box_size}z"
+        for x, y, width, height in matrix_rectangles(matrix)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{path}" fill="#000"/>'
+        "</svg>\n"
+    ).encode("ascii")
@@ -0,0 +1,129 @@
+# products/redirect_cache.py
+#
+# Barcode -> redirect target for the scan endpoint (/01/<barcode>/), cached in
+# two tiers: a small LRU in each process in front of the shared Django cache
+# (Redis in production), so a warm scan needs neither the database nor a
+# network round trip. Entries are dropped when a product is upserted, saved
+# or deleted. Other processes only see the invalidation once their local
+# entry expires (REDIRECT_LOCAL_CACHE_TTL), which bounds how stale a scan
+# can be; a product whose barcode changes keeps its old barcode in the
+# cache for the same reason until the entries expire.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product
+
+_MISSING = object()
+
+
+class LocalTTLCache:
+    """Thread safe LRU of at most maxsize entries, each valid for ttl seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@lru_cache(maxsize=None)
+def local_cache():
+    return LocalTTLCache(settings.REDIRECT_LOCAL_CACHE_SIZE, settings.REDIRECT_LOCAL_CACHE_TTL)
+
+
+def _cache_key(barcode):
+    return "qr-redirect:" + hashlib.sha1(barcode.encode("utf-8")).hexdigest()
+
+
+def redirect_target(product_name):
+    return f"{os.getenv('QR_REDIRECT_URL')}{product_name}"
+
+
+def resolve_redirect(barcode):
+    """Redirect target of the product with this barcode, None if there is none.
+
+    Unknown barcodes are cached too (as ""), so repeated scans of a code
+    that is not imported yet do not reach the database either.
+    """
+    local = local_cache()
+    target = local.get(barcode)
+    if target is _MISSING:
+        target = cache.get(_cache_key(barcode))
+        if target is None:
+            name = (
+                Product.objects.filter(barcode=barcode).order_by('pk').values_list('name', flat=True).first()
+            )
+            target = redirect_target(name) if name is not None else ""
+            cache.set(_cache_key(barcode), target, settings.REDIRECT_CACHE_TTL)
+        local.set(barcode, target)
+    return target or None
+
+
+def cached_redirect(barcode):
+    """Target from this process's LRU only, without any I/O.
+
+    Returns the target, "" for a barcode known to have no product and None
+    when the barcode is not cached here.
+    """
+    target = local_cache().get(barcode)
+    return None if target is _MISSING else target
+
+
+def invalidate_redirects(barcodes):
+    """Drop the cached targets of the barcodes once the current transaction commits."""
+    barcodes = {barcode for barcode in barcodes if barcode}
+    if not barcodes:
+        return
+
+    def invalidate():
+        local_cache().delete_many(barcodes)
+        cache.delete_many([_cache_key(barcode) for barcode in barcodes])
+
+    # Invalidating before the commit would let a scan cache the old row again
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def _product_changed(sender, instance, **kwargs):
+    # Single saves and deletes, e.g. in the admin; bulk upserts invalidate in upsert_products
+    invalidate_redirects([instance.barcode])
@@ -0,0 +1,160 @@
+# products/redirect_map.py
+#
+# The scan redirect (/01/<barcode>/) only depends on Product.barcode and
+# Product.name, so it can be compiled into static files and answered by the
+# edge without Python or the database; redirect_by_barcode stays as the
+# fallback for barcodes the files do not know yet. Written to
+# REDIRECT_MAP_DIR:
+#
+#   qr_redirects.map   nginx map include ("barcode" "target";)
+#   qr_redirects.json  {barcode: target}, also the state of the last export
+#   qr_redirects.csv   barcode,target
+#
+# The keys are Product.barcode, i.e. the path segment without its first
+# digit, like redirect_by_barcode looks them up. nginx example:
+#
+#   map $qr_barcode $qr_redirect { default ""; include /path/qr_redirects.map; }
+#   location ~ "^/01/.(?<qr_barcode>[^/]+)/?$" {
+#       if ($qr_redirect) { return 302 $qr_redirect; }
+#       proxy_pass http://django;
+#   }
+#
+# With REDIRECT_MAP_S3_BUCKET set, every barcode also gets an empty object
+# <REDIRECT_MAP_S3_PREFIX>0<barcode> with a WebsiteRedirectLocation, for a
+# bucket served as an S3 static website.
+#
+# Every file is written to a temporary name and renamed over the old one.
+# An export that finds the same pairs as the last one writes nothing, and
+# only added, changed and removed barcodes touch S3.
+
+import csv
+import fcntl
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .models import Product
+from .redirect_cache import redirect_target
+from .storage import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+MAP_FILE = "qr_redirects.map"
+JSON_FILE = "qr_redirects.json"
+CSV_FILE = "qr_redirects.csv"
+
+
+def _path(name):
+    return os.path.join(settings.REDIRECT_MAP_DIR, name)
+
+
+@contextmanager
+def _locked():
+    os.makedirs(settings.REDIRECT_MAP_DIR, exist_ok=True)
+    with open(_path(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _atomic_write(name, newline=None):
+    tmp_path = _path(name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline=newline) as f:
+        yield f
+    os.replace(tmp_path, _path(name))
+
+
+def redirect_pairs():
+    """{barcode: target} of every product; for a repeated barcode the first product wins, as in the view."""
+    pairs = {}
+    products = Product.objects.exclude(barcode="").order_by("pk").values_list("barcode", "name")
+    for barcode, name in products.iterator(chunk_size=2000):
+        if barcode and barcode not in pairs:
+            pairs[barcode] = redirect_target(name)
+    return pairs
+
+
+def _previous_pairs():
+    try:
+        with open(_path(JSON_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _nginx_quote(value):
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _write_files(pairs):
+    with _atomic_write(MAP_FILE) as f:
+        for barcode, target in sorted(pairs.items()):
+            f.write(f"{_nginx_quote(barcode)} {_nginx_quote(target)};\n")
+    with _atomic_write(CSV_FILE, newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["barcode", "target"])
+        writer.writerows(sorted(pairs.items()))
+    # Last: it is the state the next export is compared with
+    with _atomic_write(JSON_FILE) as f:
+        json.dump(pairs, f, sort_keys=True)
+
+
+def _s3_key(barcode):
+    return f"{settings.REDIRECT_MAP_S3_PREFIX}0{barcode}"
+
+
+def sync_redirect_objects(changed, removed, s3=None, workers=None):
+    """Write website redirect objects for changed {barcode: target}, delete the removed barcodes."""
+    s3 = s3 or get_s3_client()
+    bucket = settings.REDIRECT_MAP_S3_BUCKET
+
+    def put(item):
+        barcode, target = item
+        s3.put_object(
+            Bucket=bucket, Key=_s3_key(barcode), Body=b"",
+            WebsiteRedirectLocation=target, ContentType="text/html",
+        )
+
+    with ThreadPoolExecutor(max_workers=workers or settings.S3_UPLOAD_WORKERS) as pool:
+        # list() re-raises the first failed upload
+        list(pool.map(put, changed.items()))
+
+    removed = sorted(removed)
+    for start in range(0, len(removed), 1000):
+        s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": _s3_key(barcode)} for barcode in removed[start:start + 1000]], "Quiet": True},
+        )
+
+
+def export_redirect_map(s3=None):
+    """Compile the current redirects into the static files (and S3), return the counts.
+
+    Returns {"entries", "changed", "removed", "written"}; written is False
+    when nothing changed since the last export.
+    """
+    with _locked():
+        pairs = redirect_pairs()
+        previous = _previous_pairs()
+        if previous is None:
+            changed, removed = pairs, []
+        else:
+            changed = {barcode: target for barcode, target in pairs.items() if previous.get(barcode) != target}
+            removed = [barcode for barcode in previous if barcode not in pairs]
+
+        written = previous is None or bool(changed or removed)
+        if written:
+            # S3 first: if it fails the old state stays and the next export retries the diff
+            if settings.REDIRECT_MAP_S3_BUCKET:
+                sync_redirect_objects(changed, removed, s3)
+            _write_files(pairs)
+
+    logger.info("Redirect map: %s entries, %s changed, %s removed", len(pairs), len(changed), len(removed))
+    return {"entries": len(pairs), "changed": len(changed), "removed": len(removed), "written": written}
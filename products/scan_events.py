@@ -0,0 +1,179 @@
+# products/scan_events.py
+#
+# Scan analytics, written behind the redirect: record_scan() only appends to
+# an in-memory buffer, a daemon thread per process bulk inserts the buffered
+# ScanEvents every SCAN_FLUSH_INTERVAL seconds (or once SCAN_FLUSH_BATCH are
+# waiting). The buffer holds at most SCAN_BUFFER_SIZE events; when the
+# database cannot keep up further scans are counted as dropped instead of
+# queueing, so a slow database never slows down a redirect. rollup_scans()
+# aggregates the events per hour and day into ScanRollup.
+
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import ScanEvent, ScanRollup
+
+logger = logging.getLogger(__name__)
+
+BOT_MARKERS = ("bot", "crawl", "spider", "preview", "curl", "python-requests")
+
+
+def agent_class(user_agent):
+    """Coarse device class of a User-Agent header."""
+    user_agent = (user_agent or "").lower()
+    if not user_agent:
+        return "unknown"
+    if any(marker in user_agent for marker in BOT_MARKERS):
+        return "bot"
+    if "iphone" in user_agent or "ipad" in user_agent:
+        return "ios"
+    if "android" in user_agent:
+        return "android"
+    if "mobile" in user_agent:
+        return "mobile"
+    return "desktop"
+
+
+class ScanBuffer:
+    """Bounded buffer of ScanEvents with a background flusher thread."""
+
+    def __init__(self, maxsize, batch_size, interval, start_flusher=True):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self.start_flusher = start_flusher
+        self.dropped = 0
+        self.written = 0
+        self._events = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, event):
+        """Buffer one event, never blocks on I/O; returns False if it was dropped."""
+        with self._lock:
+            if len(self._events) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self._events.append(event)
+            pending = len(self._events)
+            if self.start_flusher and self._thread is None:
+                self._start()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _start(self):
+        # Started lazily, i.e. after the server forked its workers
+        self._thread = threading.Thread(target=self._run, name="scan-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write the buffered events; events of a failed write are counted as dropped."""
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            ScanEvent.objects.bulk_create(events, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error("Could not write %s scan events: %s", len(events), e)
+            with self._lock:
+                self.dropped += len(events)
+            return 0
+        self.written += len(events)
+        if self.dropped:
+            logger.warning("Scan events dropped so far: %s", self.dropped)
+        return len(events)
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._events), "written": self.written, "dropped": self.dropped}
+
+
+@lru_cache(maxsize=None)
+def get_scan_buffer():
+    """One buffer and flusher per process."""
+    return ScanBuffer(settings.SCAN_BUFFER_SIZE, settings.SCAN_FLUSH_BATCH, settings.SCAN_FLUSH_INTERVAL)
+
+
+def record_scan(gtin, user_agent=None, country=None):
+    """Queue a ScanEvent for a redirected scan; cheap enough for the hot path."""
+    if not settings.SCAN_EVENTS_ENABLED:
+        return
+    get_scan_buffer().add(ScanEvent(
+        gtin=gtin[:20],
+        scanned_at=timezone.now(),
+        agent=agent_class(user_agent),
+        country=(country or "")[:2].upper(),
+    ))
+
+
+def _day_start(moment):
+    return timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_scans(since=None):
+    """Recompute the hourly and daily ScanRollup rows from the start of since's day on.
+
+    Defaults to the last SCAN_ROLLUP_HOURS hours, which also picks up events
+    that were still buffered during the previous run. Returns the number of
+    rollup rows written.
+    """
+    since = since or timezone.now() - timedelta(hours=settings.SCAN_ROLLUP_HOURS)
+    # Whole days, so the daily rows are complete
+    since = _day_start(since)
+    if settings.SCAN_EVENT_RETENTION_DAYS:
+        # Never rebuild days whose raw events were pruned already
+        pruned_until = timezone.now() - timedelta(days=settings.SCAN_EVENT_RETENTION_DAYS)
+        since = max(since, _day_start(pruned_until) + timedelta(days=1))
+    events = ScanEvent.objects.filter(scanned_at__gte=since)
+
+    rows = []
+    for period, trunc in (("hour", TruncHour), ("day", TruncDay)):
+        buckets = (
+            events.annotate(bucket=trunc("scanned_at"))
+            .values("bucket", "gtin", "country")
+            .annotate(scans=Count("id"))
+        )
+        rows.extend(
+            ScanRollup(
+                period=period, period_start=bucket["bucket"], gtin=bucket["gtin"],
+                country=bucket["country"], scans=bucket["scans"],
+            )
+            for bucket in buckets
+        )
+
+    with transaction.atomic():
+        ScanRollup.objects.filter(period_start__gte=since).delete()
+        ScanRollup.objects.bulk_create(rows, batch_size=settings.BULK_UPSERT_BATCH_SIZE)
+    return len(rows)
+
+
+def prune_scan_events(days=None):
+    """Delete raw events older than SCAN_EVENT_RETENTION_DAYS (0 keeps them), return how many."""
+    days = settings.SCAN_EVENT_RETENTION_DAYS if days is None else days
+    if not days:
+        return 0
+    deleted, _ = ScanEvent.objects.filter(scanned_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
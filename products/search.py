@@ -0,0 +1,43 @@
+# products/search.py
+#
+# Product search for the product list filter and the admin. The default
+# "prefix" mode matches the start of the item code, the GTIN or the
+# external id with istartswith: on MySQL that is LIKE 'x%', which can use
+# the indexes on these columns (the case-insensitive collation covers the
+# "i"), where icontains (LIKE '%x%') reads the whole table. "contains"
+# keeps the old substring search. SQLite runs both modes, without the
+# index benefit.
+
+from django.conf import settings
+from django.db.models import Q
+
+SEARCH_FIELDS = ("name", "barcode", "external_id")
+
+
+def search_terms(value):
+    """The term and, for a scanned GTIN-14 with leading zero, the stored 13-digit barcode."""
+    value = value.strip()
+    terms = [value]
+    if len(value) == 14 and value.isdigit() and value.startswith("0"):
+        terms.append(value[1:])
+    return terms
+
+
+def search_products(queryset, value, mode=None):
+    """Products whose item code, GTIN or external id match value (PRODUCT_SEARCH_MODE)."""
+    if not value or not value.strip():
+        return queryset
+    mode = mode or settings.PRODUCT_SEARCH_MODE
+    lookup = "icontains" if mode == "contains" else "istartswith"
+    condition = Q()
+    for term in search_terms(value):
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{f"{field}__{lookup}": term})
+    return queryset.filter(condition)
+
+
+def admin_search_fields():
+    """ModelAdmin.search_fields for PRODUCT_SEARCH_MODE; "^" makes the admin use istartswith."""
+    if settings.PRODUCT_SEARCH_MODE == "contains":
+        return SEARCH_FIELDS + ("group",)
+    return tuple(f"^{field}" for field in SEARCH_FIELDS)
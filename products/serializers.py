@@ -7,3 +7,5 @@ class GenerateQRInputSerializer(serializers.Serializer):
     )
     select_all = serializers.BooleanField(default=False)
     domain = serializers.CharField()
+    # Re-render and re-upload even if the QR code content has not changed
+    force = serializers.BooleanField(default=False)
@@ -0,0 +1,88 @@
+# products/storage.py
+#
+# Shared S3 client and the upload helpers used by QR generation.
+
+import logging
+import os
+import random
+import time
+from functools import lru_cache
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "eps": "application/postscript",
+    "svg": "image/svg+xml",
+}
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """One S3 client per process, its connection pool sized for concurrent uploads.
+
+    boto3 clients are thread safe, so every thread shares this one.
+    """
+    return boto3.client(
+        "s3",
+        config=Config(
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+            retries={"max_attempts": settings.S3_MAX_ATTEMPTS, "mode": "adaptive"},
+        ),
+    )
+
+
+def qr_object_args(ext, qr_hash=None):
+    args = {
+        "ACL": "public-read",
+        "ContentType": CONTENT_TYPES.get(ext, "application/octet-stream"),
+        "CacheControl": settings.QR_CACHE_CONTROL,
+    }
+    if qr_hash:
+        args["Metadata"] = {"qr-hash": qr_hash}
+    return args
+
+
+def put_object_with_retry(s3, key, body, extra_args, attempts=None):
+    """PUT one object, retrying with exponential backoff and jitter.
+
+    botocore already retries throttling and 5xx responses; this covers
+    connection errors and anything else that fails a whole call.
+    """
+    attempts = attempts or settings.S3_UPLOAD_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        try:
+            return s3.put_object(Bucket=os.getenv("BUCKET_NAME"), Key=key, Body=body, **extra_args)
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = settings.S3_UPLOAD_BACKOFF * 2 ** (attempt - 1)
+            logger.warning("Upload of %s failed (%s), retry %s in %.2fs", key, e, attempt, delay)
+            time.sleep(delay + random.uniform(0, delay))
+
+
+def submit_qr_upload(pool, s3, item, files, folder, qr_hash=None):
+    """Start uploading every file of one QR code, return {ext: future}."""
+    return {
+        ext: pool.submit(
+            put_object_with_retry, s3, os.path.join(folder, f"{item}.{ext}"), content, qr_object_args(ext, qr_hash)
+        )
+        for ext, content in files.items()
+    }
+
+
+def iter_s3_objects(s3, prefix, bucket=None):
+    """Every object under prefix, one list_objects_v2 page at a time; "folder" keys are skipped."""
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket or os.getenv("BUCKET_NAME"), Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if not obj["Key"].endswith("/"):
+                yield obj
+
+
+def read_object(s3, key, bucket=None):
+    return s3.get_object(Bucket=bucket or os.getenv("BUCKET_NAME"), Key=key)["Body"].read()
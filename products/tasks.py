@@ -0,0 +1,204 @@
+# products/tasks.py
+#
+# Background jobs. Long runs are split into chunks so each Celery task stays
+# short; progress of all chunks is collected on one QRTaskStatus row.
+
+import logging
+import os
+import uuid
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+
+from .batching import chunks
+from .bundle import build_bundle, merge_staged_entries
+from .generation import generate_and_store_qr_codes
+from .import_pipeline import import_inriver_entities
+from .inriver import finish_inriver_sync, plan_inriver_sync, record_failed_entities
+from .models import Product, QRAsset, QRTaskStatus
+from .purge import purge_qr_codes
+from .redirect_map import export_redirect_map
+from .scan_events import prune_scan_events, rollup_scans
+from .progress import ProgressTracker, set_progress_total, start_progress
+from .manifest import qr_asset_keys
+from .storage import get_s3_client, read_object
+from .zip_stream import prefetch
+
+logger = logging.getLogger(__name__)
+
+S3_FOLDER = os.getenv("S3_FOLDER")
+
+
+def start_qr_generation(product_ids, domain, force=False):
+    """Create the task status and enqueue generation in chunks, return the task id."""
+    product_ids = list(product_ids)
+    task_id = str(uuid.uuid4())
+    QRTaskStatus.objects.create(task_id=task_id, total=len(product_ids), done=not product_ids)
+    start_progress(task_id, len(product_ids), done=not product_ids)
+
+    for chunk in chunks(product_ids, settings.QR_TASK_CHUNK_SIZE):
+        generate_qr_chunk.delay(task_id, chunk, domain, force)
+    return task_id
+
+
+@shared_task
+def generate_qr_chunk(task_id, product_ids, domain, force=False):
+    products = Product.objects.filter(id__in=product_ids).order_by("name")
+    progress = ProgressTracker(task_id)
+    try:
+        s3 = get_s3_client()
+        for generated in generate_and_store_qr_codes(s3, products, domain, force=force, merge_bundle=False):
+            if generated.files is None:
+                progress.error(generated.product.name, "QR code could not be generated")
+            progress.advance()
+    finally:
+        # Count products that were deleted meanwhile or not reached because of an error
+        progress.advance(len(product_ids) - progress.processed)
+        progress.close()
+        if QRTaskStatus.objects.filter(task_id=task_id, done=True).exists():
+            # The last chunk merges the files staged by all chunks, one archive rewrite per task
+            if settings.QR_BUNDLE_ENABLED:
+                merge_staged_entries()
+            if settings.REDIRECT_MAP_ENABLED:
+                start_redirect_map_export()
+
+
+def start_inriver_import(full=False):
+    """Create the task status and enqueue the inRiver sync, return the task id.
+
+    Only entities changed since the last sync are fetched unless full is set.
+    """
+    task_id = str(uuid.uuid4())
+    QRTaskStatus.objects.create(task_id=task_id)
+    start_progress(task_id, 0)
+    import_inriver_products.delay(task_id, full)
+    return task_id
+
+
+@shared_task
+def import_inriver_products(task_id, full=False):
+    try:
+        entity_ids = plan_inriver_sync(task_id, full)
+    except Exception as e:
+        logger.error("Error connecting to inRiver: %s", e)
+        ProgressTracker(task_id).error("inRiver", f"Error connecting to inRiver: {e}")
+        QRTaskStatus.objects.filter(task_id=task_id).update(done=True)
+        set_progress_total(task_id, 0)
+        return
+
+    logger.info("Inriver entities to fetch: %s", len(entity_ids))
+    QRTaskStatus.objects.filter(task_id=task_id).update(total=len(entity_ids), done=not entity_ids)
+    set_progress_total(task_id, len(entity_ids))
+    if not entity_ids:
+        finish_inriver_sync(task_id)
+        if settings.REDIRECT_MAP_ENABLED:
+            # Products may have been soft-deleted
+            start_redirect_map_export()
+
+    for chunk in chunks(entity_ids, settings.INRIVER_TASK_CHUNK_SIZE):
+        import_inriver_chunk.delay(task_id, chunk, True)
+
+
+@shared_task
+def import_inriver_chunk(task_id, entity_ids, update_existing=False):
+    progress = ProgressTracker(task_id)
+    failed = []
+
+    def on_error(entity_id, message):
+        failed.append(entity_id)
+        progress.error(entity_id, message)
+
+    try:
+        created, updated, skipped = import_inriver_entities(
+            entity_ids, progress.advance, on_error, update_existing=update_existing
+        )
+        logger.info("inRiver chunk imported: %s added, %s updated, %s skipped", created, updated, skipped)
+    except Exception:
+        # Not known which of them were stored, the next sync fetches the whole chunk again
+        failed = entity_ids
+        raise
+    finally:
+        record_failed_entities(task_id, failed)
+        progress.advance(len(entity_ids) - progress.processed)
+        progress.close()
+        # The last chunk to finish stores the sync cursor
+        if QRTaskStatus.objects.filter(task_id=task_id, done=True).exists():
+            finish_inriver_sync(task_id)
+            if settings.REDIRECT_MAP_ENABLED:
+                start_redirect_map_export()
+
+
+def start_qr_purge(formats=None, product_ids=None):
+    """Create the task status and enqueue deletion of QR code files, return the task id."""
+    task_id = str(uuid.uuid4())
+    # Estimated from the manifest, corrected when the purge is done
+    assets = QRAsset.objects.all()
+    if formats:
+        assets = assets.filter(format__in=formats)
+    if product_ids is not None:
+        assets = assets.filter(product_id__in=product_ids)
+    total = assets.count()
+    QRTaskStatus.objects.create(task_id=task_id, total=total)
+    start_progress(task_id, total)
+    purge_qr_codes_task.delay(task_id, formats, product_ids)
+    return task_id
+
+
+@shared_task
+def purge_qr_codes_task(task_id, formats=None, product_ids=None):
+    progress = ProgressTracker(task_id)
+    try:
+        result = purge_qr_codes(
+            get_s3_client(), S3_FOLDER, formats, product_ids, progress.advance, progress.error
+        )
+        logger.info("QR codes purged: %s", result)
+    except Exception as e:
+        logger.error("QR purge failed: %s", e)
+        progress.error("S3", f"QR purge failed: {e}")
+    finally:
+        # The real number of keys is known now, it replaces the estimate
+        progress.flush()
+        QRTaskStatus.objects.filter(task_id=task_id).update(total=progress.processed)
+        set_progress_total(task_id, progress.processed)
+        progress.close()
+
+
+def start_bundle_build():
+    """Enqueue a full rebuild of the QR code archive unless one is already queued."""
+    if cache.add("qr-bundle-build", True, settings.QR_BUNDLE_BUILD_LOCK):
+        build_qr_bundle.delay()
+
+
+@shared_task
+def build_qr_bundle():
+    s3 = get_s3_client()
+    try:
+        keys = qr_asset_keys()
+        objects = prefetch(keys, lambda key: read_object(s3, key), window=settings.ZIP_PREFETCH_OBJECTS)
+        count = build_bundle((key[len(S3_FOLDER):], data) for key, data in objects)
+        logger.info("QR code archive built with %s files", count)
+    finally:
+        cache.delete("qr-bundle-build")
+
+
+def start_redirect_map_export():
+    """Enqueue an export of the static redirect map unless one is queued already."""
+    if cache.add("redirect-map-export", True, settings.REDIRECT_MAP_EXPORT_LOCK):
+        export_redirect_map_task.delay()
+
+
+@shared_task
+def export_redirect_map_task():
+    # Released before reading the products, so changes made meanwhile queue another export
+    cache.delete("redirect-map-export")
+    result = export_redirect_map()
+    logger.info("Redirect map exported: %s", result)
+
+
+@shared_task
+def rollup_scan_events():
+    # Scheduled by celery beat (CELERY_BEAT_SCHEDULE)
+    rows = rollup_scans()
+    pruned = prune_scan_events()
+    logger.info("Scan rollups: %s rows written, %s old events deleted", rows, pruned)
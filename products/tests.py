@@ -1,8 +1,20 @@
 from rest_framework.test import APITestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
-from .models import Product
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Product, QRAsset, QRTaskStatus
+from inriver_qr.celery import app as celery_app
 from unittest.mock import patch, MagicMock
 import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import timedelta
+from io import BytesIO
 
 class GenerateQRAPITestCase(APITestCase):
     def setUp(self):
@@ -63,16 +75,16 @@ class GenerateQRAPITestCase(APITestCase):
         
         
      # === Новые тесты для get_all_generated_qr_codes ===
+    def get_qr_list(self, params=None):
+        response = self.client.get(self.qr_list_url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
     @patch('products.api_views.s3')  # замените 'your_app.api_views' на реальный путь к функции
     def test_get_all_generated_qr_codes(self, mock_s3):
-        # Подготавливаем фиктивные объекты S3
-        mock_s3.list_objects_v2.return_value = {
-            'Contents': [
-                {'Key': 'qrcodes/34100030.png'},
-                {'Key': 'qrcodes/34100031.eps'},
-                {'Key': 'qrcodes/'},  # папка
-            ]
-        }
+        # Файлы в S3 записаны в таблице QRAsset
+        QRAsset.objects.create(key='qrcodes/34100030.png', format='png', product=self.product1)
+        QRAsset.objects.create(key='qrcodes/34100031.eps', format='eps', product=self.product2)
 
         # Подготовка объекта get_object
         def get_object_side_effect(Bucket, Key):
@@ -81,25 +93,1200 @@ class GenerateQRAPITestCase(APITestCase):
             return mock_obj
 
         mock_s3.get_object.side_effect = get_object_side_effect
+        mock_s3.generate_presigned_url.side_effect = (
+            lambda method, Params, ExpiresIn: f"https://test-bucket.s3.amazonaws.com/{Params['Key']}?signed"
+        )
 
         # Тест без фильтра
-        response = self.client.get(self.qr_list_url)
-        self.assertEqual(response.status_code, 200)
-        data = response.json()
+        data = self.get_qr_list({'inline': 1})
         self.assertEqual(len(data['qr_codes']), 2)  # png и eps
+        self.assertIsNone(data['next_cursor'])
         for item in data['qr_codes']:
             self.assertIn('filename', item)
             self.assertIn('url', item)
             self.assertTrue(base64.b64decode(item['image_base64']))
 
         # Тест фильтрации по png
-        response = self.client.get(self.qr_list_url, {'file_type': 'png'})
-        data = response.json()
+        data = self.get_qr_list({'file_type': 'png', 'inline': 1})
         self.assertEqual(len(data['qr_codes']), 1)
         self.assertTrue(data['qr_codes'][0]['filename'].endswith('.png'))
 
         # Тест фильтрации по eps
-        response = self.client.get(self.qr_list_url, {'file_type': 'eps'})
-        data = response.json()
+        data = self.get_qr_list({'file_type': 'eps', 'inline': 1})
         self.assertEqual(len(data['qr_codes']), 1)
         self.assertTrue(data['qr_codes'][0]['filename'].endswith('.eps'))
+
+        # Без inline файлы не скачиваются, url — presigned
+        mock_s3.get_object.reset_mock()
+        data = self.get_qr_list()
+        self.assertNotIn('image_base64', data['qr_codes'][0])
+        self.assertTrue(data['qr_codes'][0]['url'].endswith('?signed'))
+        mock_s3.get_object.assert_not_called()
+
+    @patch('products.api_views.s3')
+    def test_get_all_generated_qr_codes_pages(self, mock_s3):
+        keys = [f"qrcodes/3410003{i}.png" for i in range(5)]
+        for key in keys:
+            QRAsset.objects.create(key=key, format='png')
+        mock_s3.generate_presigned_url.return_value = "https://signed"
+
+        filenames, cursor = [], None
+        for _ in range(3):
+            data = self.get_qr_list({'page_size': 2, **({'cursor': cursor} if cursor else {})})
+            filenames += [item['filename'] for item in data['qr_codes']]
+            cursor = data['next_cursor']
+        self.assertIsNone(cursor)
+        self.assertEqual(filenames, [key.split('/')[-1] for key in keys])
+
+        response = self.client.get(self.qr_list_url, {'page_size': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class RenderQRBatchTestCase(SimpleTestCase):
+    def test_results_keep_job_order(self):
+        from .qr_batch import render_qr_batch
+        from .qr_utils import render_qr_code, gs1_base_url
+
+        jobs = [(f"871396831660{i}", f"3410003{i}", "example.com") for i in range(4)]
+
+        serial = render_qr_batch(jobs, workers=1)
+        parallel = render_qr_batch(jobs, workers=2)
+
+        self.assertEqual(len(parallel), len(jobs))
+        self.assertEqual(serial, parallel)
+        self.assertEqual(parallel[2], render_qr_code(gs1_base_url("example.com"), jobs[2][0]))
+        for files in parallel:
+            self.assertTrue(files["png"].startswith(b"\x89PNG"))
+            self.assertTrue(files["eps"].startswith(b"%!PS"))
+
+
+class VectorWriterTestCase(SimpleTestCase):
+    matrix = [
+        [True, True, False],
+        [True, True, False],
+        [False, True, True],
+    ]
+
+    def test_adjacent_modules_are_merged(self):
+        from .qr_vector import matrix_rectangles
+
+        self.assertEqual(
+            matrix_rectangles(self.matrix),
+            [(0, 0, 2, 2), (1, 2, 2, 1)],
+        )
+
+    def test_eps_and_svg_are_vector(self):
+        from .qr_vector import matrix_to_eps, matrix_to_svg
+
+        eps = matrix_to_eps(self.matrix, box_size=10).decode()
+        self.assertIn("%%BoundingBox: 0 0 30 30", eps)
+        self.assertIn("0 10 20 20 r", eps)
+        self.assertIn("10 0 20 10 r", eps)
+
+        svg = matrix_to_svg(self.matrix, box_size=10).decode()
+        self.assertIn('viewBox="0 0 30 30"', svg)
+        self.assertIn("M0 0h20v20h-20z", svg)
+
+
+class UnchangedQRSkipTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="34100030", barcode="8713968316602", created_at="2024-01-01",
+            group="Test", show_on_site=True, external_id="85053"
+        )
+
+    @override_settings(QR_RENDER_WORKERS=1, QR_SKIP_VERIFY_REMOTE=True)
+    def test_unchanged_qr_code_is_not_uploaded_again(self):
+        from .qr_batch import iter_generated_qr_codes
+        from .qr_utils import gs1_base_url, qr_content_hash
+
+        qr_hash = qr_content_hash(gs1_base_url("example.com"), self.product.barcode)
+        self.product.qr_hash = qr_hash
+        self.product.qr_code_url = "https://bucket/qrcodes/34100030.png"
+
+        s3 = MagicMock()
+        s3.head_object.return_value = {"Metadata": {"qr-hash": qr_hash}}
+
+        generated = list(iter_generated_qr_codes(s3, [self.product], "example.com", "qrcodes/"))
+        self.assertTrue(generated[0].skipped)
+        self.assertIn("png", generated[0].files)
+        s3.put_object.assert_not_called()
+
+        # a stale object on S3 or force=True renders and uploads again
+        s3.head_object.return_value = {"Metadata": {}}
+        generated = list(iter_generated_qr_codes(s3, [self.product], "example.com", "qrcodes/"))
+        self.assertFalse(generated[0].skipped)
+        generated = list(iter_generated_qr_codes(s3, [self.product], "example.com", "qrcodes/", force=True))
+        self.assertFalse(generated[0].skipped)
+        self.assertEqual(s3.put_object.call_count, 4)
+        self.assertEqual(s3.put_object.call_args.kwargs["Metadata"], {"qr-hash": qr_hash})
+
+
+class RenderVerificationTestCase(SimpleTestCase):
+    job = ("8713968316602", "34100030", "example.com")
+
+    @override_settings(QR_VERIFY_DECODE=True)
+    def test_mismatching_decode_fails_the_item(self):
+        from .qr_batch import render_qr_batch
+
+        with patch("products.qr_batch.decode_qr_image", return_value="https://example.com/01/0000") as decode:
+            self.assertEqual(render_qr_batch([self.job], workers=1), [None])
+        self.assertTrue(decode.call_args.args[0].startswith(b"\x89PNG"))
+
+        with patch("products.qr_batch.decode_qr_image", return_value="https://example.com/01/08713968316602"):
+            self.assertIsNotNone(render_qr_batch([self.job], workers=1)[0])
+
+    def test_payload_is_recorded_without_download(self):
+        from .qr_batch import iter_generated_qr_codes
+
+        product = Product(pk=1, name="34100030", barcode="8713968316602")
+        s3 = MagicMock()
+        with override_settings(QR_RENDER_WORKERS=1):
+            generated = list(iter_generated_qr_codes(s3, [product], "example.com", "qrcodes/"))
+        self.assertEqual(generated[0].payload, "https://example.com/01/08713968316602")
+        s3.get_object.assert_not_called()
+
+
+class LinkCheckTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ok = Product.objects.create(
+            name="34100030", barcode="8713968316602", created_at="2024-01-01",
+            group="Test", external_id="85053", product_url="https://shop.example/ok"
+        )
+        self.broken = Product.objects.create(
+            name="34100031", barcode="8713968316619", created_at="2024-01-01",
+            group="Test", external_id="85063", product_url="https://shop.example/broken"
+        )
+
+    def test_statuses_are_stored_and_cached(self):
+        from .link_check import check_product_links
+
+        statuses = {"https://shop.example/ok": 200, "https://shop.example/broken": 404}
+        with patch("products.link_check.fetch_link_status", side_effect=lambda session, url: statuses[url]) as fetch:
+            result = check_product_links(workers=2)
+            self.assertEqual(result["broken"], 1)
+            self.assertEqual(fetch.call_count, 2)
+
+            # within the TTL nothing is checked again
+            self.assertEqual(check_product_links(workers=2)["checked"], 0)
+
+            # expired rows reuse the statuses cached per URL
+            Product.objects.update(link_checked_at=None)
+            result = check_product_links(workers=2)
+            self.assertEqual((result["cached"], result["fetched"]), (2, 0))
+            self.assertEqual(fetch.call_count, 2)
+
+        self.broken.refresh_from_db()
+        self.assertEqual(self.broken.link_status, 404)
+        self.assertFalse(self.broken.link_ok)
+        self.ok.refresh_from_db()
+        self.assertTrue(self.ok.link_ok)
+
+
+@override_settings(QR_RENDER_WORKERS=1, S3_UPLOAD_WORKERS=4, S3_UPLOAD_WINDOW=2, S3_UPLOAD_BACKOFF=0)
+class ConcurrentUploadTestCase(SimpleTestCase):
+    products = [
+        Product(pk=pk, name=f"3410003{pk}", barcode=f"871396831660{pk}")
+        for pk in range(1, 6)
+    ]
+
+    def test_objects_have_content_type_and_results_keep_order(self):
+        from .qr_batch import iter_generated_qr_codes
+
+        s3 = MagicMock()
+        generated = list(iter_generated_qr_codes(s3, self.products, "example.com", "qrcodes/"))
+
+        self.assertEqual([item.product for item in generated], self.products)
+        self.assertTrue(all(item.files for item in generated))
+        self.assertEqual(s3.put_object.call_count, 10)
+        content_types = {
+            call.kwargs["Key"].rsplit(".", 1)[1]: (call.kwargs["ContentType"], call.kwargs["CacheControl"])
+            for call in s3.put_object.call_args_list
+        }
+        self.assertEqual(content_types["png"][0], "image/png")
+        self.assertEqual(content_types["eps"][0], "application/postscript")
+        self.assertTrue(content_types["png"][1])
+
+    def test_failed_object_is_retried_then_reported(self):
+        from .qr_batch import iter_generated_qr_codes
+
+        s3 = MagicMock()
+        s3.put_object.side_effect = [Exception("reset"), {}, {}]
+        generated = list(iter_generated_qr_codes(s3, self.products[:1], "example.com", "qrcodes/"))
+        self.assertTrue(generated[0].files)
+
+        s3.put_object.side_effect = Exception("denied")
+        generated = list(iter_generated_qr_codes(s3, self.products[:1], "example.com", "qrcodes/"))
+        self.assertIsNone(generated[0].files)
+
+
+def _generate_chunk_in_worker_child(task_id, product_ids):
+    # Body of a Celery prefork child: the task runs in a daemonic billiard process
+    from .tasks import generate_qr_chunk
+
+    generate_qr_chunk(task_id, product_ids, "example.com")
+    return list(Product.objects.filter(qr_hash__isnull=False).order_by("name").values_list("name", flat=True))
+
+
+class BackgroundGenerationTestCase(TestCase):
+    def setUp(self):
+        # run tasks in-process, no broker needed
+        self.addCleanup(celery_app.conf.update, CELERY_TASK_ALWAYS_EAGER=celery_app.conf.task_always_eager)
+        celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_login(self.user)
+        self.products = [
+            Product.objects.create(
+                name=f"3410003{i}", barcode=f"871396831660{i}", created_at="2024-01-01",
+                group="Test", show_on_site=True, external_id=f"8505{i}"
+            )
+            for i in range(3)
+        ]
+
+    @override_settings(QR_RENDER_WORKERS=1, QR_TASK_CHUNK_SIZE=2)
+    @patch("products.tasks.get_s3_client")
+    def test_generate_qr_runs_chunks_and_reports_progress(self, get_s3_client):
+        get_s3_client.return_value.put_object.return_value = {"ETag": '"etag"'}
+        response = self.client.post(reverse("generate_qr"), {
+            "products": [product.id for product in self.products],
+            "domain": "example.com",
+        })
+        task_id = response.json()["task_id"]
+
+        status = QRTaskStatus.objects.get(task_id=task_id)
+        self.assertEqual((status.total, status.processed, status.done), (3, 3, True))
+        self.assertEqual(get_s3_client.return_value.put_object.call_count, 6)
+        self.assertEqual(
+            Product.objects.filter(qr_hash__isnull=False).count(), 3
+        )
+        response = self.client.get(reverse("task_status", args=[task_id]))
+        self.assertEqual(response.json()["progress"], 100)
+
+    @override_settings(QR_RENDER_WORKERS=2, QR_BUNDLE_ENABLED=False)
+    @patch("products.tasks.get_s3_client")
+    def test_chunk_renders_in_a_prefork_worker_child(self, get_s3_client):
+        import billiard
+
+        get_s3_client.return_value.put_object.return_value = {"ETag": '"etag"'}
+        QRTaskStatus.objects.create(task_id="task-1", total=3)
+        with billiard.Pool(1) as pool:
+            generated = pool.apply(_generate_chunk_in_worker_child, ("task-1", [p.id for p in self.products]))
+        self.assertEqual(generated, [product.name for product in self.products])
+
+
+@override_settings(PROGRESS_FLUSH_EVERY=10, PROGRESS_FLUSH_INTERVAL=60, PROGRESS_STREAM_INTERVAL=0.01)
+class ProgressTrackerTestCase(TestCase):
+    def setUp(self):
+        from .progress import start_progress
+
+        cache.clear()
+        QRTaskStatus.objects.create(task_id="task-1", total=25)
+        start_progress("task-1", 25)
+
+    def test_database_writes_are_coalesced(self):
+        from .progress import ProgressTracker, get_progress
+
+        progress = ProgressTracker("task-1")
+        with self.assertNumQueries(2):
+            for _ in range(25):
+                progress.advance()
+        self.assertEqual(get_progress("task-1")["processed"], 25)
+        self.assertEqual(QRTaskStatus.objects.get(task_id="task-1").processed, 20)
+
+        progress.close()
+        status = QRTaskStatus.objects.get(task_id="task-1")
+        self.assertEqual((status.processed, status.done), (25, True))
+        self.assertTrue(get_progress("task-1")["done"])
+
+    def test_stream_pushes_progress_errors_and_done(self):
+        from .progress import ProgressTracker
+
+        progress = ProgressTracker("task-1")
+        progress.advance(5)
+        progress.error("34100030", "QR code could not be generated")
+        progress.advance(20)
+        progress.close()
+
+        response = self.client.get(reverse("task_status_stream", args=["task-1"]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn("event: item-error", body)
+        self.assertIn('"item": "34100030"', body)
+        self.assertIn("event: progress", body)
+        self.assertTrue(body.rstrip().startswith("retry:"))
+        self.assertIn("event: done", body)
+
+    def test_progress_of_another_process_is_read_from_the_database(self):
+        from .progress import get_progress
+
+        # The worker's cache increments never reach a LocMem cache in the web process
+        QRTaskStatus.objects.filter(task_id="task-1").update(processed=10)
+        progress = get_progress("task-1")
+        self.assertEqual((progress["processed"], progress["progress"]), (10, 40))
+
+        QRTaskStatus.objects.filter(task_id="task-1").update(processed=25, done=True)
+        self.assertTrue(get_progress("task-1")["done"])
+
+    @override_settings(PROGRESS_STREAM_MAX_OPEN=0)
+    def test_stream_sends_one_update_when_no_slot_is_free(self):
+        response = self.client.get(reverse("task_status_stream", args=["task-1"]))
+        body = b"".join(response.streaming_content).decode()
+        self.assertTrue(body.startswith("retry: 5000"))
+        self.assertEqual(body.count("event: progress"), 1)
+        self.assertNotIn("event: done", body)
+
+
+@override_settings(QR_BUNDLE_ENABLED=False)
+class DownloadAllQRTestCase(TestCase):
+    @patch("products.views.s3")
+    def test_zip_is_streamed_with_stored_png(self, mock_s3):
+        for key in ["qrcodes/34100030.png", "qrcodes/34100030.eps", "qrcodes/34100031.png"]:
+            QRAsset.objects.create(key=key, format=key.rsplit(".", 1)[1])
+        mock_s3.get_object.side_effect = lambda Bucket, Key: {"Body": BytesIO(Key.encode() * 50)}
+
+        response = self.client.post(reverse("download_all_qr"))
+        self.assertTrue(response.streaming)
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertEqual(
+                archive.namelist(),
+                ["34100030.eps", "34100030.png", "34100031.png"],
+            )
+            self.assertEqual(archive.read("34100031.png"), b"qrcodes/34100031.png" * 50)
+            self.assertEqual(archive.getinfo("34100030.png").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.getinfo("34100030.eps").compress_type, zipfile.ZIP_DEFLATED)
+
+    @patch("products.views.s3")
+    def test_empty_bucket_returns_404(self, mock_s3):
+        response = self.client.post(reverse("download_all_qr"))
+        self.assertEqual(response.status_code, 404)
+
+
+class QRBundleTestCase(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "qr_bundle", "qr_codes.zip")
+        override = override_settings(QR_BUNDLE_PATH=self.path, QR_BUNDLE_S3_KEY="")
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def names(self):
+        with zipfile.ZipFile(self.path) as archive:
+            return sorted(archive.namelist())
+
+    def test_update_without_bundle_does_nothing(self):
+        from .bundle import bundle_status, update_bundle
+
+        update_bundle({"34100030.png": b"png"})
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(bundle_status()["exists"])
+
+    def test_new_entries_are_appended_and_changed_ones_replaced(self):
+        from .bundle import build_bundle, bundle_status, update_bundle
+
+        build_bundle([("34100030.png", b"old"), ("34100030.eps", b"eps")])
+        update_bundle({"34100031.png": b"new"})
+        self.assertEqual(self.names(), ["34100030.eps", "34100030.png", "34100031.png"])
+
+        update_bundle({"34100030.png": b"changed"}, removed=["34100030.eps"])
+        self.assertEqual(self.names(), ["34100030.png", "34100031.png"])
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertEqual(archive.read("34100030.png"), b"changed")
+        self.assertEqual(bundle_status()["entries"], 2)
+
+    def test_archive_is_replaced_not_written_in_place(self):
+        from .bundle import build_bundle, update_bundle
+
+        build_bundle([("34100030.png", b"png")])
+        # an open download keeps reading the archive it started with
+        with open(self.path, "rb") as download:
+            update_bundle({"34100031.png": b"new"})
+            with zipfile.ZipFile(download) as archive:
+                self.assertEqual(archive.namelist(), ["34100030.png"])
+        self.assertEqual(self.names(), ["34100030.png", "34100031.png"])
+
+    def test_staged_batches_are_merged_once(self):
+        from .bundle import build_bundle, merge_staged_entries, stage_bundle_entries, update_bundle
+
+        build_bundle([("34100030.png", b"old"), ("34100030.eps", b"eps")])
+        stage_bundle_entries({"34100030.png": b"changed", "34100031.png": b"new"})
+        stage_bundle_entries({"34100032.png": b"new", "34100032.eps": b"new"})
+        update_bundle(removed=["34100032.eps"])
+        self.assertEqual(self.names(), ["34100030.eps", "34100030.png"])
+
+        with patch("products.bundle.os.replace", wraps=os.replace) as replace:
+            self.assertEqual(merge_staged_entries(), 3)
+        self.assertEqual(replace.call_count, 2)  # archive and state file
+        self.assertEqual(self.names(), ["34100030.eps", "34100030.png", "34100031.png", "34100032.png"])
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertEqual(archive.read("34100030.png"), b"changed")
+        self.assertEqual(merge_staged_entries(), 0)
+
+    @patch("products.views.s3")
+    def test_download_serves_bundle(self, mock_s3):
+        from .bundle import build_bundle
+
+        build_bundle([("34100030.png", b"png")])
+        response = self.client.post(reverse("download_all_qr"))
+        self.assertEqual(response["X-QR-Bundle-Fresh"], "1")
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), ["34100030.png"])
+        mock_s3.get_paginator.assert_not_called()
+
+
+@override_settings(QR_RENDER_WORKERS=1, QR_SKIP_VERIFY_REMOTE=False, QR_BUNDLE_ENABLED=False)
+class QRAssetManifestTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="34100030", barcode="8713968316602", created_at="2024-01-01",
+            group="Test", show_on_site=True, external_id="85053"
+        )
+
+    def test_generation_records_assets_and_skips_unchanged(self):
+        from .generation import generate_and_store_qr_codes
+
+        s3 = MagicMock()
+        s3.put_object.return_value = {"ETag": '"abc"'}
+        generated = list(generate_and_store_qr_codes(s3, [self.product], "example.com"))
+        self.assertFalse(generated[0].skipped)
+
+        assets = {asset.format: asset for asset in QRAsset.objects.all()}
+        self.assertEqual(set(assets), {"png", "eps"})
+        self.assertEqual(assets["png"].key, "qrcodes/34100030.png")
+        self.assertEqual(assets["png"].etag, '"abc"')
+        self.assertEqual(assets["png"].product, self.product)
+        self.assertEqual(assets["png"].payload_hash, generated[0].qr_hash)
+        self.assertEqual(assets["png"].size, len(generated[0].content["png"]))
+
+        # the manifest answers the skip check, no HEAD requests
+        products = Product.objects.filter(pk=self.product.pk)
+        generated = list(generate_and_store_qr_codes(s3, products, "example.com"))
+        self.assertTrue(generated[0].skipped)
+        s3.head_object.assert_not_called()
+
+        QRAsset.objects.filter(format="eps").delete()
+        generated = list(generate_and_store_qr_codes(s3, products, "example.com"))
+        self.assertFalse(generated[0].skipped)
+
+    def test_generation_keeps_hidden_products_hidden(self):
+        from .generation import generate_and_store_qr_codes
+
+        Product.objects.filter(pk=self.product.pk).update(show_on_site=False, group="Archive")
+        s3 = MagicMock()
+        s3.put_object.return_value = {"ETag": '"abc"'}
+        generated = list(generate_and_store_qr_codes(s3, Product.objects.all(), "example.com"))
+
+        self.product.refresh_from_db()
+        self.assertFalse(self.product.show_on_site)
+        self.assertEqual(self.product.group, "Archive")
+        self.assertEqual(str(self.product.created_at), "2024-01-01")
+        self.assertEqual(self.product.qr_hash, generated[0].qr_hash)
+
+    def test_reconcile_rebuilds_manifest_from_listing(self):
+        from .manifest import reconcile_qr_assets
+
+        QRAsset.objects.create(key="qrcodes/34100030.png", format="png", size=10, etag='"old"', payload_hash="h")
+        QRAsset.objects.create(key="qrcodes/gone.png", format="png")
+        s3 = MagicMock()
+        s3.get_paginator.return_value.paginate.return_value = [{"Contents": [
+            {"Key": "qrcodes/"},
+            {"Key": "qrcodes/34100030.png", "Size": 12, "ETag": '"new"'},
+            {"Key": "qrcodes/34100030.eps", "Size": 30, "ETag": '"eps"'},
+        ]}]
+        s3.head_object.return_value = {"Metadata": {"qr-hash": "remote"}}
+
+        result = reconcile_qr_assets(s3, "qrcodes/", verify_hashes=True)
+        self.assertEqual(result, {"created": 1, "updated": 1, "removed": 1})
+        assets = {asset.key: asset for asset in QRAsset.objects.all()}
+        self.assertEqual(set(assets), {"qrcodes/34100030.png", "qrcodes/34100030.eps"})
+        self.assertEqual(assets["qrcodes/34100030.eps"].product, self.product)
+        self.assertEqual(assets["qrcodes/34100030.png"].etag, '"new"')
+        self.assertEqual(assets["qrcodes/34100030.png"].payload_hash, "remote")
+
+
+@override_settings(QR_BUNDLE_ENABLED=False)
+class PurgeQRCodesTestCase(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(
+                name=f"3410003{i}", barcode=f"871396831660{i}", created_at="2024-01-01",
+                group="Test", external_id=f"8505{i}", qr_code_url=f"https://bucket/qrcodes/3410003{i}.png",
+                qr_image_url="https://example.com/01/0", qr_hash="h"
+            )
+            for i in range(3)
+        ]
+        for product in self.products:
+            for ext in ("png", "eps"):
+                QRAsset.objects.create(key=f"qrcodes/{product.name}.{ext}", format=ext, product=product)
+
+        self.s3 = MagicMock()
+        # 2,500 objects over three listing pages
+        keys = [f"qrcodes/{product.name}.{ext}" for product in self.products for ext in ("png", "eps")]
+        keys += [f"qrcodes/old{i:04}.png" for i in range(2494)]
+        self.s3.get_paginator.return_value.paginate.return_value = [
+            {"Contents": [{"Key": key} for key in keys[start:start + 1000]]} for start in range(0, 2500, 1000)
+        ]
+
+        def delete_objects(Bucket, Delete):
+            failing = [obj["Key"] for obj in Delete["Objects"] if obj["Key"] == "qrcodes/34100031.eps"]
+            return {"Errors": [{"Key": key, "Code": "AccessDenied", "Message": "denied"} for key in failing]}
+
+        self.s3.delete_objects.side_effect = delete_objects
+
+    def test_batches_are_deleted_and_only_deleted_products_cleared(self):
+        from .purge import purge_qr_codes
+
+        progress, errors = [], []
+        result = purge_qr_codes(self.s3, "qrcodes/", on_progress=progress.append, on_error=lambda *e: errors.append(e))
+
+        self.assertEqual(result, {"deleted": 2499, "failed": 1, "products": 2})
+        self.assertEqual(sorted(progress), [500, 1000, 1000])
+        self.assertEqual(errors, [("qrcodes/34100031.eps", "AccessDenied: denied")])
+        self.assertTrue(all(len(call.kwargs["Delete"]["Objects"]) <= 1000 for call in self.s3.delete_objects.call_args_list))
+        self.assertEqual(list(QRAsset.objects.values_list("key", flat=True)), ["qrcodes/34100031.eps"])
+
+        cleared = {product.name: product.qr_code_url for product in Product.objects.all()}
+        self.assertIsNone(cleared["34100030"])
+        self.assertIsNotNone(cleared["34100031"])
+
+    def test_format_and_product_filters(self):
+        from .purge import purge_qr_codes
+
+        result = purge_qr_codes(self.s3, "qrcodes/", formats=["eps"], product_ids=[self.products[0].pk])
+        self.assertEqual(result, {"deleted": 1, "failed": 0, "products": 0})
+        self.s3.get_paginator.assert_not_called()
+        self.assertFalse(QRAsset.objects.filter(key="qrcodes/34100030.eps").exists())
+        self.assertEqual(QRAsset.objects.count(), 5)
+
+    def test_view_runs_purge_in_background(self):
+        from django.contrib.auth.models import User
+
+        self.addCleanup(celery_app.conf.update, CELERY_TASK_ALWAYS_EAGER=celery_app.conf.task_always_eager)
+        celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+        self.client.force_login(User.objects.create_user(username='testuser', password='testpass'))
+
+        with patch("products.tasks.get_s3_client", return_value=self.s3):
+            response = self.client.post(reverse("delete_all_qr"), {"format": "png"})
+        task_id = response.json()["task_id"]
+
+        status = QRTaskStatus.objects.get(task_id=task_id)
+        self.assertTrue(status.done)
+        self.assertEqual(status.total, 2497)
+        self.assertFalse(QRAsset.objects.filter(format="png").exists())
+        self.assertFalse(Product.objects.filter(qr_code_url__isnull=False).exists())
+
+    @patch("products.views.start_qr_purge")
+    def test_view_requires_login_and_post(self, start_qr_purge):
+        from django.contrib.auth.models import User
+
+        response = self.client.post(reverse("delete_all_qr"))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("login"), response["Location"])
+
+        self.client.force_login(User.objects.create_user(username='testuser', password='testpass'))
+        self.assertEqual(self.client.get(reverse("delete_all_qr")).status_code, 405)
+        start_qr_purge.assert_not_called()
+
+
+class SyncQRLinksTestCase(TestCase):
+    base_url = "https://bucket.s3.eu-west-1.amazonaws.com/"
+
+    def setUp(self):
+        self.linked = Product.objects.create(
+            name="AB100", barcode="8713968316602", created_at="2024-01-01", group="Test", external_id="1"
+        )
+        self.stale = Product.objects.create(
+            name="AB101", barcode="8713968316619", created_at="2024-01-01", group="Test", external_id="2",
+            qr_code_url="https://bucket/qrcodes/AB101.png", qr_image_url="https://example.com/01/0"
+        )
+        QRAsset.objects.create(key="qrcodes/ab100.png", format="png")
+        QRAsset.objects.create(key="qrcodes/ab100.eps", format="eps")
+        QRAsset.objects.create(key="qrcodes/orphan.png", format="png")
+
+    def test_dry_run_reports_without_writing(self):
+        from .qr_sync import sync_qr_links
+
+        with self.assertNumQueries(2):
+            report = sync_qr_links(MagicMock(), self.base_url, "qrcodes/", dry_run=True, use_manifest=True)
+        self.assertEqual(report["linked"], ["AB100"])
+        self.assertEqual(report["cleared"], ["AB101"])
+        self.assertEqual(report["orphans"], ["qrcodes/orphan.png"])
+        self.linked.refresh_from_db()
+        self.assertIsNone(self.linked.qr_code_url)
+
+    @patch("products.qr_sync.decode_qr_image", return_value="https://example.com/01/08713968316602")
+    def test_changes_are_applied_and_decoding_is_optional(self, decode):
+        from .qr_sync import sync_qr_links
+
+        sync_qr_links(MagicMock(), self.base_url, "qrcodes/", use_manifest=True)
+        decode.assert_not_called()
+        self.linked.refresh_from_db()
+        self.stale.refresh_from_db()
+        self.assertEqual(self.linked.qr_code_url, self.base_url + "qrcodes/ab100.png")
+        self.assertIsNone(self.stale.qr_code_url)
+        self.assertIsNone(self.stale.qr_image_url)
+
+        report = sync_qr_links(MagicMock(), self.base_url, "qrcodes/", decode=True, workers=2, use_manifest=True)
+        self.assertEqual(report["decoded"], ["AB100"])
+        self.assertEqual(report["unchanged"], 2)
+        self.linked.refresh_from_db()
+        self.assertEqual(self.linked.qr_image_url, "https://example.com/01/08713968316602")
+
+    def test_empty_manifest_does_not_clear_links(self):
+        from .qr_sync import sync_qr_links
+
+        QRAsset.objects.all().delete()
+        report = sync_qr_links(MagicMock(), self.base_url, "qrcodes/", use_manifest=True)
+        self.assertTrue(report["no_files"])
+        self.assertEqual(report["cleared"], [])
+        self.stale.refresh_from_db()
+        self.assertEqual(self.stale.qr_code_url, "https://bucket/qrcodes/AB101.png")
+        self.assertEqual(self.stale.qr_image_url, "https://example.com/01/0")
+
+    def test_default_run_lists_the_bucket(self):
+        from .qr_sync import sync_qr_links
+
+        # AB101.png was uploaded outside generation, the manifest does not know it
+        s3 = MagicMock()
+        s3.get_paginator.return_value.paginate.return_value = [
+            {"Contents": [{"Key": "qrcodes/"}, {"Key": "qrcodes/AB101.png"}]},
+            {"Contents": [{"Key": "qrcodes/AB101.eps"}]},
+        ]
+        report = sync_qr_links(s3, self.base_url, "qrcodes/")
+        s3.get_paginator.assert_called_once_with("list_objects_v2")
+        self.assertEqual(report["linked"], ["AB101"])
+        self.assertEqual(report["orphans"], [])
+        self.stale.refresh_from_db()
+        self.assertEqual(self.stale.qr_code_url, self.base_url + "qrcodes/AB101.png")
+        self.linked.refresh_from_db()
+        self.assertIsNone(self.linked.qr_code_url)
+
+
+@override_settings(INRIVER_RATE_LIMIT=0, INRIVER_BACKOFF=0)
+class InRiverClientTestCase(TestCase):
+    def start_server(self, **kwargs):
+        from .fake_inriver import FakeInRiverServer
+
+        entities = {
+            85000 + i: {"ItemCode": f"3410{i:04}", "ItemGTIN": f"87139683{i:05}", "ItemColor": "green"}
+            for i in range(250)
+        }
+        server = FakeInRiverServer(entities, **kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def inriver_client(self, server, **kwargs):
+        from .inriver_client import InRiverClient
+
+        return InRiverClient(server.url, {"X-inRiver-APIKey": "test"}, workers=4, batch_size=100, **kwargs)
+
+    def test_batches_are_fetched_with_fetchdata(self):
+        server = self.start_server()
+        client = self.inriver_client(server)
+        ids = client.query({})
+
+        results = list(client.iter_field_values(ids, ("ItemCode", "ItemGTIN")))
+        self.assertEqual([entity_id for entity_id, _, _ in results], ids)
+        self.assertEqual(results[0][1], [
+            {"fieldTypeId": "ItemCode", "value": "34100000"},
+            {"fieldTypeId": "ItemGTIN", "value": "8713968300000"},
+        ])
+        paths = [path for _, path in server.requests]
+        self.assertEqual(paths.count("/api/v1.0.0/entities:fetchdata"), 3)
+
+    def test_falls_back_to_fieldvalues_and_retries_429(self):
+        server = self.start_server(fetchdata=False, throttle=3)
+        client = self.inriver_client(server)
+
+        results = list(client.iter_field_values([85000, 85001, 99999]))
+        self.assertEqual(results[1][1][0], {"fieldTypeId": "ItemCode", "value": "34100001"})
+        self.assertIsNone(results[2][1])
+        self.assertIn("404", results[2][2])
+        self.assertFalse(client.use_fetchdata)
+
+        server.throttle = 10
+        with self.assertRaises(Exception):
+            self.inriver_client(server, max_retries=2).query({})
+
+    def test_import_creates_only_new_products(self):
+        from .import_pipeline import import_inriver_entities
+
+        server = self.start_server()
+        Product.objects.create(
+            name="34100000", barcode="8713968300000", created_at="2024-01-01", group="inriver", external_id="85000"
+        )
+        progress = []
+        created, updated, skipped = import_inriver_entities(
+            list(range(85000, 85250)), lambda count=1: progress.append(count), client=self.inriver_client(server)
+        )
+        self.assertEqual((created, updated, skipped), (249, 0, 1))
+        self.assertEqual(sum(progress), 250)
+        self.assertEqual(Product.objects.get(external_id="85010").barcode, "8713968300010")
+
+
+@override_settings(INRIVER_RATE_LIMIT=0, INRIVER_BACKOFF=0)
+@override_settings(INRIVER_MIRROR_ENABLED=False)
+class IncrementalInRiverSyncTestCase(TestCase):
+    def setUp(self):
+        from .fake_inriver import FakeInRiverServer
+        from .inriver_client import InRiverClient
+
+        self.addCleanup(celery_app.conf.update, CELERY_TASK_ALWAYS_EAGER=celery_app.conf.task_always_eager)
+        celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+
+        self.server = FakeInRiverServer({
+            85001: {"ItemCode": "34100001", "ItemGTIN": "8713968300001"},
+            85002: {"ItemCode": "34100002", "ItemGTIN": "8713968300002"},
+            85003: {"ItemCode": "34100003", "ItemGTIN": "8713968300003"},
+        }).start()
+        self.addCleanup(self.server.stop)
+        client = InRiverClient(self.server.url, {"X-inRiver-APIKey": "test"}, workers=2)
+        for target in ("products.inriver.get_inriver_client", "products.import_pipeline.get_inriver_client"):
+            patcher = patch(target, return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def sync(self, full=False):
+        from .tasks import start_inriver_import
+
+        return QRTaskStatus.objects.get(task_id=start_inriver_import(full))
+
+    def test_only_changed_entities_are_fetched_and_missing_ones_soft_deleted(self):
+        from .models import InRiverSyncState
+
+        self.assertEqual(self.sync().total, 3)
+        state = InRiverSyncState.objects.get()
+        self.assertIsNotNone(state.last_synced_at)
+        self.assertIsNotNone(state.last_full_sync_at)
+        self.assertEqual(Product.objects.count(), 3)
+
+        self.server.entities[85002]["ItemCode"] = "34100002-B"
+        self.server.modified[85002] = "2999-01-01T00:00:00"
+        del self.server.entities[85003]
+        self.server.entities[85004] = {"ItemCode": "34100004", "ItemGTIN": "8713968300004"}
+
+        status = self.sync()
+        self.assertTrue(status.done)
+        self.assertEqual(status.total, 2)
+        self.assertEqual(Product.objects.get(external_id="85002").name, "34100002-B")
+        self.assertTrue(Product.objects.filter(external_id="85004").exists())
+        removed = Product.objects.get(external_id="85003")
+        self.assertIsNotNone(removed.deleted_at)
+        self.assertFalse(removed.show_on_site)
+
+        # first sync: one query; incremental: collection ids + ids modified since the cursor
+        self.assertEqual(self.server.requests.count(("POST", "/api/v1.0.0/query")), 3)
+
+        self.assertEqual(self.sync(full=True).total, 3)
+
+    def test_entities_that_failed_are_fetched_by_the_next_sync(self):
+        from .import_pipeline import get_inriver_client
+        from .models import InRiverSyncState
+
+        self.sync()
+        client = get_inriver_client()
+        fetch = client.iter_field_values
+
+        def failing(entity_ids, fields):
+            for entity_id, json_data, error in fetch(entity_ids, fields):
+                if str(entity_id) == "85002":
+                    yield entity_id, None, "HTTP 500"
+                else:
+                    yield entity_id, json_data, error
+
+        self.server.entities[85002]["ItemCode"] = "34100002-B"
+        self.server.modified[85002] = "2999-01-01T00:00:00"
+        with patch.object(client, "iter_field_values", failing):
+            self.assertEqual(self.sync().total, 1)
+        self.assertEqual(Product.objects.get(external_id="85002").name, "34100002")
+        self.assertEqual(InRiverSyncState.objects.get().failed_entity_ids, ["85002"])
+
+        # no longer modified since the cursor, fetched because it failed
+        del self.server.modified[85002]
+        self.assertEqual(self.sync().total, 1)
+        self.assertEqual(Product.objects.get(external_id="85002").name, "34100002-B")
+        self.assertEqual(InRiverSyncState.objects.get().failed_entity_ids, [])
+
+
+class BulkUpsertTestCase(TestCase):
+    def test_products_are_written_in_chunks(self):
+        from .upsert import upsert_products
+
+        Product.objects.create(
+            name="old", barcode="8713968300001", created_at="2024-01-01", group="inriver", external_id="85001"
+        )
+        rows = (
+            {"external_id": 85000 + i, "name": f"3410000{i}", "barcode": f"871396830000{i}",
+             "created_at": "2024-02-01", "group": "inriver", "show_on_site": True}
+            for i in range(1, 6)
+        )
+        # one SELECT and one multi-row INSERT per chunk
+        with self.assertNumQueries(6):
+            created, updated = upsert_products(rows, batch_size=2)
+
+        self.assertEqual((created, updated), (4, 1))
+        self.assertEqual(Product.objects.count(), 5)
+        updated_product = Product.objects.get(external_id="85001")
+        self.assertEqual(updated_product.name, "34100001")
+        self.assertTrue(updated_product.show_on_site)
+
+
+@override_settings(INRIVER_RATE_LIMIT=0, BULK_UPSERT_BATCH_SIZE=40, INRIVER_MIRROR_ENABLED=False)
+class ImportPipelineTestCase(TestCase):
+    def test_stages_run_with_small_queues_and_report_timings(self):
+        from .fake_inriver import FakeInRiverServer
+        from .import_pipeline import run_import_pipeline
+        from .inriver_client import InRiverClient
+
+        server = FakeInRiverServer({
+            85000 + i: {"ItemCode": f"3410{i:04}", "BundleGTIN": f"87139683{i:05}"} for i in range(150)
+        }).start()
+        self.addCleanup(server.stop)
+        client = InRiverClient(server.url, {"X-inRiver-APIKey": "test"}, workers=2, batch_size=20)
+
+        errors, progress = [], []
+        result = run_import_pipeline(
+            lambda: client.query({}) + [99999], on_error=lambda *e: errors.append(e), client=client, queue_size=5,
+            on_progress=lambda count: progress.append((count, threading.current_thread())),
+        )
+        # reported from the calling thread, once per stored chunk
+        self.assertEqual(sum(count for count, _ in progress), 151)
+        self.assertEqual({thread for _, thread in progress}, {threading.current_thread()})
+        self.assertEqual((result.created, result.updated, result.skipped), (150, 0, 0))
+        self.assertEqual(list(result.timings), ["query", "fetch", "normalize", "upsert"])
+        self.assertEqual(result.timings["fetch"]["items"], 151)
+        self.assertEqual(result.timings["upsert"]["items"], 4)
+        self.assertEqual(Product.objects.get(external_id="85007").barcode, "8713968300007")
+
+        # a second run skips what exists
+        result = run_import_pipeline(client.query({}), client=client)
+        self.assertEqual((result.created, result.skipped), (0, 150))
+
+    def test_entities_without_name_or_barcode_are_reported_not_stored(self):
+        from .fake_inriver import FakeInRiverServer
+        from .import_pipeline import run_import_pipeline
+        from .inriver_client import InRiverClient
+
+        entities = {85000 + i: {"ItemCode": f"3410{i:04}", "ItemGTIN": f"87139683{i:05}"} for i in range(10)}
+        del entities[85003]["ItemCode"]
+        del entities[85004]["ItemGTIN"]
+        server = FakeInRiverServer(entities).start()
+        self.addCleanup(server.stop)
+        client = InRiverClient(server.url, {"X-inRiver-APIKey": "test"}, workers=2, batch_size=5)
+
+        errors = []
+        result = run_import_pipeline(client.query({}), on_error=lambda *e: errors.append(e), client=client)
+        self.assertEqual(result.created, 8)
+        self.assertEqual(sorted(errors), [("85003", "No ItemCode"), ("85004", "No ItemGTIN or BundleGTIN")])
+        self.assertFalse(Product.objects.filter(external_id__in=["85003", "85004"]).exists())
+
+    def test_stage_threads_stop_when_the_upsert_fails(self):
+        from .fake_inriver import FakeInRiverServer
+        from .import_pipeline import run_import_pipeline
+        from .inriver_client import InRiverClient
+
+        server = FakeInRiverServer({
+            85000 + i: {"ItemCode": f"3410{i:04}", "ItemGTIN": f"87139683{i:05}"} for i in range(100)
+        }).start()
+        self.addCleanup(server.stop)
+        client = InRiverClient(server.url, {"X-inRiver-APIKey": "test"}, workers=2, batch_size=10)
+
+        # the fetch and normalize threads fill their one-item queues and wait on them
+        with patch("products.import_pipeline.upsert_products", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                run_import_pipeline(client.query({}), client=client, queue_size=1)
+        self.assertEqual([t.name for t in threading.enumerate() if t.name.startswith("import-")], [])
+
+
+# The fetch thread reads the mirror on its own connection, which only sees committed rows
+@override_settings(INRIVER_RATE_LIMIT=0, INRIVER_MIRROR_ENABLED=True)
+class InRiverMirrorTestCase(TransactionTestCase):
+    def test_fresh_entities_come_from_the_mirror_and_rebuild_offline(self):
+        from .fake_inriver import FakeInRiverServer
+        from .import_pipeline import run_import_pipeline
+        from .inriver_client import InRiverClient
+        from .inriver_mirror import rebuild_from_mirror
+        from .models import InRiverEntityMirror
+
+        server = FakeInRiverServer({
+            85000 + i: {"ItemCode": f"3410{i:04}", "ItemGTIN": f"87139683{i:05}"} for i in range(10)
+        }).start()
+        self.addCleanup(server.stop)
+        client = InRiverClient(server.url, {"X-inRiver-APIKey": "test"}, workers=2, batch_size=5)
+        entity_ids = client.query({})
+
+        run_import_pipeline(entity_ids, client=client)
+        self.assertEqual(InRiverEntityMirror.objects.count(), 10)
+        requests = len(server.requests)
+
+        InRiverEntityMirror.objects.filter(entity_id="85003").update(stale=True)
+        result = run_import_pipeline(entity_ids, client=client, update_existing=True)
+        self.assertEqual((result.updated, result.mirrored), (10, 9))
+        # only the stale entity was requested again
+        self.assertEqual(len(server.requests), requests + 1)
+        self.assertFalse(InRiverEntityMirror.objects.get(entity_id="85003").stale)
+
+        requests = len(server.requests)
+        Product.objects.all().delete()
+        self.assertEqual(rebuild_from_mirror(), (10, 0))
+        self.assertEqual(Product.objects.get(external_id="85007").barcode, "8713968300007")
+        self.assertEqual(len(server.requests), requests)
+
+
+@override_settings(SCAN_EVENTS_ENABLED=False)
+@patch.dict(os.environ, {"QR_REDIRECT_URL": "https://shop.example.com/p/"})
+class RedirectCacheTestCase(TestCase):
+    def setUp(self):
+        from .redirect_cache import local_cache
+
+        cache.clear()
+        local_cache().clear()
+        self.addCleanup(local_cache().clear)
+        self.product = Product.objects.create(
+            name="34100001", barcode="8713968300001", created_at="2024-01-01", group="inriver", external_id="85001"
+        )
+        self.url = reverse('redirect_by_barcode', args=["08713968300001"])
+
+    def test_warm_scans_skip_the_database(self):
+        from .redirect_cache import local_cache
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertRedirects(response, "https://shop.example.com/p/34100001", fetch_redirect_response=False)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        # another process: its local cache is empty, the shared one answers
+        local_cache().clear()
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('redirect_by_barcode', args=["00000000000000"])).status_code, 404)
+
+    def test_upserts_and_deletes_invalidate(self):
+        from .upsert import upsert_products
+
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            upsert_products([{
+                "external_id": "85001", "name": "34100001-B", "barcode": "8713968300001",
+                "created_at": "2024-01-01", "group": "inriver",
+            }])
+        self.assertEqual(self.client.get(self.url)["Location"], "https://shop.example.com/p/34100001-B")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(external_id="85001").delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@patch.dict(os.environ, {"QR_REDIRECT_URL": "https://shop.example.com/p/"})
+class RedirectMapTestCase(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        settings_override = override_settings(REDIRECT_MAP_DIR=tmp_dir, REDIRECT_MAP_S3_BUCKET="qr-site")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.dir = tmp_dir
+        for i in range(1, 4):
+            Product.objects.create(
+                name=f"3410000{i}", barcode=f"871396830000{i}", created_at="2024-01-01",
+                group="inriver", external_id=f"8500{i}",
+            )
+
+    def test_export_is_written_once_and_then_only_the_changes(self):
+        from .redirect_map import export_redirect_map
+
+        s3 = MagicMock()
+        self.assertEqual(export_redirect_map(s3), {"entries": 3, "changed": 3, "removed": 0, "written": True})
+        with open(os.path.join(self.dir, "qr_redirects.map")) as f:
+            self.assertEqual(f.readline(), '"8713968300001" "https://shop.example.com/p/34100001";\n')
+        with open(os.path.join(self.dir, "qr_redirects.json")) as f:
+            self.assertEqual(json.load(f)["8713968300002"], "https://shop.example.com/p/34100002")
+        with open(os.path.join(self.dir, "qr_redirects.csv")) as f:
+            self.assertEqual(len(f.readlines()), 4)
+        s3.put_object.assert_any_call(
+            Bucket="qr-site", Key="01/08713968300003", Body=b"",
+            WebsiteRedirectLocation="https://shop.example.com/p/34100003", ContentType="text/html",
+        )
+
+        s3.reset_mock()
+        self.assertFalse(export_redirect_map(s3)["written"])
+        s3.put_object.assert_not_called()
+
+        Product.objects.filter(external_id="85001").update(name="34100001-B")
+        Product.objects.filter(external_id="85003").delete()
+        self.assertEqual(export_redirect_map(s3), {"entries": 2, "changed": 1, "removed": 1, "written": True})
+        self.assertEqual(s3.put_object.call_count, 1)
+        s3.delete_objects.assert_called_once_with(
+            Bucket="qr-site", Delete={"Objects": [{"Key": "01/08713968300003"}], "Quiet": True}
+        )
+        self.assertEqual(
+            sorted(os.listdir(self.dir)), [".lock", "qr_redirects.csv", "qr_redirects.json", "qr_redirects.map"]
+        )
+
+
+@override_settings(SCAN_EVENTS_ENABLED=False)
+@patch.dict(os.environ, {"QR_REDIRECT_URL": "https://shop.example.com/p/"})
+class ScanFastLaneTestCase(TestCase):
+    def setUp(self):
+        from .redirect_cache import local_cache
+
+        cache.clear()
+        local_cache().clear()
+        self.addCleanup(local_cache().clear)
+        Product.objects.create(
+            name="34100001", barcode="8713968300001", created_at="2024-01-01", group="inriver", external_id="85001"
+        )
+
+    def scan(self, path):
+        from asgiref.sync import async_to_sync
+        from inriver_qr.asgi import scan_fast_lane
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        handled = async_to_sync(scan_fast_lane)({"type": "http", "method": "GET", "path": path}, None, send)
+        return handled, sent
+
+    def test_known_barcodes_are_redirected_without_django(self):
+        from .redirect_cache import local_cache
+
+        # warm: served from the local LRU, nothing else is touched
+        self.client.get("/01/08713968300001/")
+        local_cache().set("0000000000000", "")
+        with self.assertNumQueries(0):
+            handled, sent = self.scan("/01/08713968300001")
+            self.assertTrue(handled)
+            self.assertEqual(sent[0]["status"], 302)
+            self.assertIn((b"location", b"https://shop.example.com/p/34100001"), sent[0]["headers"])
+
+            # unknown barcodes and other pages are left to Django
+            self.assertEqual(self.scan("/01/00000000000000/"), (False, []))
+            self.assertEqual(self.scan("/products/"), (False, []))
+
+
+class ScanEventsTestCase(TestCase):
+    def test_buffer_drops_instead_of_growing_and_flushes_in_batches(self):
+        from .models import ScanEvent
+        from .scan_events import ScanBuffer
+
+        buffer = ScanBuffer(maxsize=3, batch_size=2, interval=60, start_flusher=False)
+        for _ in range(5):
+            buffer.add(ScanEvent(gtin="08713968300001", scanned_at=timezone.now(), agent="ios"))
+        self.assertEqual(buffer.stats(), {"pending": 3, "written": 0, "dropped": 2})
+
+        with self.assertNumQueries(2):
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(ScanEvent.objects.count(), 3)
+
+        # a failing database loses the batch, the redirect never waits for it
+        buffer.add(ScanEvent(gtin="08713968300001", scanned_at=timezone.now(), agent="ios"))
+        with patch.object(ScanEvent.objects, "bulk_create", side_effect=Exception("db down")):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.stats(), {"pending": 0, "written": 3, "dropped": 3})
+
+    @patch.dict(os.environ, {"QR_REDIRECT_URL": "https://shop.example.com/p/"})
+    def test_scans_are_recorded_and_rolled_up(self):
+        from .models import ScanEvent, ScanRollup
+        from .scan_events import ScanBuffer, agent_class, rollup_scans
+
+        Product.objects.create(
+            name="34100001", barcode="8713968300001", created_at="2024-01-01", group="inriver", external_id="85001"
+        )
+        buffer = ScanBuffer(maxsize=10, batch_size=10, interval=60, start_flusher=False)
+        with patch("products.scan_events.get_scan_buffer", return_value=buffer):
+            self.client.get(
+                "/01/08713968300001/",
+                HTTP_USER_AGENT="Mozilla/5.0 (iPhone; CPU iPhone OS 17_0)", HTTP_CLOUDFRONT_VIEWER_COUNTRY="nl",
+            )
+            self.client.get("/01/00000000000000/")
+        buffer.flush()
+        event = ScanEvent.objects.get()
+        self.assertEqual((event.gtin, event.agent, event.country), ("08713968300001", "ios", "NL"))
+        self.assertEqual(agent_class("Googlebot/2.1"), "bot")
+
+        # all in the first hour of today, within the recomputed window
+        base = timezone.localtime().replace(hour=0, minute=5, second=0, microsecond=0)
+        ScanEvent.objects.update(scanned_at=base)
+        ScanEvent.objects.bulk_create([
+            ScanEvent(gtin="08713968300001", scanned_at=base + timedelta(minutes=1), agent="android", country="NL"),
+            ScanEvent(gtin="08713968300002", scanned_at=base, agent="desktop", country="DE"),
+        ])
+        self.assertEqual(rollup_scans(), 4)
+        daily = ScanRollup.objects.get(period="day", gtin="08713968300001")
+        self.assertEqual(daily.scans, 2)
+        # recomputing replaces the rows
+        rollup_scans()
+        self.assertEqual(ScanRollup.objects.filter(period="hour").count(), 2)
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_user(username='testuser', password='testpass'))
+        for i, name in enumerate(["34100001", "34100002", "AB-34100001"], start=1):
+            Product.objects.create(
+                name=name, barcode=f"871396830000{i}", created_at="2024-01-01", group="inriver", external_id=f"8500{i}"
+            )
+
+    def names(self, search):
+        response = self.client.get(reverse('product_list'), {"name": search})
+        return sorted(product.name for product in response.context["page_obj"])
+
+    def test_prefix_search_covers_item_code_gtin_and_external_id(self):
+        self.assertEqual(self.names("3410000"), ["34100001", "34100002"])
+        self.assertEqual(self.names("08713968300002"), ["34100002"])
+        self.assertEqual(self.names("85003"), ["AB-34100001"])
+        self.assertEqual(self.names("ab-"), ["AB-34100001"])
+
+        with override_settings(PRODUCT_SEARCH_MODE="contains"):
+            self.assertEqual(self.names("34100001"), ["34100001", "AB-34100001"])
+
+    def test_admin_searches_prefixes(self):
+        from django.contrib.admin.sites import site
+
+        model_admin = site._registry[Product]
+        self.assertEqual(model_admin.get_search_fields(None), ("^name", "^barcode", "^external_id"))
+        with override_settings(PRODUCT_SEARCH_MODE="contains"):
+            self.assertIn("group", model_admin.get_search_fields(None))
+
+
+@override_settings(PRODUCT_ROWS_PAGE_SIZE=2)
+class ProductRowsTestCase(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_user(username='testuser', password='testpass'))
+        # two products share a name, the id breaks the tie
+        for i, name in enumerate(["34100003", "34100001", "34100002", "34100002", "34100004"], start=1):
+            Product.objects.create(
+                name=name, barcode=f"871396830000{i}", created_at="2024-01-01", group="inriver", external_id=f"8500{i}"
+            )
+
+    def test_rows_are_paged_by_cursor_without_counting(self):
+        response = self.client.get(reverse('product_list_scroll'))
+        self.assertEqual([p.name for p in response.context["products"]], ["34100001", "34100002"])
+        cursor = response.context["next_cursor"]
+
+        names = []
+        while cursor:
+            with self.assertNumQueries(3):  # session, user, one page
+                data = self.client.get(reverse('product_rows'), {"cursor": cursor}).json()
+            names += [name for name in ["34100002", "34100003", "34100004"] if f"<td>{name}</td>" in data["html"]]
+            cursor = data["next_cursor"]
+        self.assertEqual(names, ["34100002", "34100003", "34100004"])
+
+        self.assertEqual(self.client.get(reverse('product_rows'), {"cursor": "not-a-cursor"}).status_code, 400)
+
+    def test_filters_apply_to_the_rows(self):
+        data = self.client.get(reverse('product_rows'), {"name": "34100004"}).json()
+        self.assertIn("<td>34100004</td>", data["html"])
+        self.assertIsNone(data["next_cursor"])
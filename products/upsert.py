@@ -0,0 +1,62 @@
+# products/upsert.py
+#
+# Multi-row upserts (INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE) for
+# the import and generation paths, instead of one update_or_create round
+# trip per row.
+
+from django.conf import settings
+from django.db import connection
+
+from .batching import chunks
+from .models import Product
+from .redirect_cache import invalidate_redirects
+
+
+def bulk_upsert(model, rows, unique_field, update_fields=None, batch_size=None):
+    """Insert or update rows (dicts of field values) keyed on unique_field.
+
+    Rows are written batch_size at a time: one SELECT for the counts and one
+    multi-row INSERT per chunk. update_fields defaults to every field in the
+    rows except unique_field; when a key repeats within a chunk the last row
+    wins. Returns (created, updated).
+    """
+    batch_size = batch_size or settings.BULK_UPSERT_BATCH_SIZE
+    key_field = model._meta.get_field(unique_field)
+    conflict_args = {}
+    # MySQL has no conflict target, ON DUPLICATE KEY UPDATE applies to every unique key
+    if connection.features.supports_update_conflicts_with_target:
+        conflict_args["unique_fields"] = [unique_field]
+
+    created = updated = 0
+    for chunk in chunks(rows, batch_size):
+        by_key = {key_field.to_python(row[unique_field]): row for row in chunk}
+        existing = set(
+            model.objects.filter(**{f"{unique_field}__in": list(by_key)}).values_list(unique_field, flat=True)
+        )
+        fields = update_fields or sorted({name for row in by_key.values() for name in row} - {unique_field})
+        model.objects.bulk_create(
+            [model(**row) for row in by_key.values()],
+            update_conflicts=True,
+            update_fields=fields,
+            **conflict_args,
+        )
+        updated += len(existing)
+        created += len(by_key) - len(existing)
+    return created, updated
+
+
+def upsert_products(rows, update_fields=None, batch_size=None):
+    """Bulk upsert of product dicts keyed on external_id, returns (created, updated).
+
+    The cached scan redirects of the written barcodes are invalidated.
+    """
+    barcodes = set()
+
+    def collect(rows):
+        for row in rows:
+            barcodes.add(row.get('barcode'))
+            yield row
+
+    result = bulk_upsert(Product, collect(rows), "external_id", update_fields, batch_size)
+    invalidate_redirects(barcodes)
+    return result
@@ -4,12 +4,15 @@ from .views import product_list,  download_all_qr,  download_qr_zip, delete_all_
 from django.contrib.auth import views as auth_views
 
 from .api_views import generate_qr_api, MyEndpoint, get_all_generated_qr_codes
-from .views import redirect_by_barcode,  generate_qr, get_task_status
+from .views import redirect_by_barcode,  generate_qr, get_task_status, task_status_stream
+from .views import product_list_scroll, product_rows
 
 urlpatterns = [
     
  
     path('', product_list, name='product_list'),
+    path('scroll/', product_list_scroll, name='product_list_scroll'),
+    path('product_rows/', product_rows, name='product_rows'),
     path('generate_qr/', generate_qr, name='generate_qr'),
     
     
@@ -20,6 +23,7 @@ urlpatterns = [
     path('delete_all_qr/', delete_all_qr, name='delete_all_qr'),
     
     path('api/task-status/<str:task_id>/', get_task_status, name='task_status'),
+    path('api/task-status/<str:task_id>/stream/', task_status_stream, name='task_status_stream'),
 
     
     
@@ -1,37 +1,39 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib import messages
 from django.shortcuts import redirect
-from .models import Product, QRTaskStatus, ItemCollection
+from .models import Product, QRTaskStatus
 from .filters import ProductFilter
+from .keyset import product_page
 import qrcode
 import tempfile
 import shutil
 
 import os
 from django.conf import settings
-from django.http import HttpResponse, FileResponse, Http404, JsonResponse
+from django.http import HttpResponse, FileResponse, Http404, JsonResponse, StreamingHttpResponse
 import requests
 from PIL import Image
 from io import BytesIO
-import json
 import zipfile
 from django.core.paginator import Paginator
-from datetime import date
 from zipfile import ZipFile
 from django.template.loader import render_to_string
-from .qr_utils import create_and_save_qr_code_eps, extract_qr_data_from_image
+from .tasks import start_bundle_build, start_inriver_import, start_qr_generation, start_qr_purge
+from .bundle import bundle_path, bundle_status, bundle_url
+from .manifest import qr_asset_keys
+from .progress import get_progress, stream_progress
+from .redirect_cache import resolve_redirect
+from .scan_events import record_scan
 from django.contrib.auth import authenticate, login,logout
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
-import uuid
-from .models import QRTaskStatus
 
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-import boto3
-from .inriver import  get_inriver_header
-import uuid
+from .storage import get_s3_client, read_object
+from .zip_stream import prefetch, stream_zip
+import itertools
 
 
 
@@ -45,30 +47,38 @@ AWS_REGION=os.getenv("AWS_REGION")
 
 AWS_URL = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{S3_FOLDER}"
 
-s3 = boto3.client("s3")
+s3 = get_s3_client()
 
 
 
 
 
-@login_required(login_url='login')
-def product_list(request):
-    if not request.user.is_authenticated:
-        return redirect("/")
-
-    # Main queryset
-    queryset = Product.objects.all().order_by('name')
+def _filtered_products(request):
+    """Products of the list and its ProductFilter, from the GET parameters; shared by the list views."""
+    # Main queryset, without products that left the inRiver collections
+    queryset = Product.objects.filter(deleted_at__isnull=True).order_by('name')
 
     # Filter: only products without QR codes
-    show_without_qr = request.GET.get("without_qr") == "1"
-    
-    
-    if show_without_qr:
+    if request.GET.get("without_qr") == "1":
         queryset = queryset.filter(qr_image_url__isnull= True)
 
-    
+    # Filter: only products whose landing page failed the last link check
+    if request.GET.get("broken_links") == "1":
+        queryset = queryset.filter(link_status__isnull=False).exclude(link_status__range=(200, 399))
+
     # Application of filters
     product_filter = ProductFilter(request.GET, queryset=queryset)
+    return queryset, product_filter
+
+
+@login_required(login_url='login')
+def product_list(request):
+    if not request.user.is_authenticated:
+        return redirect("/")
+
+    queryset, product_filter = _filtered_products(request)
+    show_without_qr = request.GET.get("without_qr") == "1"
+    show_broken_links = request.GET.get("broken_links") == "1"
 
     # Pagination
     paginator = Paginator(product_filter.qs, 20)
@@ -87,47 +97,57 @@ def product_list(request):
 
     # Full page render
     return render(request, 'products/product_list.html', {
+        'bundle': bundle_status(),
         'filter': product_filter,
         'page_obj': page_obj,
         'has_qr_codes': has_qr_codes,
         'show_without_qr': show_without_qr,
+        'show_broken_links': show_broken_links,
     })
 
-def redirect_by_barcode(request, barcode):
-    product = get_object_or_404(Product, barcode=barcode[1:])
-    return redirect(f"{os.getenv("QR_REDIRECT_URL")}{product.name}")
+@login_required(login_url='login')
+def product_list_scroll(request):
+    # Infinite scroll version of the list: first page here, the next ones from product_rows
+    _, product_filter = _filtered_products(request)
+    products, next_cursor = product_page(product_filter.qs, page_size=settings.PRODUCT_ROWS_PAGE_SIZE)
+    return render(request, 'products/product_list_infinite scroll.html', {
+        'filter': product_filter,
+        'products': products,
+        'next_cursor': next_cursor,
+    })
 
-def delete_all_qr(request):
 
-        
-    response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=S3_FOLDER)
-    
+@login_required(login_url='login')
+def product_rows(request):
+    """Rendered rows of the page after ?cursor= and the cursor of the next page (keyset pagination)."""
+    _, product_filter = _filtered_products(request)
+    try:
+        products, next_cursor = product_page(
+            product_filter.qs, request.GET.get('cursor'), settings.PRODUCT_ROWS_PAGE_SIZE
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    html = render_to_string('products/includes/product_rows.html', {'products': products}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
 
-    if "Contents" not in response:
-        messages.info(request, "No QR codes were found for deletion.")
-        return redirect('product_list')
-
-    # Creating a list of keys to delete
-    objects_to_delete = [
-        {"Key": obj["Key"]}
-        for obj in response["Contents"]
-        if not obj["Key"].endswith("/")  # skip “folder”
-    ]
-
-    if not objects_to_delete:
-        messages.info(request, "No QR codes were found for deletion.")
-        return redirect('product_list')
-
-    # Delete all objects
-    print("Deleting QR codes from S3...")
-    s3.delete_objects(
-        Bucket=BUCKET_NAME,
-        Delete={"Objects": objects_to_delete}
-    )
-    Product.objects.filter(qr_code_url__isnull=False).update(qr_code_url=None)
-    Product.objects.filter(qr_image_url__isnull=False).update(qr_image_url=None)
-    
-    return redirect('product_list') 
+
+def redirect_by_barcode(request, barcode):
+    # Every consumer scan ends up here; warm lookups are served from the redirect cache
+    target = resolve_redirect(barcode[1:])
+    if target is None:
+        raise Http404("No Product matches the given query.")
+    record_scan(barcode, request.META.get("HTTP_USER_AGENT"), request.headers.get(settings.SCAN_COUNTRY_HEADER))
+    return redirect(target)
+
+@login_required(login_url='login')
+@require_POST
+def delete_all_qr(request):
+    # Files are deleted in background workers, the page follows the task status.
+    # Optional filters: format=png|eps|svg and products=<id> (both repeatable)
+    formats = [ext for ext in request.POST.getlist('format') if ext] or None
+    product_ids = [int(pk) for pk in request.POST.getlist('products') if pk.isdigit()] or None
+    task_id = start_qr_purge(formats, product_ids)
+    return JsonResponse({'task_id': task_id})
 
 
 @csrf_exempt
@@ -151,59 +171,11 @@ def generate_qr(request):
         else:
             products = Product.objects.filter(id__in=selected_ids)
             
-        file_paths = []
- 
-        
-        count = 1 
-        
-        task_id = uuid.uuid4()
-        print(f"🚀 Generating generate_qr_view", task_id)
-
+        force = request.POST.get("force") == "1"
 
-  
-        task_status, _ = QRTaskStatus.objects.get_or_create(task_id=task_id)
-        task_status.total = len(selected_ids) if not select_all else 0
-        task_status.processed = 0
-        task_status.done = False
-        task_status.save()
-        
-        
-
-        for product in products:
-            qr_text = f"{product.name}"
-
-            filename = f"{product.name.replace(' ', '_')}.png"
-            
-            url = f"https://{domain}/01/0"
-            
-            result = create_and_save_qr_code_eps(s3,url, product.name, product.barcode,  S3_FOLDER)
-            if not isinstance(result, dict):
-                continue
-         
-                
-            product, created = Product.objects.update_or_create(
-            external_id=product.external_id,
-            defaults={
-                    'name': product.name,
-                    'barcode': product.barcode,
-                    'created_at': date.today(),
-                    'group': 'inriver',
-                    'show_on_site': True,
-                    'qr_code_url': f"{AWS_URL}{product.name}.png",
-                    'qr_image_url': extract_qr_data_from_image(product.name,AWS_URL),
-                    
-
-                    }
-                )
-
-            file_paths.append((product.id, filename))
-            task_status.processed = count
-            task_status.save(update_fields=["processed"])
-            
-            count += 1
-    
-        task_status.done = True
-        task_status.save(update_fields=["done"])
+        # Generation runs in background workers, the page polls the task status
+        product_ids = list(products.values_list("id", flat=True))
+        task_id = start_qr_generation(product_ids, domain, force)
 
         return JsonResponse({'task_id': task_id})
     
@@ -220,20 +192,19 @@ def download_qr_zip(request, product_id):
     product = get_object_or_404(Product, id=product_id)
 
     # 2️⃣ We shape paths
-    png_key = f"{S3_FOLDER}{product.name}.png"
-    eps_key = f"{S3_FOLDER}{product.name}.eps"
+    keys = [(f"{S3_FOLDER}{product.name}.{ext}", ext) for ext in settings.QR_FORMATS]
 
     # 3️⃣ Checking for files in S3
     try:
-        s3.head_object(Bucket=BUCKET_NAME, Key=png_key)
-        s3.head_object(Bucket=BUCKET_NAME, Key=eps_key)
+        for key, ext in keys:
+            s3.head_object(Bucket=BUCKET_NAME, Key=key)
     except s3.exceptions.ClientError:
         return HttpResponse("No QR codes found for this product.", status=404)
 
     # 4️⃣ Download files to memory and create ZIP
     buffer = BytesIO()
     with ZipFile(buffer, 'w') as zip_file:
-        for key, ext in [(png_key, "png"), (eps_key, "eps")]:
+        for key, ext in keys:
             file_stream = BytesIO()
             s3.download_fileobj(Bucket=BUCKET_NAME, Key=key, Fileobj=file_stream)
             file_stream.seek(0)
@@ -246,59 +217,44 @@ def download_qr_zip(request, product_id):
 
 @csrf_exempt
 def download_all_qr(request):
-    # Buffer for ZIP file
-    zip_buffer = BytesIO()
-
-    with ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-        continuation_token = None
-        total_files = 0
-
-        # S3 returns a maximum of 1,000 objects at a time, so we use pagination.
-        while True:
-            list_kwargs = {
-                "Bucket": BUCKET_NAME,
-                "Prefix": S3_FOLDER,
-                "ContinuationToken": continuation_token,
-            } if continuation_token else {
-                "Bucket": BUCKET_NAME,
-                "Prefix": S3_FOLDER,
-            }
-
-            response = s3.list_objects_v2(**list_kwargs)
-            contents = response.get("Contents", [])
-
-            for obj in contents:
-                key = obj["Key"]
-                # We skip “folder” keys (e.g., qrcodes/).
-                if key.endswith("/"):
-                    continue
-
-                # Uploading the file to memory
-                file_buffer = BytesIO()
-                s3.download_fileobj(BUCKET_NAME, key, file_buffer)
-                file_buffer.seek(0)
-
-                # Add file to ZIP
-                arcname = key[len(S3_FOLDER):]  # name without prefix
-                zipf.writestr(arcname, file_buffer.read())
-                total_files += 1
-
-            # Checking if there are any more pages
-            if response.get("IsTruncated"):
-                continuation_token = response.get("NextContinuationToken")
-            else:
-                break
+    # Serve the pre-built archive, ?live=1 builds the ZIP from S3 instead
+    status = bundle_status()
+    if status["exists"] and request.GET.get("live") != "1":
+        url = bundle_url()
+        if url:
+            response = redirect(url)
+        else:
+            response = FileResponse(
+                open(bundle_path(), "rb"),
+                as_attachment=True,
+                filename="qr_codes.zip",
+                content_type="application/zip",
+            )
+        response["X-QR-Bundle-Updated-At"] = status["updated_at"].isoformat()
+        response["X-QR-Bundle-Fresh"] = "1" if status["fresh"] else "0"
+        return response
+
+    if settings.QR_BUNDLE_ENABLED:
+        # Build the archive in the background so the next download is a single file
+        start_bundle_build()
+
+    # Keys come from the manifest in key order
+    keys = qr_asset_keys()
 
     # If there are no files, return 404.
-    if total_files == 0:
+    first_key = next(keys, None)
+    if first_key is None:
         return HttpResponse("No QR codes found in S3 bucket.", status=404)
 
-    # Preparing a response
-    zip_buffer.seek(0)
-    response = HttpResponse(
-        zip_buffer.getvalue(),
-        content_type="application/zip",
+    # Entries are sent as soon as they are downloaded, the next ones are fetched meanwhile
+    objects = prefetch(
+        itertools.chain([first_key], keys),
+        lambda key: read_object(s3, key),
+        window=settings.ZIP_PREFETCH_OBJECTS,
     )
+    entries = ((key[len(S3_FOLDER):], data) for key, data in objects)
+
+    response = StreamingHttpResponse(stream_zip(entries), content_type="application/zip")
     response["Content-Disposition"] = 'attachment; filename="qr_codes.zip"'
     return response
 
@@ -306,17 +262,18 @@ def download_all_qr(request):
 
 @csrf_exempt
 def get_task_status(request, task_id):
-    try:
-        task = QRTaskStatus.objects.get(task_id=task_id)
-        return JsonResponse({
-            "task_id": task.task_id,
-            "total": task.total,
-            "processed": task.processed,
-            "done": task.done,
-            "progress": task.progress,
-        })
-    except QRTaskStatus.DoesNotExist:
+    progress = get_progress(task_id)
+    if progress is None:
         return JsonResponse({"error": "Task not found"}, status=404)
+    return JsonResponse(progress)
+
+
+def task_status_stream(request, task_id):
+    # Server-sent events: progress and per-item errors are pushed until the task is done
+    response = StreamingHttpResponse(stream_progress(task_id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
     
    
 
@@ -357,126 +314,7 @@ from django.contrib import messages
 from django.shortcuts import redirect
 
 def update_products_from_inriver_old(request):
-    created_count = 0
-    updated_count = 0
-    skipped_count = 0
-    
-    ''' 
-    json_request =  {
-            "systemCriteria": [ ],
-            "dataCriteria": [ {
-                "fieldTypeId": "ItemIndicationWebshop",
-                "value": "1",
-                "operator": "Equal"
-                }
-                             ]
-            }
-            
-    json_request =  {
-        "systemCriteria": [],
-        "dataCriteria": [
-            {
-                "fieldTypeId": "ItemCollection",
-                "value": "AM",
-                "operator": "Equal"
-            } ,
-
-            {
-                "fieldTypeId": "ItemCollection",
-                "value": "FF",
-                "operator": "Equal"
-            } 
-
-        ],
-    "dataCriteriaOperator": "Or"
-
-      
-    }
-	        
-            
-    '''   
-    collections = ItemCollection.objects.values_list('collection', flat=True)
-
-    json_request = {
-        "systemCriteria": [],
-        "dataCriteria": [
-            {
-                "fieldTypeId": "ItemCollection",
-                "value": collection,
-                "operator": "Equal"
-            }
-            for collection in collections
-        ],
-        "dataCriteriaOperator": "Or"
-    }
-
-    try:
-        
-        response = requests.post('{}/api/v1.0.0/query'.format(IN_RIVER_URL),
-                                 headers= get_inriver_header(), data= json.dumps(json_request))
-        
-        response.raise_for_status()
-
-        inriver_data = response.json()  # Ожидается список словарей с полями
-        print("Inriver data received:", len(inriver_data['entityIds']))
-    except Exception as e:
-        print("Begin_",e)
-        messages.error(request, f"Ошибка при подключении к Inriver: {e}")
-        return redirect('product_list')
-    
-    task_id = uuid.uuid4()
-    count = 1  
-    task_status, _ = QRTaskStatus.objects.get_or_create(task_id=task_id)
-    task_status.total = len(inriver_data['entityIds']) 
-    task_status.processed = 0
-    task_status.done = False
-    task_status.save()
-    
-
-    for item in inriver_data['entityIds']:
-        ext_id = item
-        task_status.processed = count
-        task_status.save(update_fields=["processed"])
-        count += 1
-        if Product.objects.filter(external_id=ext_id).exists():
-            skipped_count += 1
-            continue
-        if not ext_id:
-            continue
-        resp_get_linkEntityId = requests.get('{}/api/v1.0.0/entities/{}/fieldvalues'.format(IN_RIVER_URL,int(ext_id)),headers= get_inriver_header())
-        if resp_get_linkEntityId.text != '[]' and resp_get_linkEntityId.status_code == 200:
-            json_data = resp_get_linkEntityId.json()
-            product_name = next((item_["value"] for item_ in json_data if item_["fieldTypeId"] == "ItemCode"), None)
-            
-            product, created = Product.objects.update_or_create(
-                external_id=ext_id,
-                defaults={
-                    'name': product_name,
-                    'barcode': next((item["value"] for item in json_data if item["fieldTypeId"] == "ItemGTIN"), None),
-                    'created_at': date.today(),
-                    'group': 'inriver',
-                    'show_on_site': True,
-                    'product_url' : f"{os.getenv("QR_REDIRECT_URL")}{product_name}",
-                    'product_image_url' : f"https://dhznjqezv3l9q.cloudfront.net/report_Image/normal/{product_name}_01.png"
-                    }
-                )
-        task_status.processed = count
-        task_status.save(update_fields=["processed"])
-        count += 1
-
-        if created:
-            created_count += 1
-        else:
-            updated_count += 1
-            
-    task_status.done = True
-    task_status.save(update_fields=["done"])
-        
-    messages.success(
-        request,
-        f"The update has been finalized: {created_count} added, {updated_count} updated, {skipped_count} missing (duplicates)."
-    )
+    # The import runs in background workers, the page polls the task status.
+    # full=1 fetches every entity instead of the ones changed since the last sync
+    task_id = start_inriver_import(full=request.POST.get('full') == '1')
     return JsonResponse({'task_id': task_id})
-    return redirect('product_list')
-
-
@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 # =========================================================
 # One-command deploy for Django + Docker + Host MySQL
-# (NO Redis, NO Celery)
+# (Redis and the Celery worker run in Docker Compose)
 # =========================================================
 
 set -euo pipefail